@@ -1,9 +1,28 @@
-from flask import Flask, request, send_file, jsonify, render_template, after_this_request
+from flask import Flask, request, send_file, jsonify, render_template, after_this_request, stream_with_context, url_for
+import io
 import os
+import json
 import time
-import threading
-from services.image_generator import generate_offer_poster
+import multiprocessing
+import numpy as np
+from services.image_generator import generate_offer_poster_bytes
+from services.multi_size import parse_sizes, FIT_MODES
 from services.exchange_rate import ExchangeRateService
+from services.rate_history import parse_timestamps
+from services.template_cache import template_cache, normalize_scale
+from services.font_cache import font_registry
+from services.render_cache import render_cache
+from services.image_encoder import negotiate_format, resolve_options, parse_bool, palette_cache
+from services.render_pool import RenderQueueFull
+from services.job_broker import create_broker, JOB_DONE, JOB_FAILED
+from services.job_manager import JobManager
+from services.expiry_scheduler import ExpiryScheduler
+from services.template_registry import template_registry, TemplateNotFound
+from services.poster_service import (
+    RENDER_RETRY_AFTER, get_render_pool, poster_cache_key, poster_request_key,
+    render_poster, generate_batch_zip, run_render_job
+)
+from werkzeug.security import safe_join
 from utils.file_handler import FileHandler
 
 app = Flask(__name__)
@@ -12,48 +31,121 @@ app = Flask(__name__)
 OUTPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "generated_images")
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+# 输出目录的容量上限（字节），超出时删除最久未访问的文件
+OUTPUT_MAX_BYTES = int(os.environ.get('OUTPUT_MAX_BYTES', str(512 * 1024 * 1024)))
+
 # Initialize file handler
-file_handler = FileHandler(OUTPUT_DIR)
+file_handler = FileHandler(OUTPUT_DIR, max_bytes=OUTPUT_MAX_BYTES or None)
 
-# 用于存储待删除的文件及其删除时间
-files_to_delete = {}
+# 海报默认只在内存中生成并直接返回；设置PERSIST_POSTERS=1（或请求中传persist=true）时同时写入磁盘
+PERSIST_POSTERS = os.environ.get('PERSIST_POSTERS', '').lower() in ('1', 'true', 'yes')
+PERSIST_SECONDS = int(os.environ.get('PERSIST_SECONDS', '60'))
+# 磁盘上海报的删除计划索引（SQLite），设为空字符串时只在进程内调度
+EXPIRY_INDEX_PATH = os.environ.get(
+    'EXPIRY_INDEX_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "expiry.db")
+) or None
 
-# 清理线程函数
-def cleanup_thread():
-    """后台线程，定期检查并删除过期的文件"""
-    while True:
-        current_time = time.time()
-        files_to_remove = []
-        
-        # 查找需要删除的文件
-        for file_path, delete_time in files_to_delete.items():
-            if current_time >= delete_time:
-                try:
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
-                        print(f"已删除文件: {file_path}")
-                    files_to_remove.append(file_path)
-                except Exception as e:
-                    print(f"删除文件时出错: {file_path}, 错误: {e}")
-        
-        # 从字典中移除已处理的文件
-        for file_path in files_to_remove:
-            files_to_delete.pop(file_path, None)
-            
-        # 休眠一段时间
-        time.sleep(10)  # 每10秒检查一次
+# 预览图默认缩放比例
+PREVIEW_SCALE = float(os.environ.get('PREVIEW_SCALE', '0.25'))
+
+# 批量生成接口单次最多处理的海报数量
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', '500'))
+
+# 异步渲染任务：任务队列、后台调度线程数（使用独立的render_worker时可设为0）、
+# 最多排队的任务数、结果保留秒数
+JOB_BROKER_URL = os.environ.get('JOB_BROKER_URL', 'memory://')
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', str(max(2, os.cpu_count() or 1))))
+JOB_MAX_PENDING = int(os.environ.get('JOB_MAX_PENDING', '1000'))
+JOB_RESULT_TTL = int(os.environ.get('JOB_RESULT_TTL', '600'))
+
+# 汇率缓存：有效秒数、过期后仍可返回旧值的秒数，以及多个工作进程共用的快照文件
+RATE_CACHE_TTL = float(os.environ.get('RATE_CACHE_TTL', '60'))
+RATE_MAX_STALE = float(os.environ.get('RATE_MAX_STALE', '3600'))
+RATE_SNAPSHOT_PATH = os.environ.get(
+    'RATE_SNAPSHOT_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "exchange_rates.json")
+)
+
+# 汇率上游地址（默认Yahoo Finance），是否一次请求查询所有货币，以及上游拒绝批量查询后多少秒再重试
+EXCHANGE_RATE_URL = os.environ.get('EXCHANGE_RATE_URL')
+EXCHANGE_RATE_BATCH = os.environ.get('EXCHANGE_RATE_BATCH', '1').lower() in ('1', 'true', 'yes')
+EXCHANGE_BATCH_RETRY = float(os.environ.get('EXCHANGE_BATCH_RETRY', '3600'))
+
+# 汇率上游请求的连接/读取超时、获取全部汇率的总时限、对冲请求的等待秒数（不设置则不发对冲请求），
+# 以及断路器连续失败多少次后打开、打开多少秒后重新探测
+EXCHANGE_CONNECT_TIMEOUT = float(os.environ.get('EXCHANGE_CONNECT_TIMEOUT', '2'))
+EXCHANGE_READ_TIMEOUT = float(os.environ.get('EXCHANGE_READ_TIMEOUT', '5'))
+EXCHANGE_DEADLINE = float(os.environ.get('EXCHANGE_DEADLINE', '10'))
+EXCHANGE_HEDGE_AFTER = os.environ.get('EXCHANGE_HEDGE_AFTER')
+EXCHANGE_BREAKER_THRESHOLD = int(os.environ.get('EXCHANGE_BREAKER_THRESHOLD', '5'))
+EXCHANGE_BREAKER_RESET = float(os.environ.get('EXCHANGE_BREAKER_RESET', '30'))
+
+# 汇率历史目录（每次刷新追加一行，供/api/convert按日期换算），以及单次换算的最大行数
+RATE_HISTORY_PATH = os.environ.get(
+    'RATE_HISTORY_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "rate_history")
+)
+CONVERT_MAX_ROWS = int(os.environ.get('CONVERT_MAX_ROWS', '100000'))
+
+# 所有请求共用的汇率服务、海报删除调度器和异步任务管理器，由start_services()创建
+exchange_service = None
+expiry_scheduler = None
+job_manager = None
+
+def start_services():
+    """Create the shared services and start their background threads (repeated calls are no-ops)"""
+    global exchange_service, expiry_scheduler, job_manager
+    if expiry_scheduler is not None:
+        return
+    
+    exchange_service = ExchangeRateService(
+        cache_ttl=RATE_CACHE_TTL,
+        max_stale=RATE_MAX_STALE,
+        snapshot_path=RATE_SNAPSHOT_PATH,
+        base_url=EXCHANGE_RATE_URL,
+        batch=EXCHANGE_RATE_BATCH,
+        batch_retry_after=EXCHANGE_BATCH_RETRY,
+        connect_timeout=EXCHANGE_CONNECT_TIMEOUT,
+        read_timeout=EXCHANGE_READ_TIMEOUT,
+        deadline=EXCHANGE_DEADLINE,
+        hedge_after=float(EXCHANGE_HEDGE_AFTER) if EXCHANGE_HEDGE_AFTER else None,
+        failure_threshold=EXCHANGE_BREAKER_THRESHOLD,
+        reset_timeout=EXCHANGE_BREAKER_RESET,
+        history_path=RATE_HISTORY_PATH
+    )
+    
+    job_manager = JobManager(
+        run_render_job,
+        broker=create_broker(JOB_BROKER_URL),
+        workers=JOB_WORKERS,
+        max_pending=JOB_MAX_PENDING,
+        result_ttl=JOB_RESULT_TTL,
+        retry_after=RENDER_RETRY_AFTER
+    )
+    
+    # 写入磁盘的海报按删除时间排队，删除计划保存在各工作进程共用的索引中；
+    # 到期删除的文件同时从输出目录的容量统计中移除
+    expiry_scheduler = ExpiryScheduler(index_path=EXPIRY_INDEX_PATH, on_remove=file_handler.forget)
+    expiry_scheduler.start()
 
-# 启动清理线程
-cleanup_thread_instance = threading.Thread(target=cleanup_thread, daemon=True)
-cleanup_thread_instance.start()
+# 渲染进程池以spawn方式启动工作进程，python app.py运行时子进程会重新导入本模块（作为__mp_main__），
+# 因此只在服务进程中创建共享服务和后台线程
+if multiprocessing.parent_process() is None:
+    start_services()
 
 # 添加文件到待删除列表
 def schedule_file_deletion(file_path, delay_seconds=60):
     """安排文件在指定延迟后删除"""
-    delete_time = time.time() + delay_seconds
-    files_to_delete[file_path] = delete_time
+    expiry_scheduler.schedule(file_path, delay_seconds)
     print(f"文件 {file_path} 将在 {delay_seconds} 秒后删除")
 
+def _persist_poster(download_name, poster_bytes):
+    """把海报写入输出目录并安排到期删除，返回下载地址"""
+    poster_path = file_handler.write_file(download_name, poster_bytes)
+    schedule_file_deletion(poster_path, PERSIST_SECONDS)
+    return url_for('get_persisted_poster', filename=os.path.basename(poster_path))
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -66,14 +158,12 @@ def form():
 @app.route('/api/exchange-rates', methods=['GET'])
 def get_all_exchange_rates():
     """Get all available exchange rates"""
-    exchange_service = ExchangeRateService()
     rates = exchange_service.get_all_rates()
     return jsonify(rates)
 
 @app.route('/api/exchange-rate/<currency_code>', methods=['GET'])
 def get_exchange_rate(currency_code):
     """Get exchange rate for a specific currency"""
-    exchange_service = ExchangeRateService()
     rate = exchange_service.get_exchange_rate(currency_code)
     
     if rate is None:
@@ -85,6 +175,146 @@ def get_exchange_rate(currency_code):
         "description": exchange_service.currencies.get(currency_code, "Unknown currency")
     })
 
+@app.route('/api/exchange-rates/stats', methods=['GET'])
+def get_exchange_rate_stats():
+    """Get circuit breaker state and upstream latency of the exchange rate service"""
+    return jsonify(exchange_service.stats())
+
+def _conversion_columns(data):
+    """
+    读取换算请求的各列，支持行格式 {"rows": [{"amount", "from", "to", "date"}, ...]}
+    或列格式 {"amount": [...], "from": [...], "to": [...], "date": [...]}
+    """
+    if isinstance(data.get('rows'), list):
+        rows = data['rows']
+        if not all(isinstance(row, dict) for row in rows):
+            raise ValueError("Each row must be an object with amount, from and to")
+        columns = {key: [row.get(key) for row in rows] for key in ('amount', 'from', 'to', 'date')}
+    else:
+        columns = {key: data.get(key) for key in ('amount', 'from', 'to', 'date')}
+        if not isinstance(columns['amount'], list):
+            raise ValueError("Send either rows or amount/from/to (and optional date) arrays")
+        count = len(columns['amount'])
+        for key in ('from', 'to', 'date'):
+            value = columns[key]
+            if value is None or isinstance(value, str):
+                # 单个值适用于所有行
+                columns[key] = [value] * count
+            elif not isinstance(value, list) or len(value) != count:
+                raise ValueError(f"'{key}' must be a string or an array with {count} entries")
+
+    for key in ('from', 'to'):
+        if any(not isinstance(code, str) for code in columns[key]):
+            raise ValueError(f"Every row needs a '{key}' currency code")
+    try:
+        columns['amount'] = np.array(columns['amount'], dtype=np.float64)
+    except (TypeError, ValueError):
+        raise ValueError("Every row needs a numeric 'amount'")
+    return columns
+
+@app.route('/api/convert', methods=['POST'])
+def convert_amounts():
+    """Convert many amounts between currencies in one vectorized pass"""
+    data = request.json or {}
+    try:
+        columns = _conversion_columns(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    count = len(columns['amount'])
+    if count > CONVERT_MAX_ROWS:
+        return jsonify({"error": f"Too many rows: {count} (maximum {CONVERT_MAX_ROWS})"}), 400
+    
+    converted, rates = exchange_service.convert(
+        columns['amount'], columns['from'], columns['to'], parse_timestamps(columns['date'])
+    )
+    failed = np.isnan(converted)
+    return jsonify({
+        "count": count,
+        "failed": int(failed.sum()),
+        # 无法换算（未知货币或该日期之前没有汇率记录）的行为null
+        "converted": np.where(failed, None, converted).tolist(),
+        "rate": np.where(failed, None, rates).tolist()
+    })
+
+def _queue_full_response(error):
+    """渲染队列已满时的503响应"""
+    response = jsonify({"error": "Render queue is full, please retry later", "retry_after": error.retry_after})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+def _send_poster_bytes(data, download_name, etag, info, cache_status, as_attachment=True):
+    """返回内存中的海报，并带上强ETag和编码信息"""
+    response = send_file(
+        io.BytesIO(data),
+        mimetype=info.get('mimetype', 'image/png'),
+        as_attachment=as_attachment,
+        download_name=download_name
+    )
+    response.set_etag(etag)
+    response.vary.add('Accept')
+    response.headers['X-Render-Cache'] = cache_status
+    if 'encode_ms' in info:
+        response.headers['X-Encode-Time-Ms'] = str(info['encode_ms'])
+    if 'render_ms' in info:
+        response.headers['X-Render-Time-Ms'] = str(info['render_ms'])
+    return response
+
+def _get_output_format(data, default_format=None):
+    """
+    从请求中确定输出格式和编码参数（format参数优先，其次default_format，最后Accept请求头）
+    
+    返回:
+        (output_format, encode_options): 格式名称和编码参数，参数不合法时抛出ValueError
+    """
+    output_format = negotiate_format(
+        data.get('format') or request.args.get('format') or default_format,
+        request.accept_mimetypes
+    )
+    requested_options = {
+        key: data.get(key, request.args.get(key))
+        for key in ('compress_level', 'quality', 'lossless', 'method', 'colors', 'dither')
+    }
+    return output_format, resolve_options(output_format, requested_options)
+
+def _parse_poster_options(data, template):
+    """
+    解析请求中的输出格式、编码参数和多尺寸参数（每个尺寸不能超过模板banner的尺寸）
+    
+    返回:
+        (output_format, encode_options, sizes, fit): sizes为None表示只输出原尺寸，参数不合法时抛出ValueError
+    """
+    output_format, encode_options = _get_output_format(data)
+    # 可选：一次渲染导出多个尺寸
+    max_size = (template.width, template.height) if template.width else None
+    sizes = parse_sizes(data['sizes'], max_size=max_size) if data.get('sizes') else None
+    fit = data.get('fit', 'contain')
+    if fit not in FIT_MODES:
+        raise ValueError(f"fit must be one of: {', '.join(FIT_MODES)}")
+    return output_format, encode_options, sizes, fit
+
+def _resolve_template(template_id):
+    """
+    按template_id查找模板（为空时使用默认模板）
+    
+    返回:
+        (template, error_response): 找不到模板时template为None，error_response为错误响应
+    """
+    try:
+        return template_registry.get(template_id or None), None
+    except TemplateNotFound as e:
+        templates = [template.id for template in template_registry.all()]
+        if not templates:
+            return None, (jsonify({"error": "找不到banner图片，请确保assets/images目录中有图片文件"}), 500)
+        return None, (jsonify({"error": e.args[0], "templates": templates}), 400)
+
+@app.route('/api/templates', methods=['GET'])
+def list_templates():
+    """List the available poster templates"""
+    templates = [template.to_dict() for template in template_registry.all()]
+    return jsonify(dict(template_registry.stats(), templates=templates))
+
 @app.route('/api/generate-poster', methods=['POST'])
 def create_poster():
     """Generate an offer poster with the provided information"""
@@ -105,77 +335,309 @@ def create_poster():
             "error": "Missing required parameters. Please provide recipient_name, offer_amount, and team_name."
         }), 400
     
+    # 按template_id选择模板（banner和字体）
+    template, error_response = _resolve_template(data.get('template_id'))
+    if error_response:
+        return error_response
+    
+    try:
+        output_format, encode_options, sizes, fit = _parse_poster_options(data, template)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    # 可选：把海报写入磁盘保留一段时间（"false"、"0"等字符串视为False）
+    persist = parse_bool(data.get('persist', PERSIST_POSTERS))
+    
     try:
-        print(f"Generating poster with: recipient={recipient_name}, amount={offer_amount}, team={team_name}")
+        print(f"Generating poster with: recipient={recipient_name}, amount={offer_amount}, team={team_name}, format={output_format}")
         print(f"Output directory: {OUTPUT_DIR}")
         
-        # 查找assets目录中的banner图片
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        assets_dir = os.path.join(base_dir, "assets")
-        banner_path = None
+        banner_path, font_path, layout = template.banner_path, template.font_path, template.render_layout
+        
+        # 相同参数、模板、字体、排版和格式的海报直接使用缓存结果
+        cache_key = poster_request_key(
+            recipient_name, offer_amount, team_name, team_name2,
+            banner_path, output_format, encode_options, sizes, fit, font_path, layout
+        )
+        
+        # 客户端已有相同内容时返回304
+        if cache_key in request.if_none_match:
+            response = app.response_class(status=304)
+            response.set_etag(cache_key)
+            response.vary.add('Accept')
+            return response
+        
+        result, cache_status = render_poster(
+            cache_key, recipient_name, offer_amount, team_name, team_name2,
+            banner_path, output_format, encode_options, sizes, fit, font_path=font_path, layout=layout
+        )
+        if not result:
+            print("Failed to generate poster: No data returned")
+            return jsonify({"error": "Failed to generate poster"}), 500
+        
+        poster_bytes, download_name, encode_info = result
+        if cache_status == 'MISS':
+            print(f"Generated poster: {download_name} ({len(poster_bytes)} bytes, encoded in {encode_info['encode_ms']} ms)")
+        
+        # Return the file for download
+        response = _send_poster_bytes(poster_bytes, download_name, cache_key, encode_info, cache_status)
+        
+        # 缓存命中的海报同样按persist写入磁盘
+        if persist:
+            response.headers['X-Poster-Url'] = _persist_poster(download_name, poster_bytes)
+        return response
+    
+    except RenderQueueFull as e:
+        print(f"Render queue full, rejecting request: {e}")
+        return _queue_full_response(e)
+    
+    except Exception as e:
+        import traceback
+        print(f"Error generating poster: {str(e)}")
+        print(traceback.format_exc())
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/preview-poster', methods=['GET', 'POST'])
+def preview_poster():
+    """Render a low-resolution preview of an offer poster"""
+    # 支持JSON请求体或查询参数（便于直接作为<img src>使用）
+    data = request.get_json(silent=True) or request.args.to_dict()
+    
+    recipient_name = data.get('recipient_name')
+    offer_amount = data.get('offer_amount')
+    team_name = data.get('team_name')
+    team_name2 = data.get('team_name2', None)
+    
+    if not all([recipient_name, offer_amount, team_name]):
+        return jsonify({
+            "error": "Missing required parameters. Please provide recipient_name, offer_amount, and team_name."
+        }), 400
+    
+    try:
+        # 规整到两位小数后再计算缓存键，相差极小的比例共用同一个缓存条目
+        scale = normalize_scale(data.get('scale', PREVIEW_SCALE))
+        output_format, encode_options = _get_output_format(data, default_format='jpeg')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    try:
+        template, error_response = _resolve_template(data.get('template_id'))
+        if error_response:
+            return error_response
+        banner_path, font_path, layout = template.banner_path, template.font_path, template.render_layout
         
-        # 尝试查找banner图片
-        possible_banner_paths = [
-            os.path.join(assets_dir, "images", "offer_banner.png"),
-            os.path.join(assets_dir, "images", "banner.png"),
-            # 添加其他可能的路径
-        ]
+        cache_key = poster_cache_key(
+            recipient_name, offer_amount, team_name, team_name2,
+            banner_path, output_format, encode_options, font_path, layout, scale=scale
+        )
         
-        for path in possible_banner_paths:
-            if os.path.exists(path):
-                banner_path = path
-                print(f"找到banner图片: {banner_path}")
-                break
-                
-        if not banner_path:
-            # 如果找不到banner图片，搜索assets目录下的所有图片
-            for root, dirs, files in os.walk(assets_dir):
-                for file in files:
-                    if file.endswith(('.png', '.jpg', '.jpeg')):
-                        banner_path = os.path.join(root, file)
-                        print(f"使用找到的图片作为banner: {banner_path}")
-                        break
-                if banner_path:
-                    break
+        if cache_key in request.if_none_match:
+            response = app.response_class(status=304)
+            response.set_etag(cache_key)
+            response.vary.add('Accept')
+            return response
         
-        if not banner_path:
-            return jsonify({"error": "找不到banner图片，请确保assets/images目录中有图片文件"}), 500
+        cached = render_cache.get(cache_key)
+        if cached is not None:
+            return _send_poster_bytes(cached[0], cached[1], cache_key, cached[2], 'HIT', as_attachment=False)
         
-        # Generate the poster
-        poster_path = generate_offer_poster(
+        # 预览图渲染很快，直接在请求线程中完成，不占用完整渲染的进程池
+        start_time = time.perf_counter()
+        result = generate_offer_poster_bytes(
             recipient_name=recipient_name,
             offer_amount=offer_amount,
             team_name=team_name,
             team_name2=team_name2,
             banner_path=banner_path,
-            output_dir=OUTPUT_DIR,
-            font_path=None,
-            save_interim=False
+            font_path=font_path,
+            layout=layout,
+            output_format=output_format,
+            encode_options=encode_options,
+            scale=scale
         )
+        if not result:
+            return jsonify({"error": "Failed to generate preview"}), 500
         
-        print(f"Generated poster path: {poster_path}")
-        
-        if not poster_path:
-            print("Failed to generate poster: No path returned")
-            return jsonify({"error": "Failed to generate poster"}), 500
+        preview_bytes, download_name, encode_info = result
+        encode_info = dict(encode_info, render_ms=round((time.perf_counter() - start_time) * 1000, 2))
+        render_cache.put(cache_key, preview_bytes, download_name, encode_info)
         
-        # 确保文件存在
-        if not os.path.exists(poster_path):
-            print(f"Generated file does not exist: {poster_path}")
-            return jsonify({"error": f"Generated file not found: {poster_path}"}), 500
-        
-        # 安排文件在下载后删除（60秒后）
-        schedule_file_deletion(poster_path, 60)
-        
-        # Return the file for download
-        return send_file(poster_path, as_attachment=True)
+        return _send_poster_bytes(preview_bytes, download_name, cache_key, encode_info, 'MISS', as_attachment=False)
     
     except Exception as e:
         import traceback
-        print(f"Error generating poster: {str(e)}")
+        print(f"Error generating preview: {str(e)}")
         print(traceback.format_exc())
         return jsonify({"error": str(e)}), 500
 
+def _parse_batch_items(body):
+    """
+    解析批量请求体，支持JSON数组或JSONL（每行一个JSON对象）
+    
+    返回:
+        list: [(item, error), ...]，无法解析的行以error记录，不影响其他条目
+    """
+    text = body.strip()
+    if not text:
+        raise ValueError("Request body is empty. Send a JSON array or JSONL of poster requests.")
+    
+    if text.startswith('['):
+        try:
+            items = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON array: {e}")
+        return [(item, None) for item in items]
+    
+    parsed = []
+    for line_number, line in enumerate(text.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            parsed.append((json.loads(line), None))
+        except json.JSONDecodeError as e:
+            parsed.append((None, f"Invalid JSON on line {line_number}: {e}"))
+    return parsed
+
+@app.route('/api/generate-posters', methods=['POST'])
+def create_posters():
+    """Generate a batch of offer posters and stream them back as a ZIP archive"""
+    try:
+        items = _parse_batch_items(request.get_data(as_text=True))
+        output_format, encode_options = _get_output_format({})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({"error": f"Too many items: {len(items)} (maximum {BATCH_MAX_ITEMS})"}), 400
+    
+    # 请求体是海报列表，模板通过查询参数选择
+    template, error_response = _resolve_template(request.args.get('template_id'))
+    if error_response:
+        return error_response
+    
+    print(f"Batch request: {len(items)} posters, format={output_format}, template={template.id}")
+    
+    response = app.response_class(
+        stream_with_context(generate_batch_zip(
+            items, template.banner_path, output_format, encode_options, template.font_path,
+            template.render_layout
+        )),
+        mimetype='application/zip'
+    )
+    response.headers['Content-Disposition'] = f'attachment; filename="posters_{time.strftime("%Y%m%d_%H%M%S")}.zip"'
+    return response
+
+def _job_response(job, status_code=200):
+    """任务状态的JSON响应，附带状态和结果的URL"""
+    job_data = job.to_dict()
+    job_data["status_url"] = url_for('get_job', job_id=job.id)
+    if job.status == JOB_DONE:
+        job_data["result_url"] = url_for('get_job_result', job_id=job.id)
+    response = jsonify(job_data)
+    response.status_code = status_code
+    return response
+
+@app.route('/api/jobs', methods=['POST'])
+def create_job():
+    """Queue a poster (or a batch of posters) for rendering and return a job id immediately"""
+    data = request.get_json(silent=True) or {}
+    
+    callback_url = data.get('callback_url')
+    if callback_url and not str(callback_url).startswith(('http://', 'https://')):
+        return jsonify({"error": "callback_url must be an http(s) URL"}), 400
+    
+    template, error_response = _resolve_template(data.get('template_id'))
+    if error_response:
+        return error_response
+    banner_path, font_path, layout = template.banner_path, template.font_path, template.render_layout
+    
+    try:
+        if 'items' in data:
+            # 批量任务：结果为包含manifest.json的ZIP
+            items = data['items']
+            if not isinstance(items, list) or not items:
+                raise ValueError("items must be a non-empty list of poster requests")
+            if len(items) > BATCH_MAX_ITEMS:
+                raise ValueError(f"Too many items: {len(items)} (maximum {BATCH_MAX_ITEMS})")
+            output_format, encode_options = _get_output_format(data)
+            job_type = 'batch'
+            payload = {
+                "items": [(item, None) for item in items],
+                "banner_path": banner_path,
+                "font_path": font_path,
+                "layout": layout,
+                "output_format": output_format,
+                "encode_options": encode_options
+            }
+        else:
+            recipient_name = data.get('recipient_name')
+            offer_amount = data.get('offer_amount')
+            team_name = data.get('team_name')
+            team_name2 = data.get('team_name2', None)
+            if not all([recipient_name, offer_amount, team_name]):
+                raise ValueError("Missing required parameters. Please provide recipient_name, offer_amount, and team_name.")
+            output_format, encode_options, sizes, fit = _parse_poster_options(data, template)
+            job_type = 'poster'
+            payload = {
+                "cache_key": poster_request_key(
+                    recipient_name, offer_amount, team_name, team_name2,
+                    banner_path, output_format, encode_options, sizes, fit, font_path, layout
+                ),
+                "recipient_name": recipient_name,
+                "offer_amount": offer_amount,
+                "team_name": team_name,
+                "team_name2": team_name2,
+                "banner_path": banner_path,
+                "font_path": font_path,
+                "layout": layout,
+                "output_format": output_format,
+                "encode_options": encode_options,
+                "sizes": sizes,
+                "fit": fit
+            }
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    try:
+        job = job_manager.submit(job_type, payload, callback_url=callback_url)
+    except RenderQueueFull as e:
+        return _queue_full_response(e)
+    
+    print(f"Queued {job_type} job {job.id}")
+    response = _job_response(job, 202)
+    response.headers['Location'] = url_for('get_job', job_id=job.id)
+    return response
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Get the status of a render job"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Job {job_id} not found or expired"}), 404
+    return _job_response(job)
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    """Download the result of a finished render job"""
+    job = job_manager.get(job_id, with_result=True)
+    if job is None:
+        return jsonify({"error": f"Job {job_id} not found or expired"}), 404
+    if job.status != JOB_DONE:
+        response = _job_response(job, 409)
+        if job.status != JOB_FAILED:
+            response.headers['Retry-After'] = str(RENDER_RETRY_AFTER)
+        return response
+    
+    if job.etag in request.if_none_match:
+        response = app.response_class(status=304)
+        response.set_etag(job.etag)
+        return response
+    return _send_poster_bytes(job.data, job.filename, job.etag, job.info, 'JOB')
+
+@app.route('/api/jobs', methods=['GET'])
+def get_job_stats():
+    """Get statistics of the render job queue"""
+    return jsonify(job_manager.stats())
+
 @app.route('/api/cleanup', methods=['POST'])
 def cleanup_old_files():
     """Clean up old generated files"""
@@ -190,11 +652,64 @@ def cleanup_old_files():
         return jsonify({
             "success": True,
             "deleted_count": deleted_count,
-            "message": message
+            "message": message,
+            "scheduled_deletions": expiry_scheduler.stats()
         })
     
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/posters/<path:filename>', methods=['GET'])
+def get_persisted_poster(filename):
+    """Download a poster persisted with persist=true until it expires"""
+    poster_path = safe_join(OUTPUT_DIR, filename)
+    if poster_path is None or not os.path.isfile(poster_path):
+        return jsonify({"error": f"Poster not found: {filename}"}), 404
+    # 读取也算一次访问，输出目录超出容量时最后才淘汰
+    file_handler.touch(poster_path)
+    return send_file(poster_path, as_attachment=True, download_name=os.path.basename(poster_path))
+
+@app.route('/api/output-cache', methods=['GET'])
+def get_output_cache_stats():
+    """Get disk usage and evictions of the generated images directory"""
+    return jsonify(file_handler.stats())
+
+@app.route('/api/cache-stats', methods=['GET'])
+def get_cache_stats():
+    """Get statistics of the in-process render caches"""
+    return jsonify({
+        "template_cache": template_cache.stats(),
+        "font_cache": font_registry.stats(),
+        "render_cache": render_cache.stats(),
+        "palette_cache": palette_cache.stats(),
+        "exchange_rates": exchange_service.cache.stats()
+    })
+
+@app.route('/api/render-pool', methods=['GET'])
+def get_render_pool_stats():
+    """Get statistics of the render process pool"""
+    return jsonify(get_render_pool().stats())
+
+@app.route('/api/cache/invalidate', methods=['POST'])
+def invalidate_caches():
+    """Invalidate cached banner templates"""
+    data = request.json or {}
+    removed = template_cache.invalidate(data.get('banner_path'))
+    if data.get('fonts'):
+        removed += font_registry.clear()
+    if data.get('renders'):
+        removed += render_cache.clear()
+    if data.get('palettes'):
+        removed += palette_cache.clear()
+    if data.get('rates'):
+        removed += exchange_service.cache.clear()
+    return jsonify({
+        "success": True,
+        "removed": removed
+    })
+
 if __name__ == '__main__':
+    # 调试模式下只在实际处理请求的子进程中预热进程池，而不是在重载监视进程中
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        get_render_pool()
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
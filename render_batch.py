@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+"""
+Offline batch renderer for offer posters
+
+Reads poster requests from a CSV or JSONL file and renders them on a
+multiprocessing pool, without going through the Flask app:
+
+    python render_batch.py posters.jsonl --output-dir rendered --format png
+
+Each row needs recipient_name, offer_amount and team_name (team_name2 and id are
+optional). Output names are derived from the row id (or row number) and a hash of
+the rendering inputs, so rerunning the same file produces the same names. Progress
+is appended to a checkpoint file; an interrupted run resumes where it stopped.
+"""
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import contextlib
+import multiprocessing
+from services.render_pool import preload_worker
+from services.render_cache import RenderCache
+from services.image_encoder import FORMATS, normalize_format, resolve_options, format_key
+from services.image_generator import render_offer_poster, DEFAULT_FONT_PATH
+from services.layout_plan import load_layout_plan, LayoutError
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BANNER_PATH = os.path.join(BASE_DIR, "assets", "images", "offer_banner.png")
+REQUIRED_FIELDS = ("recipient_name", "offer_amount", "team_name")
+STAGES = ("render", "encode", "write")
+
+
+def read_rows(input_path):
+    """Read poster requests from a CSV or JSONL file"""
+    rows = []
+    with open(input_path, newline='', encoding='utf-8') as f:
+        if input_path.lower().endswith('.csv'):
+            for row in csv.DictReader(f):
+                rows.append({key: value for key, value in row.items() if value not in (None, '')})
+        else:
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    rows.append(json.loads(line))
+                except json.JSONDecodeError as e:
+                    raise ValueError(f"Invalid JSON on line {line_number}: {e}")
+    return rows
+
+
+def output_name(index, row, banner_path, font_path, output_format, encode_options, extension, layout=None):
+    """Deterministic output file name for a row"""
+    params = {field: row.get(field) for field in REQUIRED_FIELDS + ("team_name2",)}
+    digest = RenderCache.make_key(params, banner_path, font_path, format_key(output_format, encode_options), layout)
+    prefix = str(row.get('id', f"{index:05d}"))
+    prefix = "".join(c if c.isalnum() or c in "-_" else "_" for c in prefix)
+    return f"{prefix}_{digest[:12]}.{extension}"
+
+
+def load_checkpoint(checkpoint_path):
+    """Return the output names already rendered according to the checkpoint file"""
+    done = set()
+    if not os.path.exists(checkpoint_path):
+        return done
+    with open(checkpoint_path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # a line cut short by an interrupted run
+            if record.get("status") == "ok":
+                done.add(record["file"])
+    return done
+
+
+def init_worker(banner_path, font_path, layout, verbose):
+    """Pool initializer: preload the template, fonts and layout once per process"""
+    if not verbose:
+        # the render functions log every step; keep the progress output readable
+        sys.stdout = open(os.devnull, 'w')
+    preload_worker([banner_path], font_path, layouts=[(layout, font_path)])
+
+
+def render_row(task):
+    """Render, encode and write one poster (runs in a pool worker)"""
+    index, row, filename, options = task
+    timings = {}
+    try:
+        start = time.perf_counter()
+        editor, _ = render_offer_poster(
+            recipient_name=row['recipient_name'],
+            offer_amount=row['offer_amount'],
+            team_name=row['team_name'],
+            team_name2=row.get('team_name2', ''),
+            banner_path=options['banner_path'],
+            font_path=options['font_path'],
+            layout=options['layout']
+        )
+        timings["render"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        data, _ = editor.encode(options['output_format'], options['encode_options'])
+        timings["encode"] = time.perf_counter() - start
+
+        # write to a temporary name first so an interrupted run never leaves a partial file
+        start = time.perf_counter()
+        output_path = os.path.join(options['output_dir'], filename)
+        temp_path = output_path + ".tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, output_path)
+        timings["write"] = time.perf_counter() - start
+
+        return {"index": index, "id": row.get('id'), "file": filename, "status": "ok",
+                "bytes": len(data), "timings": timings}
+    except Exception as e:
+        return {"index": index, "id": row.get('id'), "file": filename, "status": "error",
+                "error": str(e), "timings": timings}
+
+
+def print_summary(results, skipped, failed, elapsed, read_seconds):
+    """Print throughput and per-stage timings"""
+    rendered = len(results) - failed
+    print(f"\nRendered {rendered} posters, {failed} failed, {skipped} skipped (already done)")
+    print(f"Elapsed: {elapsed:.2f}s, throughput: {rendered / elapsed if elapsed else 0:.2f} posters/sec")
+    print(f"  read input: {read_seconds * 1000:.1f} ms")
+    for stage in STAGES:
+        values = sorted(result["timings"][stage] for result in results if stage in result["timings"])
+        if not values:
+            continue
+        mean = sum(values) / len(values)
+        p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+        print(f"  {stage:<7} mean {mean * 1000:8.1f} ms   p95 {p95 * 1000:8.1f} ms   "
+              f"total {sum(values):8.2f} s")
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description="Render offer posters in bulk from a CSV or JSONL file")
+    parser.add_argument("input", help="CSV or JSONL file with one poster request per row")
+    parser.add_argument("--output-dir", default="rendered_posters", help="Directory for the rendered posters")
+    parser.add_argument("--checkpoint", default=None,
+                        help="Checkpoint file (default: <output-dir>/checkpoint.jsonl)")
+    parser.add_argument("--template", default=None,
+                        help="Template id from assets/templates (sets the banner, font and layout)")
+    parser.add_argument("--banner", default=DEFAULT_BANNER_PATH, help="Banner template image")
+    parser.add_argument("--font", default=DEFAULT_FONT_PATH, help="Font file")
+    parser.add_argument("--layout", default=None,
+                        help="Layout spec (JSON) for the text slots, default: the offer_banner layout")
+    parser.add_argument("--format", default="png", help="Output format: png, webp or jpeg")
+    parser.add_argument("--quality", type=int, default=None, help="Quality for webp/jpeg")
+    parser.add_argument("--compress-level", type=int, default=None, help="PNG compression level (0-9)")
+    parser.add_argument("--colors", type=int, default=None, help="Palette size for quantized PNG")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Number of worker processes")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and render everything")
+    parser.add_argument("--verbose", action="store_true", help="Show the renderer's log output")
+
+    args = parser.parse_args()
+
+    output_format = normalize_format(args.format)
+    if output_format is None:
+        parser.error(f"Unsupported format: {args.format}")
+    try:
+        encode_options = resolve_options(output_format, {
+            "quality": args.quality,
+            "compress_level": args.compress_level,
+            "colors": args.colors,
+        })
+    except ValueError as e:
+        parser.error(str(e))
+    if args.template:
+        from services.template_registry import template_registry, TemplateNotFound
+        try:
+            template = template_registry.get(args.template)
+        except TemplateNotFound as e:
+            parser.error(e.args[0])
+        args.banner, args.font = template.banner_path, template.font_path
+        args.layout = args.layout or template.render_layout
+    if not os.path.exists(args.banner):
+        parser.error(f"Banner image not found: {args.banner}")
+    try:
+        # compile the layout once up front so a broken spec fails before any row is rendered
+        load_layout_plan(args.layout, args.font)
+    except (OSError, LayoutError) as e:
+        parser.error(f"Invalid layout: {e}")
+
+    start_time = time.perf_counter()
+    rows = read_rows(args.input)
+    read_seconds = time.perf_counter() - start_time
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    checkpoint_path = args.checkpoint or os.path.join(args.output_dir, "checkpoint.jsonl")
+    if args.restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    done = load_checkpoint(checkpoint_path)
+
+    options = {
+        "banner_path": args.banner,
+        "font_path": args.font,
+        "layout": args.layout,
+        "output_format": output_format,
+        "encode_options": encode_options,
+        "output_dir": args.output_dir,
+    }
+    extension = FORMATS[output_format]["extension"]
+
+    tasks = []
+    invalid = []
+    skipped = 0
+    for index, row in enumerate(rows):
+        missing = [field for field in REQUIRED_FIELDS if not row.get(field)]
+        if missing:
+            invalid.append({"index": index, "id": row.get('id'), "status": "error",
+                            "error": f"Missing required fields: {', '.join(missing)}", "timings": {}})
+            continue
+        filename = output_name(index, row, args.banner, args.font, output_format, encode_options, extension,
+                               args.layout)
+        if filename in done and os.path.exists(os.path.join(args.output_dir, filename)):
+            skipped += 1
+            continue
+        tasks.append((index, row, filename, options))
+
+    print(f"{len(rows)} rows: {len(tasks)} to render, {skipped} already done, {len(invalid)} invalid "
+          f"({args.workers} workers, format={output_format})")
+
+    results = list(invalid)
+    for result in invalid:
+        print(f"  row {result['index']}: {result['error']}")
+
+    render_start = time.perf_counter()
+    with open(checkpoint_path, 'a', encoding='utf-8') as checkpoint:
+        def record(result):
+            results.append(result)
+            entry = {key: result.get(key) for key in ("index", "id", "file", "status", "error")}
+            checkpoint.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            checkpoint.flush()
+            if result["status"] != "ok":
+                print(f"  row {result['index']}: {result['error']}")
+            completed = len(results) - len(invalid)
+            if completed % 50 == 0 or completed == len(tasks):
+                rate = completed / (time.perf_counter() - render_start)
+                print(f"  {completed}/{len(tasks)} rendered ({rate:.2f} posters/sec)")
+
+        if args.workers <= 1:
+            # render in this process, silencing the renderer's log unless --verbose
+            preload_worker([args.banner], args.font, layouts=[(args.layout, args.font)])
+            with open(os.devnull, 'w') as devnull:
+                for task in tasks:
+                    with contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+                        result = render_row(task)
+                    record(result)
+        else:
+            with multiprocessing.Pool(args.workers, initializer=init_worker,
+                                      initargs=(args.banner, args.font, args.layout, args.verbose)) as pool:
+                for result in pool.imap_unordered(render_row, tasks):
+                    record(result)
+
+    failed = sum(1 for result in results if result["status"] != "ok")
+    print_summary(results, skipped, failed, time.perf_counter() - render_start, read_seconds)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
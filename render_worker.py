@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""
+Render worker for the asynchronous job API
+
+Consumes render jobs from a shared job broker and stores the results back in it,
+so rendering can be scaled out independently of the web tier:
+
+    JOB_BROKER_URL=sqlite:///data/jobs.db JOB_WORKERS=0 gunicorn app:app   # web tier only enqueues
+    python render_worker.py --broker sqlite:///data/jobs.db                # start as many as needed
+
+Each worker renders on its own pre-warmed process pool (see RENDER_POOL_WORKERS).
+"""
+import os
+import time
+import argparse
+from services.job_broker import create_broker
+from services.job_manager import JobManager
+from services.poster_service import get_render_pool, run_render_job
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description="Consume render jobs from a job broker")
+    parser.add_argument("--broker", default=os.environ.get('JOB_BROKER_URL'),
+                        help="Job broker URL, e.g. sqlite:///data/jobs.db (default: $JOB_BROKER_URL)")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="Jobs claimed at a time (default: number of render processes)")
+    parser.add_argument("--result-ttl", type=int, default=int(os.environ.get('JOB_RESULT_TTL', '600')),
+                        help="Seconds to keep finished jobs before purging them")
+    parser.add_argument("--stats-interval", type=int, default=60, help="Seconds between progress reports")
+    parser.add_argument("--name", default=None, help="Worker name recorded on claimed jobs")
+
+    args = parser.parse_args()
+
+    if not args.broker or args.broker.startswith("memory://"):
+        parser.error("A shared broker is required, e.g. --broker sqlite:///data/jobs.db")
+    try:
+        broker = create_broker(args.broker)
+    except ValueError as e:
+        parser.error(str(e))
+
+    # start the render processes before claiming the first job
+    pool = get_render_pool()
+    manager = JobManager(
+        run_render_job,
+        broker=broker,
+        workers=args.threads or max(1, pool.workers),
+        result_ttl=args.result_ttl,
+        name=args.name
+    )
+    manager.start()
+    print(f"Render worker {manager.name} consuming {args.broker} with {manager.workers} threads")
+
+    try:
+        while True:
+            time.sleep(args.stats_interval)
+            stats = manager.stats()
+            print(f"completed={stats['completed']} failed={stats['failed']} "
+                  f"queued={stats['jobs']['queued']} running={stats['jobs']['running']} "
+                  f"render_pool={pool.stats()}")
+    except KeyboardInterrupt:
+        print("Stopping: finishing jobs in progress...")
+        manager.stop()
+
+
+if __name__ == "__main__":
+    main()
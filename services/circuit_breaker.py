@@ -0,0 +1,99 @@
+import time
+import threading
+
+# 断路器状态
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """断路器处于打开状态，请求未发出"""
+
+
+class CircuitBreaker:
+    """
+    断路器
+
+    连续失败达到failure_threshold次后打开，之后的请求直接失败（调用方改用缓存或
+    最后一次成功的值），不再占用工作线程等待超时。打开reset_timeout秒后进入半开状态，
+    只放行一个探测请求：成功则关闭，失败则重新打开。
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        """
+        初始化断路器
+
+        参数:
+            failure_threshold: 连续失败多少次后打开
+            reset_timeout: 打开后多少秒允许探测请求
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+        self.times_opened = 0
+        self.short_circuited = 0
+
+    def allow(self):
+        """
+        判断是否允许发出请求
+
+        返回:
+            bool: False表示断路器打开，调用方应直接失败
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.time() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.short_circuited += 1
+            return False
+
+    def check(self):
+        """不允许请求时抛出CircuitOpenError"""
+        if not self.allow():
+            raise CircuitOpenError("Circuit breaker is open, upstream calls are suspended")
+
+    def record_success(self):
+        """记录一次成功的请求"""
+        with self._lock:
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        """记录一次失败的请求"""
+        with self._lock:
+            self.consecutive_failures += 1
+            self._probe_in_flight = False
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.times_opened += 1
+                self.state = OPEN
+                self.opened_at = time.time()
+
+    def stats(self):
+        """
+        获取断路器状态
+
+        返回:
+            dict: 状态、连续失败次数、打开次数和被直接拒绝的请求数
+        """
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "failure_threshold": self.failure_threshold,
+                "reset_timeout": self.reset_timeout,
+                "opened_seconds_ago": round(time.time() - self.opened_at, 1) if self.opened_at else None,
+                "times_opened": self.times_opened,
+                "short_circuited": self.short_circuited,
+            }
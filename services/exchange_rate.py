@@ -1,11 +1,82 @@
 # services/exchange_rate.py
+import csv
+import time
+import threading
 import requests
+import numpy as np
 import pandas as pd
-from typing import Dict, Optional
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from requests.adapters import HTTPAdapter
+from typing import Dict, List, Optional
+from services.rate_cache import RateCache
+from services.circuit_breaker import CircuitBreaker, CircuitOpenError
+from services.rate_history import RateHistory
+
+DEFAULT_BASE_URL = "http://download.finance.yahoo.com/d/quotes.csv"
+
+# 上游不支持一次查询多个货币时返回的状态码（请求格式错误、路径不存在、URL过长）；
+# 其他4xx（鉴权、限流等）与批量查询无关，不会关闭批量查询
+BATCH_UNSUPPORTED_STATUSES = (400, 404, 414)
 
 class ExchangeRateService:
-    def __init__(self):
-        self.base_url = "http://download.finance.yahoo.com/d/quotes.csv"
+    def __init__(self, cache_ttl: Optional[float] = None, max_stale: float = 3600,
+                 snapshot_path: Optional[str] = None, base_url: Optional[str] = None,
+                 batch: bool = True, max_connections: int = 8,
+                 connect_timeout: float = 2.0, read_timeout: float = 5.0, deadline: float = 10.0,
+                 hedge_after: Optional[float] = None, failure_threshold: int = 5,
+                 reset_timeout: float = 30, history_path: Optional[str] = None,
+                 batch_retry_after: float = 3600):
+        """
+        参数:
+            cache_ttl: 汇率缓存的有效秒数，None表示不缓存（每次调用都请求上游）
+            max_stale: 缓存过期后仍可返回旧值（同时后台刷新）的秒数
+            snapshot_path: 汇率快照文件，多个进程共用同一份快照
+            base_url: 上游地址，默认Yahoo Finance的quotes.csv
+            batch: 是否在一次请求中查询所有货币（上游不支持时自动改为并行单独查询）
+            max_connections: 连接池大小，也是并行查询的最大并发数
+            connect_timeout: 单次请求的连接超时秒数
+            read_timeout: 单次请求的读取超时秒数
+            deadline: 获取全部汇率的总时限秒数，超时未返回的货币使用最后一次成功的值
+            hedge_after: 请求超过该秒数未返回（或提前失败）时再发一个相同的请求，
+                         取先成功的结果；None表示不发对冲请求
+            failure_threshold: 连续失败多少次后断路器打开
+            reset_timeout: 断路器打开后多少秒放行探测请求
+            history_path: 汇率历史目录，每次从上游获取汇率后追加一行；None表示不记录历史
+            batch_retry_after: 上游拒绝批量查询后，改为并行单独查询多少秒再重新尝试批量查询
+        """
+        self.base_url = base_url or DEFAULT_BASE_URL
+        self.batch = batch
+        self.batch_retry_after = batch_retry_after
+        # 批量查询被拒绝后暂停到该time.monotonic()时间点
+        self.batch_paused_until = 0.0
+        self.max_connections = max_connections
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.deadline = deadline
+        self.hedge_after = hedge_after
+        # 所有请求共用一个保持连接的Session，避免每次查询都重新建立TCP连接
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # 上游连续失败时快速失败，不再让每个请求都等到超时
+        self.breaker = CircuitBreaker(failure_threshold=failure_threshold, reset_timeout=reset_timeout)
+        self._hedge_executor = None
+        if hedge_after is not None:
+            self._hedge_executor = ThreadPoolExecutor(max_workers=max_connections * 2,
+                                                      thread_name_prefix="rate-hedge")
+        # 上游请求的延迟和结果统计
+        self._metrics_lock = threading.Lock()
+        self._latencies = deque(maxlen=1000)
+        self.upstream_requests = 0
+        self.upstream_failures = 0
+        self.upstream_timeouts = 0
+        self.deadline_misses = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        # 每个货币最后一次成功获取的汇率，上游不可用时返回
+        self.last_known: Dict[str, float] = {}
         # 常用货币代码
         self.currencies = {
             'CNY': 'Chinese Yuan',     # 人民币
@@ -16,11 +87,31 @@ class ExchangeRateService:
             'AUD': 'Australian Dollar',# 澳元
             'INR': 'Indian Rupee'      # 印度卢比
         }
+        self.history = RateHistory(history_path, self.currencies) if history_path else None
+        self.cache = None
+        if cache_ttl is not None:
+            self.cache = RateCache(self.fetch_all_rates, ttl=cache_ttl, max_stale=max_stale,
+                                   snapshot_path=snapshot_path)
 
     def get_exchange_rate(self, currency_code: str) -> Optional[float]:
         """
-        获取指定货币兑美元的实时汇率
-        返回值表示1美元等于多少目标货币
+        获取指定货币兑美元的汇率（启用缓存时，支持的货币从缓存中读取）
+        返回值表示1美元等于多少目标货币；上游不可用时返回最后一次成功获取的值
+        """
+        if self.cache is not None and currency_code in self.currencies:
+            return self.cache.get().get(currency_code)
+        rate = self.fetch_exchange_rate(currency_code)
+        if rate is None:
+            return self.last_known.get(currency_code)
+        return rate
+
+    def fetch_exchange_rate(self, currency_code: str, deadline_at: Optional[float] = None) -> Optional[float]:
+        """
+        从上游获取指定货币兑美元的实时汇率
+        返回值表示1美元等于多少目标货币，失败时返回None
+
+        参数:
+            deadline_at: time.monotonic()时间点，请求不会超过该时间
         """
         try:
             # 构造Yahoo Finance API请求
@@ -31,16 +122,19 @@ class ExchangeRateService:
                 's': pair
             }
             
-            response = requests.get(self.base_url, params=params)
+            response = self._request(params, deadline_at)
             response.raise_for_status()
             
             # 解析CSV响应
             data = response.text.strip().split(',')
             if len(data) >= 2:
                 rate = float(data[1])  # 第二个字段是汇率
+                self.last_known[currency_code] = rate
                 return rate
             return None
             
+        except CircuitOpenError:
+            return None
         except requests.RequestException as e:
             print(f"Error fetching rate for {currency_code}: {e}")
             return None
@@ -50,15 +144,235 @@ class ExchangeRateService:
 
     def get_all_rates(self) -> Dict[str, float]:
         """
-        获取所有支持货币的实时汇率
+        获取所有支持货币的汇率（启用缓存时从缓存中读取）
+        上游不可用时返回最后一次成功获取的值
+        """
+        if self.cache is not None:
+            return self.cache.get()
+        return dict(self.last_known, **self.fetch_all_rates())
+
+    def fetch_all_rates(self) -> Dict[str, float]:
+        """
+        从上游获取所有支持货币的实时汇率，总耗时不超过self.deadline秒
+        优先一次请求查询全部货币，失败或缺少部分货币时再并行单独查询
         """
+        deadline_at = time.monotonic() + self.deadline
+        codes = list(self.currencies.keys())
+        use_batch = self.batch and time.monotonic() >= self.batch_paused_until
+        rates = self._fetch_batch(codes, deadline_at) if use_batch else {}
+        missing = [code for code in codes if code not in rates]
+        if missing:
+            rates.update(self._fetch_parallel(missing, deadline_at))
+        if rates and self.history is not None:
+            # 上游这次没有返回的货币按最后一次成功的值记录
+            self.history.append(time.time(), dict(self.last_known, **rates))
+        return rates
+
+    def convert(self, amounts, from_codes, to_codes, timestamps=None):
+        """
+        批量换算金额（向量化，一次处理所有行）
+
+        参数:
+            amounts: 金额数组
+            from_codes: 原货币代码数组
+            to_codes: 目标货币代码数组
+            timestamps: 每行使用哪个时刻的汇率（Unix时间戳），NaN或None表示使用当前汇率
+
+        返回:
+            tuple: (换算结果, 使用的汇率)，两个numpy数组；无法换算的行为NaN
+        """
+        amounts = np.asarray(amounts, dtype=np.float64)
+        from_codes = np.char.upper(np.asarray(from_codes, dtype=str))
+        to_codes = np.char.upper(np.asarray(to_codes, dtype=str))
+        if timestamps is None:
+            timestamps = np.full(len(amounts), np.nan)
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+
+        current = np.isnan(timestamps)
+        from_rates = np.full(len(amounts), np.nan)
+        to_rates = np.full(len(amounts), np.nan)
+        if current.any():
+            rates = dict(self.get_all_rates(), USD=1.0)
+            for code, rate in rates.items():
+                from_rates[current & (from_codes == code)] = rate
+                to_rates[current & (to_codes == code)] = rate
+        if self.history is not None and not current.all():
+            dated = ~current
+            from_rates[dated] = self.history.rates_at(from_codes[dated], timestamps[dated])
+            to_rates[dated] = self.history.rates_at(to_codes[dated], timestamps[dated])
+
+        # 汇率都是1美元等于多少该货币
+        cross_rates = to_rates / from_rates
+        return amounts * cross_rates, cross_rates
+
+    def _fetch_batch(self, codes: List[str], deadline_at: float) -> Dict[str, float]:
+        """一次请求查询多个货币，每个货币在响应中占一行"""
+        params = {
+            'e': '.csv',
+            'f': 'sl1d1t1',  # symbol, last price, date, time
+            's': ','.join(f"USD{code}=X" for code in codes)
+        }
+        try:
+            response = self._request(params, deadline_at)
+            if response.status_code in BATCH_UNSUPPORTED_STATUSES:
+                # 上游不支持一次查询多个货币，冷却期内直接并行单独查询，之后重新探测
+                print(f"Batch rate request rejected ({response.status_code}), falling back to parallel "
+                      f"requests for {self.batch_retry_after:g}s")
+                self.batch_paused_until = time.monotonic() + self.batch_retry_after
+                return {}
+            response.raise_for_status()
+        except CircuitOpenError:
+            return {}
+        except requests.RequestException as e:
+            print(f"Error fetching batch rates: {e}")
+            return {}
+
+        rates = {}
+        for row in csv.reader(response.text.strip().splitlines()):
+            if len(row) < 2 or not row[0].startswith('USD'):
+                continue
+            code = row[0][3:6]
+            try:
+                rates[code] = float(row[1])
+            except ValueError:
+                print(f"Error parsing rate for {code}: {row[1]}")
+        self.last_known.update(rates)
+        return rates
+
+    def _fetch_parallel(self, codes: List[str], deadline_at: float) -> Dict[str, float]:
+        """通过连接池并行单独查询多个货币，到达deadline_at时返回已经完成的部分"""
+        executor = ThreadPoolExecutor(max_workers=min(len(codes), self.max_connections))
+        futures = {executor.submit(self.fetch_exchange_rate, code, deadline_at): code for code in codes}
+        done, not_done = wait(futures, timeout=max(0.0, deadline_at - time.monotonic()))
+        # 不等待未完成的请求，它们受单次请求超时限制，会自行结束
+        executor.shutdown(wait=False)
+        if not_done:
+            with self._metrics_lock:
+                self.deadline_misses += 1
+            print(f"Rate lookups missed the {self.deadline}s deadline: "
+                  f"{', '.join(sorted(futures[f] for f in not_done))}")
         rates = {}
-        for code in self.currencies.keys():
-            rate = self.get_exchange_rate(code)
+        for future in done:
+            rate = future.result()
             if rate is not None:
-                rates[code] = rate
+                rates[futures[future]] = rate
         return rates
 
+    def _request(self, params: Dict[str, str], deadline_at: Optional[float] = None) -> requests.Response:
+        """
+        经过断路器向上游发出一次请求
+
+        连接和读取都有超时，且不超过deadline_at；5xx、超时和连接错误计为失败。
+        断路器打开时抛出CircuitOpenError，不发出请求。
+        """
+        connect_timeout, read_timeout = self.connect_timeout, self.read_timeout
+        if deadline_at is not None:
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                raise requests.Timeout("Exchange rate deadline exceeded")
+            connect_timeout, read_timeout = min(connect_timeout, remaining), min(read_timeout, remaining)
+        timeout = (connect_timeout, read_timeout)
+        self.breaker.check()
+
+        start = time.monotonic()
+        try:
+            if self._hedge_executor is None:
+                response = self.session.get(self.base_url, params=params, timeout=timeout)
+            else:
+                response = self._hedged_get(params, timeout)
+        except requests.RequestException as e:
+            self._record(start, ok=False, timed_out=isinstance(e, requests.Timeout))
+            self.breaker.record_failure()
+            raise
+
+        ok = response.status_code < 500
+        self._record(start, ok=ok)
+        if ok:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+        return response
+
+    def _hedged_get(self, params: Dict[str, str], timeout) -> requests.Response:
+        """首个请求超过hedge_after秒未返回或已失败时再发一个请求，返回先成功的响应"""
+        primary = self._hedge_executor.submit(self.session.get, self.base_url, params=params, timeout=timeout)
+        wait([primary], timeout=self.hedge_after)
+        if primary.done() and primary.exception() is None:
+            return primary.result()
+
+        with self._metrics_lock:
+            self.hedged += 1
+        backup = self._hedge_executor.submit(self.session.get, self.base_url, params=params, timeout=timeout)
+        pending = {backup} if primary.done() else {primary, backup}
+        error = primary.exception() if primary.done() else None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                if future is backup:
+                    with self._metrics_lock:
+                        self.hedge_wins += 1
+                return future.result()
+        raise error
+
+    def _record(self, start: float, ok: bool, timed_out: bool = False) -> None:
+        """记录一次上游请求的延迟和结果"""
+        elapsed_ms = (time.monotonic() - start) * 1000
+        with self._metrics_lock:
+            self._latencies.append(elapsed_ms)
+            self.upstream_requests += 1
+            if not ok:
+                self.upstream_failures += 1
+            if timed_out:
+                self.upstream_timeouts += 1
+
+    def stats(self) -> Dict:
+        """
+        获取上游请求统计
+
+        返回:
+            dict: 断路器状态、超时设置、批量查询状态、请求/失败/超时/对冲次数和最近请求的延迟分布(毫秒)
+        """
+        with self._metrics_lock:
+            latencies = sorted(self._latencies)
+            upstream = {
+                "requests": self.upstream_requests,
+                "failures": self.upstream_failures,
+                "timeouts": self.upstream_timeouts,
+                "deadline_misses": self.deadline_misses,
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins,
+            }
+        if latencies:
+            def percentile(q):
+                return round(latencies[min(len(latencies) - 1, int(len(latencies) * q))], 1)
+            upstream["latency_ms"] = {
+                "samples": len(latencies),
+                "avg": round(sum(latencies) / len(latencies), 1),
+                "p50": percentile(0.5),
+                "p95": percentile(0.95),
+                "p99": percentile(0.99),
+                "max": round(latencies[-1], 1),
+            }
+        return {
+            "breaker": self.breaker.stats(),
+            "upstream": upstream,
+            "timeouts": {
+                "connect": self.connect_timeout,
+                "read": self.read_timeout,
+                "deadline": self.deadline,
+                "hedge_after": self.hedge_after,
+            },
+            "batch": {
+                "enabled": self.batch,
+                "paused_for": round(max(0.0, self.batch_paused_until - time.monotonic()), 1),
+            },
+            "last_known": len(self.last_known),
+            "history": self.history.stats() if self.history is not None else None,
+        }
+
 if __name__ == "__main__":
     # 测试代码
     exchange_service = ExchangeRateService()
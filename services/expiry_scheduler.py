@@ -0,0 +1,225 @@
+import os
+import time
+import heapq
+import sqlite3
+import threading
+
+
+class ExpiryScheduler:
+    """
+    文件过期删除调度器
+
+    待删除的文件按删除时间放在最小堆中，后台线程睡到最早的删除时间再醒来，
+    每个文件的调度和删除都是O(log n)，不需要每隔几秒扫描全部文件。
+    设置index_path时，删除计划同时写入SQLite索引（按删除时间建索引）：多个gunicorn
+    工作进程共用同一个索引，重启后未删除的文件会继续按计划删除；每个文件由
+    最先在索引中领取到它的进程删除。
+    """
+
+    def __init__(self, index_path=None, poll_interval=30, on_remove=None):
+        """
+        初始化调度器
+
+        参数:
+            index_path: SQLite索引文件路径，None表示只在本进程内存中调度
+            poll_interval: 检查其他进程安排的删除的最长间隔秒数
+            on_remove: 文件到期删除后调用 on_remove(path)，例如让FileHandler更新占用字节数
+        """
+        self.index_path = index_path
+        self.poll_interval = poll_interval
+        self.on_remove = on_remove
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._heap = []          # [(删除时间, 文件路径)]
+        self._deadlines = {}     # 文件路径 -> 当前有效的删除时间，堆中时间不一致的条目已失效
+        self._local = threading.local()
+        self._thread = None
+        self._stopping = False
+        self.scheduled = 0
+        self.deleted = 0
+        self.errors = 0
+
+        if index_path:
+            os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+            conn = self._connect()
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS expiry (
+                    path TEXT PRIMARY KEY,
+                    delete_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS expiry_delete_at ON expiry (delete_at)")
+            # 重启前安排的删除继续生效
+            for path, delete_at in conn.execute("SELECT path, delete_at FROM expiry"):
+                self._push_locked(path, delete_at)
+
+    def _connect(self):
+        # 每个线程使用自己的连接
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.index_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _push_locked(self, path, delete_at):
+        self._deadlines[path] = delete_at
+        heapq.heappush(self._heap, (delete_at, path))
+
+    def schedule(self, path, delay_seconds=60):
+        """
+        安排文件在指定秒数后删除（同一文件再次安排时以最后一次为准）
+
+        参数:
+            path: 文件路径
+            delay_seconds: 延迟秒数
+        """
+        path = os.path.abspath(path)
+        delete_at = time.time() + delay_seconds
+        if self.index_path:
+            self._connect().execute(
+                "INSERT OR REPLACE INTO expiry (path, delete_at) VALUES (?, ?)", (path, delete_at)
+            )
+        with self._lock:
+            self._push_locked(path, delete_at)
+            self.scheduled += 1
+            # 新的删除时间比后台线程等待的更早时唤醒它
+            if self._heap[0][1] == path:
+                self._wakeup.notify()
+
+    def cancel(self, path):
+        """取消文件的删除计划，返回是否存在该计划"""
+        path = os.path.abspath(path)
+        found = False
+        if self.index_path:
+            found = self._connect().execute("DELETE FROM expiry WHERE path = ?", (path,)).rowcount > 0
+        with self._lock:
+            # 堆中的条目留到出堆时丢弃
+            return self._deadlines.pop(path, None) is not None or found
+
+    def _claim(self, path, now):
+        """在共享索引中领取一个到期的文件，其他进程已删除或重新安排时返回False"""
+        if not self.index_path:
+            return True
+        cursor = self._connect().execute(
+            "DELETE FROM expiry WHERE path = ? AND delete_at <= ?", (path, now)
+        )
+        return cursor.rowcount > 0
+
+    def _remove(self, path):
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+                print(f"已删除文件: {path}")
+            with self._lock:
+                self.deleted += 1
+        except OSError as e:
+            print(f"删除文件时出错: {path}, 错误: {e}")
+            with self._lock:
+                self.errors += 1
+            return
+        if self.on_remove is not None:
+            try:
+                self.on_remove(path)
+            except Exception as e:
+                print(f"文件删除回调出错: {path}, 错误: {e}")
+
+    def run_due(self, now=None):
+        """
+        删除所有已到期的文件
+
+        参数:
+            now: 当前时间，默认time.time()
+
+        返回:
+            int: 本次删除的文件数
+        """
+        now = time.time() if now is None else now
+        due = {}
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                delete_at, path = heapq.heappop(self._heap)
+                if self._deadlines.get(path) == delete_at:
+                    del self._deadlines[path]
+                    due[path] = delete_at
+
+        if self.index_path:
+            # 其他进程安排的、已经到期但还没被删除的文件（例如该进程已退出）
+            rows = self._connect().execute(
+                "SELECT path FROM expiry WHERE delete_at <= ? ORDER BY delete_at LIMIT 1000", (now,)
+            ).fetchall()
+            for (path,) in rows:
+                due.setdefault(path, now)
+
+        removed = 0
+        for path in due:
+            if self._claim(path, now):
+                self._remove(path)
+                removed += 1
+        return removed
+
+    def _next_wakeup_locked(self, now):
+        # 丢弃堆顶已失效的条目
+        while self._heap and self._deadlines.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        wait = self.poll_interval if self.index_path else None
+        if self._heap:
+            until_next = max(0.0, self._heap[0][0] - now)
+            wait = until_next if wait is None else min(wait, until_next)
+        return wait
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if self._stopping:
+                    return
+                wait = self._next_wakeup_locked(time.time())
+                if wait is None or wait > 0:
+                    self._wakeup.wait(wait)
+                if self._stopping:
+                    return
+            try:
+                self.run_due()
+            except sqlite3.Error as e:
+                print(f"读取文件过期索引失败: {e}")
+                time.sleep(1)
+
+    def start(self):
+        """启动后台删除线程"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="expiry-scheduler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """停止后台删除线程（删除计划保留在索引中）"""
+        with self._lock:
+            self._stopping = True
+            self._wakeup.notify_all()
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+    def stats(self):
+        """
+        获取调度统计信息
+
+        返回:
+            dict: 本进程待删除的文件数、最近的删除时间、索引中的计划数和删除/失败次数
+        """
+        indexed = None
+        if self.index_path:
+            indexed = self._connect().execute("SELECT COUNT(*) FROM expiry").fetchone()[0]
+        with self._lock:
+            next_at = self._heap[0][0] if self._heap else None
+            return {
+                "pending": len(self._deadlines),
+                "indexed": indexed,
+                "next_due_in": round(max(0.0, next_at - time.time()), 1) if next_at else None,
+                "scheduled": self.scheduled,
+                "deleted": self.deleted,
+                "errors": self.errors,
+            }
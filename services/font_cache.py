@@ -0,0 +1,95 @@
+import os
+import threading
+from collections import OrderedDict
+from PIL import ImageFont
+
+
+class FontRegistry:
+    """
+    有界LRU字体缓存
+
+    以 (字体路径, 字体大小, 排版引擎) 为键缓存 FreeTypeFont 对象，
+    避免每次测量或绘制文字时重复打开字体文件并初始化字形。
+    """
+
+    def __init__(self, maxsize=64):
+        """
+        初始化字体缓存
+
+        参数:
+            maxsize: 最多缓存的字体对象数量
+        """
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._fonts = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _make_key(font_path, font_size, layout_engine):
+        # 本地文件统一使用绝对路径，系统字体名称保持原样
+        if os.path.exists(font_path):
+            font_path = os.path.abspath(font_path)
+        return (font_path, font_size, layout_engine)
+
+    def get(self, font_path, font_size, layout_engine=None):
+        """
+        获取字体对象，不存在时加载并放入缓存
+
+        参数:
+            font_path: 字体文件路径或系统字体名称
+            font_size: 字体大小
+            layout_engine: 排版引擎（ImageFont.Layout.BASIC / RAQM），None表示Pillow默认
+
+        返回:
+            FreeTypeFont: 字体对象，加载失败时抛出异常（失败结果不缓存）
+        """
+        key = self._make_key(font_path, font_size, layout_engine)
+
+        with self._lock:
+            font = self._fonts.get(key)
+            if font is not None:
+                self._fonts.move_to_end(key)
+                self.hits += 1
+                return font
+            self.misses += 1
+
+        font = ImageFont.truetype(key[0], font_size, layout_engine=layout_engine)
+
+        with self._lock:
+            self._fonts[key] = font
+            self._fonts.move_to_end(key)
+            while len(self._fonts) > self.maxsize:
+                self._fonts.popitem(last=False)
+                self.evictions += 1
+        return font
+
+    def clear(self):
+        """清空缓存，返回被移除的条目数"""
+        with self._lock:
+            removed = len(self._fonts)
+            self._fonts.clear()
+            return removed
+
+    def stats(self):
+        """
+        获取缓存统计信息
+
+        返回:
+            dict: 条目数、容量、命中/未命中/淘汰次数以及命中率
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._fonts),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+# 进程级共享的字体缓存，容量可通过环境变量调整
+font_registry = FontRegistry(maxsize=int(os.environ.get("FONT_CACHE_SIZE", "64")))
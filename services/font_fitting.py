@@ -0,0 +1,178 @@
+import threading
+from PIL import Image, ImageDraw
+from services.font_cache import font_registry
+
+# 预测宽度时使用的参考字体大小
+REFERENCE_SIZE = 100
+
+
+class FontMetrics:
+    """
+    字体在参考大小下的字符步进宽度和字距表
+
+    宽度随字体大小近似线性变化，因此可以用参考大小下的数据按比例预测
+    任意大小下的文本宽度，只在最后用真实测量确认。
+    """
+
+    def __init__(self, font, reference_size=REFERENCE_SIZE):
+        """
+        初始化字体度量表
+
+        参数:
+            font: 参考大小下的字体对象
+            reference_size: 参考字体大小
+        """
+        self.font = font
+        self.reference_size = reference_size
+        self._lock = threading.Lock()
+        self._advances = {}
+        self._kerning = {}
+
+    def _advance(self, char):
+        width = self._advances.get(char)
+        if width is None:
+            width = self.font.getlength(char)
+            self._advances[char] = width
+        return width
+
+    def _kern(self, pair):
+        kern = self._kerning.get(pair)
+        if kern is None:
+            kern = self.font.getlength(pair) - self._advance(pair[0]) - self._advance(pair[1])
+            self._kerning[pair] = kern
+        return kern
+
+    def unit_width(self, text):
+        """
+        计算文本在参考大小下的步进宽度（逐字符步进宽度加相邻字符字距）
+
+        参数:
+            text: 要计算的文本
+
+        返回:
+            float: 参考大小下的宽度
+        """
+        with self._lock:
+            width = sum(self._advance(char) for char in text)
+            for i in range(len(text) - 1):
+                width += self._kern(text[i:i + 2])
+            return width
+
+    def predict_width(self, text, font_size):
+        """按比例预测文本在指定字体大小下的宽度"""
+        return self.unit_width(text) * font_size / self.reference_size
+
+
+_metrics_lock = threading.Lock()
+_metrics = {}
+
+
+def get_font_metrics(font_path, reference_size=REFERENCE_SIZE):
+    """
+    获取（并缓存）字体的度量表
+
+    参数:
+        font_path: 字体文件路径
+        reference_size: 参考字体大小
+
+    返回:
+        FontMetrics: 字体度量表
+    """
+    key = (font_path, reference_size)
+    with _metrics_lock:
+        metrics = _metrics.get(key)
+        if metrics is None:
+            metrics = FontMetrics(font_registry.get(font_path, reference_size), reference_size)
+            _metrics[key] = metrics
+        return metrics
+
+
+def measure_text_width(text, font):
+    """
+    测量文本的实际像素宽度，与原先逐步缩小循环中的测量方式一致
+
+    参数:
+        text: 要测量的文本
+        font: 字体对象
+
+    返回:
+        int: 文本宽度
+    """
+    temp_draw = ImageDraw.Draw(Image.new('RGBA', (1, 1), (0, 0, 0, 0)))
+    try:
+        # 新版Pillow
+        text_bbox = temp_draw.textbbox((0, 0), text, font=font)
+        return text_bbox[2] - text_bbox[0]
+    except:
+        # 旧版Pillow
+        return temp_draw.textsize(text, font=font)[0]
+
+
+def fit_font_size(text, font_path, start_size, min_size, max_width, step, font_loader=None):
+    """
+    计算文本的合适字体大小
+
+    结果与从start_size开始每次减小step、直到宽度不超过max_width的线性循环
+    完全相同：候选大小为 start_size, start_size-step, ... (>= min_size)，
+    返回其中第一个适合的大小，都不适合时返回min_size。先用度量表预测候选位置，
+    再用真实测量确认，预测偏差时在候选序列上二分查找。
+
+    参数:
+        text: 要计算的文本
+        font_path: 字体路径
+        start_size: 起始字体大小
+        min_size: 最小字体大小
+        max_width: 最大允许宽度
+        step: 每次缩小的像素数
+        font_loader: 按大小加载字体的函数，默认使用字体缓存
+
+    返回:
+        (font_size, text_width): 合适的字体大小及对应宽度（未测量时宽度为None）
+    """
+    if font_loader is None:
+        font_loader = lambda size: font_registry.get(font_path, size)
+
+    candidates = list(range(start_size, min_size - 1, -step))
+    if not candidates:
+        return min_size, None
+
+    measured = {}
+
+    def fits(index):
+        if index not in measured:
+            size = candidates[index]
+            measured[index] = measure_text_width(text, font_loader(size))
+        return measured[index] <= max_width
+
+    # 用参考大小下的度量表预测第一个适合的候选位置
+    guess = 0
+    try:
+        unit_width = get_font_metrics(font_path).unit_width(text)
+        if unit_width > 0:
+            predicted_size = max_width * REFERENCE_SIZE / unit_width
+            guess = next((i for i, size in enumerate(candidates) if size <= predicted_size),
+                         len(candidates) - 1)
+    except Exception as e:
+        print(f"预测字体大小时出错: {e}")
+
+    # 确认预测结果，通常一到两次测量即可
+    if fits(guess):
+        if guess == 0 or not fits(guess - 1):
+            return candidates[guess], measured[guess]
+        low, high = 0, guess - 1
+    else:
+        low, high = guess + 1, len(candidates) - 1
+
+    # 预测偏差较大时，在剩余候选区间二分查找第一个适合的大小
+    found = None
+    while low <= high:
+        middle = (low + high) // 2
+        if fits(middle):
+            found = middle
+            high = middle - 1
+        else:
+            low = middle + 1
+
+    if found is None:
+        return min_size, None
+    return candidates[found], measured[found]
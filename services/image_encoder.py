@@ -0,0 +1,273 @@
+import io
+import time
+import threading
+from collections import OrderedDict
+from PIL import Image, features
+
+# 支持的输出格式及各自的默认编码参数
+# PNG默认压缩级别3：比Pillow默认的6更快，体积只略大
+# PNG的colors大于0时输出调色板（量化）PNG，0表示不量化
+FORMATS = {
+    "png": {
+        "pil_format": "PNG",
+        "mimetype": "image/png",
+        "extension": "png",
+        "defaults": {"compress_level": 3, "colors": 0, "dither": False},
+    },
+    "webp": {
+        "pil_format": "WEBP",
+        "mimetype": "image/webp",
+        "extension": "webp",
+        "defaults": {"quality": 85, "lossless": False, "method": 0},
+    },
+    "jpeg": {
+        "pil_format": "JPEG",
+        "mimetype": "image/jpeg",
+        "extension": "jpg",
+        "defaults": {"quality": 90},
+    },
+}
+
+# 格式别名
+FORMAT_ALIASES = {
+    "jpg": "jpeg",
+    "image/png": "png",
+    "image/webp": "webp",
+    "image/jpeg": "jpeg",
+}
+
+# 各编码参数的取值范围
+OPTION_RANGES = {
+    "compress_level": (0, 9),
+    "quality": (0, 100),
+    "method": (0, 6),
+    "colors": (0, 256),
+}
+
+# 布尔类型的编码参数
+BOOLEAN_OPTIONS = ("lossless", "dither")
+
+DEFAULT_FORMAT = "png"
+
+
+def normalize_format(output_format):
+    """
+    规范化格式名称
+
+    参数:
+        output_format: 格式名称或MIME类型（如 "jpg"、"image/webp"）
+
+    返回:
+        str: 规范化后的格式名称，不支持时返回None
+    """
+    if not output_format:
+        return None
+    name = str(output_format).strip().lower()
+    name = FORMAT_ALIASES.get(name, name)
+    return name if name in FORMATS else None
+
+
+def negotiate_format(requested=None, accept_mimetypes=None):
+    """
+    确定输出格式：显式指定的format参数优先，其次按Accept请求头协商，默认PNG
+
+    参数:
+        requested: 请求中的format参数
+        accept_mimetypes: werkzeug的request.accept_mimetypes
+
+    返回:
+        str: 格式名称，format参数不受支持时抛出ValueError
+    """
+    if requested:
+        output_format = normalize_format(requested)
+        if output_format is None:
+            raise ValueError(f"Unsupported format: {requested}. Supported formats: {', '.join(FORMATS)}")
+        return output_format
+
+    if accept_mimetypes:
+        # PNG排在第一位，这样 */* 或未指定时仍然返回PNG
+        candidates = [FORMATS[name]["mimetype"] for name in FORMATS]
+        best = accept_mimetypes.best_match(candidates)
+        if best:
+            return normalize_format(best)
+
+    return DEFAULT_FORMAT
+
+
+def parse_bool(value):
+    """布尔参数：bool原样返回，字符串 "1"/"true"/"yes"（不区分大小写）为True，其他为False"""
+    return value if isinstance(value, bool) else str(value).lower() in ("1", "true", "yes")
+
+
+def resolve_options(output_format, options=None):
+    """
+    合并默认编码参数和请求中的编码参数，忽略该格式不支持的参数
+
+    参数:
+        output_format: 格式名称
+        options: 请求中的编码参数字典
+
+    返回:
+        dict: 最终使用的编码参数，参数值不合法时抛出ValueError
+    """
+    resolved = dict(FORMATS[output_format]["defaults"])
+    for key, value in (options or {}).items():
+        if key not in resolved or value is None:
+            continue
+        if key in BOOLEAN_OPTIONS:
+            resolved[key] = parse_bool(value)
+            continue
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            # 列表、字典等无法转换的值同样是参数错误（400），而不是服务器错误
+            raise ValueError(f"{key} must be an integer") from None
+        low, high = OPTION_RANGES[key]
+        if not low <= value <= high:
+            raise ValueError(f"{key} must be between {low} and {high}")
+        resolved[key] = value
+    return resolved
+
+
+def format_key(output_format, options):
+    """生成包含编码参数的格式标识，用于渲染缓存的键"""
+    return output_format + ":" + ",".join(f"{key}={options[key]}" for key in sorted(options))
+
+
+class PaletteCache:
+    """
+    按模板缓存的量化调色板
+
+    同一模板生成的海报颜色基本相同（背景加白色文字），因此每个模板只对第一张海报
+    做一次完整的颜色分析，之后的海报直接映射到缓存的调色板上。只缓存调色板本身
+    （1x1的P模式图像），与海报尺寸无关；条目数有上限，超出时淘汰最久未使用的。
+    """
+
+    def __init__(self, max_entries=32):
+        """
+        初始化调色板缓存
+
+        参数:
+            max_entries: 最多缓存的调色板数
+        """
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._palettes = OrderedDict()  # (palette_key, colors) -> 1x1的P模式图像
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _analyse(img, colors):
+        # 有libimagequant时使用，否则使用中位切分
+        if features.check('libimagequant'):
+            method = Image.Quantize.LIBIMAGEQUANT
+        else:
+            method = Image.Quantize.MEDIANCUT
+        return img.quantize(colors, method=method, dither=Image.Dither.NONE)
+
+    def quantize(self, img, colors, dither=False, palette_key=None):
+        """
+        把RGB图像量化为调色板图像
+
+        参数:
+            img: RGB模式的图片
+            colors: 调色板颜色数（2-256）
+            dither: 是否使用Floyd-Steinberg抖动
+            palette_key: 模板标识（不含缩放比例或导出尺寸），相同标识的图片共用调色板；None表示不缓存
+
+        返回:
+            Image: P模式图像
+        """
+        dither_mode = Image.Dither.FLOYDSTEINBERG if dither else Image.Dither.NONE
+        if palette_key is None:
+            return self._analyse(img, colors)
+
+        key = (palette_key, colors)
+        with self._lock:
+            palette = self._palettes.get(key)
+            if palette is not None:
+                self._palettes.move_to_end(key)
+                self.hits += 1
+        if palette is None:
+            # 首次遇到该模板：做一次完整的颜色分析，只缓存得到的调色板
+            quantized = self._analyse(img, colors)
+            palette = Image.new('P', (1, 1))
+            palette.putpalette(quantized.getpalette())
+            with self._lock:
+                self.misses += 1
+                self._palettes[key] = palette
+                self._palettes.move_to_end(key)
+                while len(self._palettes) > self.max_entries:
+                    self._palettes.popitem(last=False)
+                    self.evictions += 1
+            if not dither:
+                return quantized
+
+        return img.quantize(palette=palette, dither=dither_mode)
+
+    def clear(self):
+        """清空缓存，返回被移除的条目数"""
+        with self._lock:
+            removed = len(self._palettes)
+            self._palettes.clear()
+            return removed
+
+    def stats(self):
+        """获取缓存统计信息"""
+        with self._lock:
+            return {
+                "entries": len(self._palettes),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+# 进程级共享的调色板缓存
+palette_cache = PaletteCache()
+
+
+def encode_image(img, output_format=DEFAULT_FORMAT, options=None, palette_key=None):
+    """
+    编码图片
+
+    参数:
+        img: PIL图片对象
+        output_format: 格式名称（png / webp / jpeg）
+        options: 编码参数，未指定的使用该格式的默认值
+        palette_key: 量化PNG时共用调色板的模板标识
+
+    返回:
+        (data, info): 编码后的字节，以及包含格式、MIME类型、扩展名、编码参数、
+                      编码耗时(毫秒)和字节数的字典
+    """
+    output_format = normalize_format(output_format) or DEFAULT_FORMAT
+    spec = FORMATS[output_format]
+    resolved = resolve_options(output_format, options)
+
+    start_time = time.perf_counter()
+    if img.mode != 'RGB':
+        img = img.convert('RGB')  # 转为RGB模式保存
+
+    save_options = dict(resolved)
+    colors = save_options.pop("colors", 0)
+    dither = save_options.pop("dither", False)
+    if colors >= 2:
+        # 调色板PNG：映射到模板的缓存调色板
+        img = palette_cache.quantize(img, colors, dither=dither, palette_key=palette_key)
+
+    buffer = io.BytesIO()
+    img.save(buffer, format=spec["pil_format"], **save_options)
+    data = buffer.getvalue()
+    encode_ms = (time.perf_counter() - start_time) * 1000
+
+    return data, {
+        "format": output_format,
+        "mimetype": spec["mimetype"],
+        "extension": spec["extension"],
+        "options": resolved,
+        "encode_ms": round(encode_ms, 2),
+        "bytes": len(data),
+    }
@@ -1,12 +1,23 @@
 from PIL import Image, ImageDraw, ImageFont
 import os
+import math
 import datetime
+from services.template_cache import template_cache, normalize_scale
+from services.font_cache import font_registry
+from services.font_fitting import fit_font_size
+from services.image_encoder import encode_image
+from services.render_cache import file_identity
+from services.multi_size import parse_sizes, derive_sizes, size_label
+from services.layout_plan import load_layout_plan, rotation_matrix, rotated_bounds
 
 # Create a directory for storing generated images
 OUTPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "generated_images")
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 print(f"Output directory set to: {OUTPUT_DIR}")  # 添加日志
 
+# 默认字体路径
+DEFAULT_FONT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "assets", "fonds", "impact.ttf")
+
 def get_image_size(image_path):
     """
         返回图片的尺寸
@@ -24,24 +35,64 @@ def get_image_size(image_path):
         print(f"获取图片尺寸时出错: {e}")
         return None
 
+def load_font(font_name, font_size):
+    """
+    从字体缓存加载字体，失败时回退到系统字体或默认字体
+    
+    参数:
+        font_name: 字体名称或路径
+        font_size: 字体大小
+        
+    返回:
+        font: 字体对象
+    """
+    try:
+        return font_registry.get(font_name, font_size)
+    except Exception as font_error:
+        print(f"加载字体 {font_name} 失败: {font_error}")
+        try:
+            # 如果找不到指定字体，尝试加载系统字体
+            import matplotlib.font_manager as fm
+            system_fonts = fm.findSystemFonts()
+            if system_fonts:
+                print(f"使用系统字体: {system_fonts[0]}")
+                return font_registry.get(system_fonts[0], font_size)
+            print("使用默认字体")
+            return ImageFont.load_default()
+        except:
+            return ImageFont.load_default()
+
 class ImageEditor:
-    def __init__(self, image_path):
+    def __init__(self, image_path, scale=1):
         """
         初始化图片编辑器
         
         参数:
             image_path: 图片文件的路径
+            scale: 缩放比例（0-1]，用于低分辨率预览，规整到两位小数。坐标、字体大小等参数仍按原图尺寸传入，
+                   绘制时按比例缩放
         """
         try:
-            # 打开图像并转换为RGBA模式
+            # 从模板缓存获取已解码的RGBA图像副本
             self.img_path = image_path
-            self.img = Image.open(image_path).convert('RGBA')
+            self.scale = normalize_scale(scale)
+            self.img = template_cache.get(image_path, self.scale)
             self.width, self.height = self.img.size
+            # 延迟渲染的文本队列: (旋转角度, 旋转中心) -> 文本列表
+            self._pending = {}
+            # 排版方案预先计算的旋转矩阵和裁剪区域: (旋转角度, 旋转中心) -> (矩阵, 裁剪区域)
+            self._prepared = {}
             print(f"图片尺寸: {self.img.size}")
         except Exception as e:
             print(f"打开图片时出错: {e}")
             raise e
     
+    def _scaled(self, value):
+        """把原图坐标系中的数值换算到当前画布"""
+        if value is None or self.scale == 1:
+            return value
+        return round(value * self.scale)
+
     def add_text(self, 
                 text="测试文本",
                 position=(None, None),  # 如果为None，则居中
@@ -49,7 +100,9 @@ class ImageEditor:
                 font_name="../assets/fonds/impact.ttf",
                 font_size=100,
                 text_color="white",
-                rotation_angle=0):
+                rotation_angle=0,
+                rotation_center=None,   # 旋转中心，默认为图片中心
+                defer=False):           # 是否加入队列，等flush()时批量渲染
         """
         在图片上添加旋转的文字
         
@@ -61,33 +114,18 @@ class ImageEditor:
             font_size: 字体大小
             text_color: 文字颜色，可以是名称(如"white")或RGB元组(如(255,255,255))
             rotation_angle: 旋转角度（度数）
+            rotation_center: 旋转中心(x, y)，None表示图片中心
+            defer: 为True时只排版并加入队列，调用flush()时与相同旋转的文本一起渲染
         
         返回:
             self: 返回对象本身，支持链式调用
         """
         try:
-            # 尝试加载字体
-            try:
-                font = ImageFont.truetype(font_name, font_size)
-                print(f"成功加载字体: {font_name}, 大小: {font_size}")
-            except Exception as font_error:
-                print(f"加载字体 {font_name} 失败: {font_error}")
-                try:
-                    # 如果找不到指定字体，尝试加载系统字体
-                    import matplotlib.font_manager as fm
-                    system_fonts = fm.findSystemFonts()
-                    if system_fonts:
-                        font = ImageFont.truetype(system_fonts[0], font_size)
-                        print(f"使用系统字体: {system_fonts[0]}")
-                    else:
-                        font = ImageFont.load_default()
-                        print("使用默认字体")
-                except:
-                    font = ImageFont.load_default()
+            # 从字体缓存加载字体
+            font = load_font(font_name, max(1, self._scaled(font_size)))
             
-            # 创建一个透明图层用于文字
-            text_layer = Image.new('RGBA', self.img.size, (0, 0, 0, 0))
-            text_draw = ImageDraw.Draw(text_layer)
+            # 创建一个临时图层用于测量文字
+            text_draw = ImageDraw.Draw(Image.new('RGBA', (1, 1), (0, 0, 0, 0)))
             
             # 获取文本尺寸
             try:
@@ -100,7 +138,7 @@ class ImageEditor:
                 text_width, text_height = text_draw.textsize(text, font=font)
             
             # 确定文本位置
-            x, y = position
+            x, y = self._scaled(position[0]), self._scaled(position[1])
             
             # # 修复右对齐逻辑 - 关键修改部分开始
             # if right_align_x is not None:
@@ -128,7 +166,7 @@ class ImageEditor:
             # 简化版的右对齐逻辑
             if right_align_x is not None:
                 # 直接计算左侧起始位置，不考虑旋转偏移
-                x = right_align_x - text_width
+                x = self._scaled(right_align_x) - text_width
             elif x is None:
                 # 如果没有设置x坐标和右对齐，则居中
                 x = (self.width - text_width) // 2
@@ -136,15 +174,17 @@ class ImageEditor:
             if y is None:
                 y = (self.height - text_height) // 2
             
-            # 绘制文本到透明图层
-            text_draw.text((x, y), text, fill=text_color, font=font)
+            item = ((x, y), text, font, text_color)
+            if rotation_center is not None:
+                rotation_center = (self._scaled(rotation_center[0]), self._scaled(rotation_center[1]))
+            if defer:
+                # 加入队列，flush()时按旋转角度和旋转中心分组一次性渲染
+                self._pending.setdefault((rotation_angle, rotation_center), []).append(item)
+                return self
             
-            # 旋转文本图层
+            # 绘制、旋转并合并文本
             # 注意：rotation_angle为负数表示顺时针旋转
-            rotated_layer = text_layer.rotate(rotation_angle, resample=Image.BICUBIC, expand=False)
-            
-            # 合并图层
-            self.img = Image.alpha_composite(self.img, rotated_layer)
+            self._composite_text([item], rotation_angle, rotation_center)
             
             return self
             
@@ -154,6 +194,137 @@ class ImageEditor:
             traceback.print_exc()
             return self
 
+    def queue_text(self, **kwargs):
+        """
+        排版文字并加入渲染队列，参数与add_text相同
+        
+        返回:
+            self: 返回对象本身，支持链式调用
+        """
+        return self.add_text(defer=True, **kwargs)
+
+    def queue_items(self, items, rotation_angle=0, rotation_center=None, matrix=None, clip=None):
+        """
+        把已经排好版的文字加入渲染队列（供排版方案使用）
+        
+        参数:
+            items: [((x, y), text, font, text_color), ...]，坐标和字体均为当前画布尺寸
+            rotation_angle: 旋转角度（度数）
+            rotation_center: 旋转中心(x, y)（当前画布坐标），None表示图片中心
+            matrix: 预先计算的逆向仿射矩阵，None表示渲染时计算
+            clip: 文字（旋转前）允许绘制的区域，作用于同一旋转分组的所有文字
+        
+        返回:
+            self: 返回对象本身，支持链式调用
+        """
+        key = (rotation_angle, rotation_center)
+        self._pending.setdefault(key, []).extend(items)
+        if matrix is not None or clip is not None:
+            self._prepared[key] = (matrix, clip)
+        return self
+
+    def flush(self):
+        """
+        渲染队列中的所有文字
+        
+        相同旋转角度和旋转中心的文字绘制在同一个图层上，每组只做一次旋转和合并；
+        各组按首次加入队列的顺序合并。
+        
+        返回:
+            self: 返回对象本身，支持链式调用
+        """
+        pending, self._pending = self._pending, {}
+        prepared, self._prepared = self._prepared, {}
+        for (rotation_angle, rotation_center), items in pending.items():
+            matrix, clip = prepared.get((rotation_angle, rotation_center), (None, None))
+            try:
+                self._composite_text(items, rotation_angle, rotation_center, matrix=matrix, clip=clip)
+            except Exception as e:
+                print(f"渲染文字队列时出错: {e}")
+                import traceback
+                traceback.print_exc()
+        return self
+
+    def _composite_text(self, items, rotation_angle, rotation_center=None, matrix=None, clip=None):
+        """
+        把文本绘制到只包含文字区域的精灵图上，绕旋转中心旋转后合并到对应位置
+        
+        结果与绘制到整张透明图层、rotate(expand=False)后再alpha_composite完全一致，
+        但只需要分配、旋转和合并文字所在的区域。
+        
+        参数:
+            items: [((x, y), text, font, text_color), ...] 要绘制的文本
+            rotation_angle: 旋转角度（度数）
+            rotation_center: 旋转中心(x, y)，None表示图片中心
+            matrix: 预先计算的逆向仿射矩阵（rotation_matrix），None表示按旋转角度和中心计算
+            clip: 文字（旋转前）允许绘制的区域(left, top, right, bottom)，None表示整张图片
+        """
+        # 文字区域四周留出透明边距，保证双三次插值的采样范围内都是透明像素
+        padding = 4
+        left, top, right, bottom = self.width, self.height, 0, 0
+        try:
+            measure_draw = ImageDraw.Draw(Image.new('RGBA', (1, 1), (0, 0, 0, 0)))
+            for xy, text, font, _ in items:
+                text_bbox = measure_draw.textbbox(xy, text, font=font)
+                left = min(left, math.floor(text_bbox[0]) - padding)
+                top = min(top, math.floor(text_bbox[1]) - padding)
+                right = max(right, math.ceil(text_bbox[2]) + padding)
+                bottom = max(bottom, math.ceil(text_bbox[3]) + padding)
+        except Exception:
+            # 无法测量时退回到整张图片大小的图层
+            left, top, right, bottom = 0, 0, self.width, self.height
+        
+        # 超出图片（或裁剪区域）的部分在整图图层上也会被裁掉
+        clip_left, clip_top, clip_right, clip_bottom = clip or (0, 0, self.width, self.height)
+        left, top = max(left, clip_left), max(top, clip_top)
+        right, bottom = min(right, clip_right), min(bottom, clip_bottom)
+        if left >= right or top >= bottom:
+            return
+        
+        # 在精灵图上绘制文本，坐标平移为精灵图的局部坐标
+        sprite = Image.new('RGBA', (right - left, bottom - top), (0, 0, 0, 0))
+        sprite_draw = ImageDraw.Draw(sprite)
+        for (x, y), text, font, text_color in items:
+            sprite_draw.text((x - left, y - top), text, fill=text_color, font=font)
+        
+        angle = rotation_angle % 360.0
+        if angle == 0:
+            self.img.alpha_composite(sprite, dest=(left, top))
+            return
+        if angle in (90, 180, 270) and rotation_center is None:
+            # rotate对这些角度使用转置快速路径，直接按整图处理
+            text_layer = Image.new('RGBA', self.img.size, (0, 0, 0, 0))
+            text_layer.paste(sprite, (left, top))
+            rotated_layer = text_layer.rotate(rotation_angle, resample=Image.BICUBIC, expand=False)
+            self.img = Image.alpha_composite(self.img, rotated_layer)
+            return
+        
+        # 与Image.rotate相同的逆向仿射矩阵（目标坐标 -> 源坐标）
+        if matrix is None:
+            center = rotation_center if rotation_center is not None else (self.width / 2, self.height / 2)
+            matrix = rotation_matrix(angle, center)
+        a, b, c, d, e, f = matrix
+        
+        # 精灵图四个角在旋转后的位置，决定需要合并的目标区域
+        dest_left, dest_top, dest_right, dest_bottom = rotated_bounds(matrix, (left, top, right, bottom))
+        dest_left, dest_top = max(dest_left, 0), max(dest_top, 0)
+        dest_right, dest_bottom = min(dest_right, self.width), min(dest_bottom, self.height)
+        if dest_left >= dest_right or dest_top >= dest_bottom:
+            return
+        
+        # 把矩阵平移到目标区域和精灵图的局部坐标系
+        matrix = (
+            a, b, a * dest_left + b * dest_top + c - left,
+            d, e, d * dest_left + e * dest_top + f - top,
+        )
+        rotated_sprite = sprite.transform(
+            (dest_right - dest_left, dest_bottom - dest_top),
+            Image.AFFINE, matrix, resample=Image.BICUBIC
+        )
+        
+        # 只在目标区域内合并
+        self.img.alpha_composite(rotated_sprite, dest=(dest_left, dest_top))
+
     def add_text_adaptive(self, 
                 text="测试文本",
                 position=(None, None),  # 如果为None，则居中
@@ -162,6 +333,8 @@ class ImageEditor:
                 font_size=100,
                 text_color="white",
                 rotation_angle=0,
+                rotation_center=None,   # 旋转中心，默认为图片中心
+                defer=False,            # 是否加入队列，等flush()时批量渲染
                 max_width=None,         # 文本最大宽度，超过会自动缩小字体
                 min_font_size=50,       # 最小字体大小限制
                 width_threshold=0.8     # 宽度阈值，超过这个比例开始缩小字体
@@ -177,6 +350,8 @@ class ImageEditor:
             font_size: 初始/最大字体大小
             text_color: 文字颜色，可以是名称(如"white")或RGB元组(如(255,255,255))
             rotation_angle: 旋转角度（度数）
+            rotation_center: 旋转中心(x, y)，None表示图片中心
+            defer: 为True时只排版并加入队列，调用flush()时批量渲染
             max_width: 文本最大宽度，超过会自动缩小字体
             min_font_size: 自动缩小的最小字体大小限制
             width_threshold: 宽度阈值，文本宽度超过max_width*width_threshold时开始缩小字体
@@ -190,58 +365,21 @@ class ImageEditor:
                 # 如果右对齐，最大宽度默认为从右边界到图像左边缘的80%
                 max_width = right_align_x * width_threshold
             elif max_width is None:
-                # 如果没有设置max_width，默认为图像宽度的80%
-                max_width = self.width * width_threshold
+                # 如果没有设置max_width，默认为图像宽度的80%（按原图尺寸计算）
+                max_width = self.width / self.scale * width_threshold
                 
-            # 计算适合的字体大小
-            current_font_size = font_size
-            font = None
-            text_width = float('inf')
-            
-            # 循环尝试字体大小，直到文本宽度适合或达到最小字体大小
-            while current_font_size >= min_font_size:
-                try:
-                    # 尝试加载字体
-                    try:
-                        font = ImageFont.truetype(font_name, current_font_size)
-                    except Exception as font_error:
-                        print(f"加载字体 {font_name} 失败: {font_error}")
-                        try:
-                            # 如果找不到指定字体，尝试加载系统字体
-                            import matplotlib.font_manager as fm
-                            system_fonts = fm.findSystemFonts()
-                            if system_fonts:
-                                font = ImageFont.truetype(system_fonts[0], current_font_size)
-                            else:
-                                font = ImageFont.load_default()
-                        except:
-                            font = ImageFont.load_default()
-                    
-                    # 创建临时图层来测量文本尺寸
-                    temp_layer = Image.new('RGBA', (1, 1), (0, 0, 0, 0))
-                    temp_draw = ImageDraw.Draw(temp_layer)
-                    
-                    # 获取文本尺寸
-                    try:
-                        # 新版Pillow
-                        text_bbox = temp_draw.textbbox((0, 0), text, font=font)
-                        text_width = text_bbox[2] - text_bbox[0]
-                    except:
-                        # 旧版Pillow
-                        text_width, _ = temp_draw.textsize(text, font=font)
-                    
-                    # 检查文本宽度是否在允许范围内
-                    if text_width <= max_width:
-                        print(f"最终使用字体大小: {current_font_size}，文本宽度: {text_width}，最大宽度: {max_width}")
-                        break
-                    
-                    # 缩小字体大小并重试
-                    current_font_size -= 8  # 每次减小5px
-                    
-                except Exception as e:
-                    print(f"测量文本时出错: {e}")
-                    # 如果发生错误，减小字体大小继续尝试
-                    current_font_size -= 8
+            # 计算适合的字体大小：与每次减小8px的线性循环结果一致，但只需少量测量
+            current_font_size, text_width = fit_font_size(
+                text=text,
+                font_path=font_name,
+                start_size=font_size,
+                min_size=min_font_size,
+                max_width=max_width,
+                step=8,
+                font_loader=lambda size: load_font(font_name, size)
+            )
+            if text_width is not None:
+                print(f"最终使用字体大小: {current_font_size}，文本宽度: {text_width}，最大宽度: {max_width}")
             
             # 确保字体大小不小于最小限制
             current_font_size = max(current_font_size, min_font_size)
@@ -255,7 +393,9 @@ class ImageEditor:
                 font_name=font_name,
                 font_size=current_font_size,
                 text_color=text_color,
-                rotation_angle=rotation_angle
+                rotation_angle=rotation_angle,
+                rotation_center=rotation_center,
+                defer=defer
             )
             
         except Exception as e:
@@ -270,7 +410,9 @@ class ImageEditor:
                 font_name=font_name,
                 font_size=font_size,
                 text_color=text_color,
-                rotation_angle=rotation_angle
+                rotation_angle=rotation_angle,
+                rotation_center=rotation_center,
+                defer=defer
             )
     
     def save_image(self, output_path):
@@ -284,6 +426,9 @@ class ImageEditor:
             output_path: 如果成功，返回输出文件路径；否则返回None
         """
         try:
+            # 先渲染队列中尚未合并的文字
+            self.flush()
+            
             # 创建输出目录（如果不存在）
             output_dir = os.path.dirname(output_path)
             if output_dir and not os.path.exists(output_dir):
@@ -301,6 +446,21 @@ class ImageEditor:
             traceback.print_exc()
             return None
     
+    def encode(self, output_format="png", options=None):
+        """
+        把当前编辑的图片编码为字节，不写入磁盘
+        
+        参数:
+            output_format: 输出格式（png / webp / jpeg）
+            options: 编码参数（如 compress_level、quality、lossless、colors），未指定时使用格式默认值
+            
+        返回:
+            (data, info): 编码后的图片数据和编码信息（格式、MIME类型、耗时等）
+        """
+        self.flush()
+        # 同一模板（文件内容不变）的海报共用量化调色板，与缩放比例无关
+        return encode_image(self.img, output_format, options, palette_key=file_identity(self.img_path))
+    
     def get_current_image(self):
         """
         获取当前编辑的图片对象
@@ -308,6 +468,7 @@ class ImageEditor:
         返回:
             Image: PIL图片对象
         """
+        self.flush()
         return self.img
     
     def show_image(self):
@@ -330,51 +491,101 @@ def calculate_font_size(text, font_path, start_size, min_size, max_width):
     返回:
         适合的字体大小
     """
-    from PIL import Image, ImageDraw, ImageFont
+    # 与每次减小5px的线性循环结果一致，但只需少量测量
+    try:
+        font_size, text_width = fit_font_size(
+            text=text,
+            font_path=font_path,
+            start_size=start_size,
+            min_size=min_size,
+            max_width=max_width,
+            step=5
+        )
+    except Exception as e:
+        print(f"计算字体大小时出错: {e}")
+        return min_size
     
-    # 临时图像用于测量文本尺寸
-    temp_img = Image.new('RGBA', (1, 1), (0, 0, 0, 0))
-    temp_draw = ImageDraw.Draw(temp_img)
+    if text_width is not None:
+        print(f"文本 '{text}' 适合的字体大小: {font_size}, 宽度: {text_width}/{max_width}")
+    return font_size
+
+def render_offer_poster(recipient_name, offer_amount, team_name,
+                        team_name2="",
+                        banner_path=None,
+                        font_path=None,
+                        scale=1,
+                        layout=None):
+    """
+    排版并渲染offer海报，结果只保存在内存中
     
-    current_size = start_size
+    参数:
+        recipient_name: 收件人姓名（如 "Cora Xia"）
+        offer_amount: offer金额（如 "20,850"）
+        team_name: 团队名称（如 "Niki/Vera"）
+        team_name2: 第二个团队名称（可选）
+        banner_path: offer banner图片路径
+        font_path: 字体文件路径
+        scale: 缩放比例（0-1]，小于1时基于预先缩小的banner渲染低分辨率版本
+        layout: 排版文件路径或排版定义（字典），None表示默认排版
+        
+    返回:
+        (editor, output_filename): 渲染完成的图片编辑器和建议的输出文件名
+    """
+    # 设置默认路径
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     
-    # 逐步减小字体大小直到文本宽度适合
-    while current_size >= min_size:
-        try:
-            font = ImageFont.truetype(font_path, current_size)
-            
-            # 获取文本宽度
-            try:
-                # 新版Pillow
-                text_bbox = temp_draw.textbbox((0, 0), text, font=font)
-                text_width = text_bbox[2] - text_bbox[0]
-            except:
-                # 旧版Pillow
-                text_width, _ = temp_draw.textsize(text, font=font)
-            
-            # 检查是否适合
-            if text_width <= max_width:
-                print(f"文本 '{text}' 适合的字体大小: {current_size}, 宽度: {text_width}/{max_width}")
-                return current_size
-            
-            # 减小字体大小并重试
-            current_size -= 5
-            
-        except Exception as e:
-            print(f"计算字体大小时出错: {e}")
-            current_size -= 5
+    if banner_path is None:
+        banner_path = os.path.join(base_dir, "assets", "images", "offer_banner.png")
+        print(f"使用默认banner路径: {banner_path}")
+        
+    if font_path is None:
+        font_path = DEFAULT_FONT_PATH
+        print(f"使用默认字体路径: {font_path}")
+        
+    # 检查banner文件是否存在（可用的模板见模板注册表 /api/templates）
+    if not os.path.exists(banner_path):
+        raise FileNotFoundError(f"Banner图片不存在: {banner_path}")
+        
+    # 获取当前日期
+    current_date = datetime.datetime.now().strftime("%Y%m%d")
+    
+    # 处理金额格式（确保有$符号）
+    if not offer_amount.startswith('$') and not offer_amount.startswith('￥'):
+        offer_amount = f"${offer_amount}"
+        
+    # 创建图片编辑器（排版中的坐标和字体大小均按原图尺寸，由编辑器按比例缩放）
+    editor = ImageEditor(banner_path, scale=scale)
     
-    # 如果所有尺寸都不适合，返回最小尺寸
-    return min_size
+    # 按模板的排版方案（默认为assets/templates/layouts/offer_banner.json）加入所有文字
+    plan = load_layout_plan(layout, font_path)
+    font_sizes = plan.execute(editor, {
+        "recipient_name": recipient_name,
+        "offer_amount": offer_amount,
+        "team_name": team_name,
+        "team_name2": team_name2 or "",
+    })
+    print(f"文字位字体大小: {font_sizes}")
+    
+    # 相同旋转的文字一次绘制、旋转和合并
+    editor.flush()
+    
+    # 生成不带特殊字符的文件名
+    safe_recipient = recipient_name.replace(' ', '_').replace('/', '_').replace(';', '_')
+    safe_amount = offer_amount.replace('$', '').replace(',', '').replace('.', '_')
+    safe_team = team_name.replace('/', '_')
+    output_filename = f"output_{safe_recipient}_{safe_amount}_{safe_team}_{current_date}.png"
+    
+    return editor, output_filename
 
 def generate_offer_poster(recipient_name, offer_amount, team_name,
                          team_name2 ="", 
                          banner_path=None,  # 修改为None，后面会设置默认值
                          output_dir=None,   # 修改为None，后面会设置默认值
                          font_path=None,    # 修改为None，后面会设置默认值
-                         save_interim=False):
+                         save_interim=False,
+                         layout=None):
     """
-    生成offer海报，支持自适应字体大小
+    生成offer海报并保存到磁盘，支持自适应字体大小
     
     参数:
         recipient_name: 收件人姓名（如 "Cora Xia"）
@@ -385,133 +596,40 @@ def generate_offer_poster(recipient_name, offer_amount, team_name,
         output_dir: 输出目录
         font_path: 字体文件路径
         save_interim: 是否保存中间结果
+        layout: 排版文件路径或排版定义（字典），None表示默认排版
         
     返回:
         output_path: 生成的海报路径
     """
     try:
-        # 设置默认路径
-        base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        
-        if banner_path is None:
-            banner_path = os.path.join(base_dir, "assets", "images", "offer_banner.png")
-            print(f"使用默认banner路径: {banner_path}")
-            
         if output_dir is None:
-            output_dir = os.path.join(base_dir, "generated_images")
+            output_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "generated_images")
             print(f"使用默认输出目录: {output_dir}")
-            
-        if font_path is None:
-            font_path = os.path.join(base_dir, "assets", "fonds", "impact.ttf")
-            print(f"使用默认字体路径: {font_path}")
         
         # 确保输出目录存在
         if not os.path.exists(output_dir):
             os.makedirs(output_dir, exist_ok=True)
-            
-        # 检查banner文件是否存在
-        if not os.path.exists(banner_path):
-            print(f"警告: Banner图片不存在: {banner_path}")
-            # 尝试查找assets目录下的所有图片
-            assets_dir = os.path.join(base_dir, "assets")
-            if os.path.exists(assets_dir):
-                print(f"搜索assets目录中的图片文件...")
-                for root, dirs, files in os.walk(assets_dir):
-                    for file in files:
-                        if file.endswith(('.png', '.jpg', '.jpeg')):
-                            print(f"找到图片: {os.path.join(root, file)}")
-            
-            raise FileNotFoundError(f"Banner图片不存在: {banner_path}")
-            
-        # 获取当前日期
-        current_date = datetime.datetime.now().strftime("%Y%m%d")
         
-        # 处理金额格式（确保有$符号）
-        if not offer_amount.startswith('$') and not offer_amount.startswith('￥'):
-            offer_amount = f"${offer_amount}"
-            
-        # 创建图片编辑器
-        editor = ImageEditor(banner_path)
-        
-        # 添加金额文字 - 不使用自适应大小
-        editor.add_text(
-            text=offer_amount,
-            position=(1200, 800),
-            font_name=font_path,
-            font_size=700,
-            text_color="white",
-            rotation_angle=-13
-        )
-        
-        # 添加收件人姓名 - 使用自适应字体大小，右对齐
-        editor.add_text_adaptive(
-            text=f"@{recipient_name}",
-            position=(None, 650),  # 只使用y坐标
-            right_align_x=3300,    # 右侧固定边界，调整这个值可以改变右对齐位置
-            font_name=font_path,
-            font_size=200,         # 初始/最大字体大小
-            min_font_size=100,     # 最小字体大小限制
-            text_color="white",
-            rotation_angle=-13,
-            width_threshold=0.75   # 宽度阈值，文本宽度超过75%时开始缩小字体
-        )
-        
-        # 确定团队名称的字体大小
-        team_text = f"FROM {team_name} Team!"
-        team_text2 = f"FROM {team_name2} Team!" if team_name2 else ""
-
-        # 选择较长的团队名称来确定字体大小
-        longer_team_text = team_text if len(team_text) >= len(team_text2) else team_text2
-        max_team_width = 2400  # 设置团队名称最大宽度
-
-        # 计算合适的字体大小，基于较长的文本
-        team_font_size = calculate_font_size(
-            text=longer_team_text,
+        editor, output_filename = render_offer_poster(
+            recipient_name=recipient_name,
+            offer_amount=offer_amount,
+            team_name=team_name,
+            team_name2=team_name2,
+            banner_path=banner_path,
             font_path=font_path,
-            start_size=170,
-            min_size=100,
-            max_width=max_team_width
+            layout=layout
         )
-
-        print(f"两个团队名称统一使用字体大小: {team_font_size}")
-
-        # 添加第一个团队名称
-        editor.add_text(
-            text=team_text,
-            position=(1100, 1600),
-            font_name=font_path,
-            font_size=team_font_size,  # 使用计算好的统一字体大小
-            text_color="white",
-            rotation_angle=-13
-        )
-
-        # 添加第二个团队名称（如果有）
-        if team_name2:
-            editor.add_text(
-                text=team_text2,
-                position=(1100, 1800),
-                font_name=font_path,
-                font_size=team_font_size,  # 使用相同的字体大小
-                text_color="white",
-                rotation_angle=-13
-            )
-        
-        # 生成不带特殊字符的文件名
-        safe_recipient = recipient_name.replace(' ', '_').replace('/', '_').replace(';', '_')
-        safe_amount = offer_amount.replace('$', '').replace(',', '').replace('.', '_')
-        safe_team = team_name.replace('/', '_')
         
         # 保存中间结果（如果需要）
         if save_interim:
+            safe_recipient = recipient_name.replace(' ', '_').replace('/', '_').replace(';', '_')
+            current_date = datetime.datetime.now().strftime("%Y%m%d")
             interim_path = os.path.join(output_dir, f"interim_{safe_recipient}_{current_date}.png")
             editor.save_image(interim_path)
             print(f"中间结果已保存: {interim_path}")
         
-        # 生成最终输出文件名
-        output_filename = f"output_{safe_recipient}_{safe_amount}_{safe_team}_{current_date}.png"
-        output_path = os.path.join(output_dir, output_filename)
-        
         # 保存最终结果
+        output_path = os.path.join(output_dir, output_filename)
         editor.save_image(output_path)
         
         return output_path
@@ -522,6 +640,110 @@ def generate_offer_poster(recipient_name, offer_amount, team_name,
         traceback.print_exc()
         return None
 
+def generate_offer_poster_bytes(recipient_name, offer_amount, team_name,
+                                team_name2="",
+                                banner_path=None,
+                                font_path=None,
+                                output_format="png",
+                                encode_options=None,
+                                scale=1,
+                                layout=None):
+    """
+    生成offer海报并直接返回编码后的图片数据，不经过磁盘
+    
+    参数:
+        recipient_name: 收件人姓名（如 "Cora Xia"）
+        offer_amount: offer金额（如 "20,850"）
+        team_name: 团队名称（如 "Niki/Vera"）
+        team_name2: 第二个团队名称（可选）
+        banner_path: offer banner图片路径
+        font_path: 字体文件路径
+        output_format: 输出格式（png / webp / jpeg）
+        encode_options: 编码参数，未指定时使用格式默认值
+        scale: 缩放比例（0-1]，用于生成低分辨率预览
+        layout: 排版文件路径或排版定义（字典），None表示默认排版
+        
+    返回:
+        (data, filename, info): 图片字节、建议的文件名和编码信息，失败时返回None
+    """
+    try:
+        editor, output_filename = render_offer_poster(
+            recipient_name=recipient_name,
+            offer_amount=offer_amount,
+            team_name=team_name,
+            team_name2=team_name2,
+            banner_path=banner_path,
+            font_path=font_path,
+            scale=scale,
+            layout=layout
+        )
+        data, info = editor.encode(output_format, encode_options)
+        output_filename = f"{os.path.splitext(output_filename)[0]}.{info['extension']}"
+        return data, output_filename, info
+        
+    except Exception as e:
+        print(f"生成offer海报时出错: {e}")
+        import traceback
+        traceback.print_exc()
+        return None
+
+def generate_offer_poster_sizes(recipient_name, offer_amount, team_name,
+                                team_name2="",
+                                banner_path=None,
+                                font_path=None,
+                                sizes=("full",),
+                                fit="contain",
+                                output_format="png",
+                                encode_options=None,
+                                layout=None):
+    """
+    渲染一次offer海报，并通过缩小金字塔导出多个尺寸
+    
+    参数:
+        recipient_name: 收件人姓名（如 "Cora Xia"）
+        offer_amount: offer金额（如 "20,850"）
+        team_name: 团队名称（如 "Niki/Vera"）
+        team_name2: 第二个团队名称（可选）
+        banner_path: offer banner图片路径
+        font_path: 字体文件路径
+        sizes: 尺寸列表（如 ["1200x627", "1080x1080", "full"]）
+        fit: 适配方式，contain 完整保留画面并补边，cover 铺满并居中裁剪
+        output_format: 输出格式（png / webp / jpeg）
+        encode_options: 编码参数，未指定时使用格式默认值
+        layout: 排版文件路径或排版定义（字典），None表示默认排版
+        
+    返回:
+        list: [(data, filename, info), ...]，顺序与sizes相同，失败时返回None
+    """
+    try:
+        sizes = parse_sizes(sizes)
+        editor, output_filename = render_offer_poster(
+            recipient_name=recipient_name,
+            offer_amount=offer_amount,
+            team_name=team_name,
+            team_name2=team_name2,
+            banner_path=banner_path,
+            font_path=font_path,
+            layout=layout
+        )
+        
+        base_name = os.path.splitext(output_filename)[0]
+        template_identity = file_identity(editor.img_path)
+        outputs = []
+        for size, img in derive_sizes(editor.get_current_image(), sizes, fit=fit):
+            label = size_label(size)
+            data, info = encode_image(img, output_format, encode_options, palette_key=template_identity)
+            filename = f"{base_name}.{info['extension']}" if size is None else f"{base_name}_{label}.{info['extension']}"
+            info = dict(info, size=label, width=img.width, height=img.height)
+            outputs.append((data, filename, info))
+        return outputs
+        
+    except Exception as e:
+        print(f"生成多尺寸offer海报时出错: {e}")
+        import traceback
+        traceback.print_exc()
+        return None
+
 # 使用示例
 if __name__ == "__main__":
     # 双team测试
@@ -0,0 +1,416 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from collections import deque
+
+# 任务状态
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_STATUSES = (JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED)
+
+
+class Job:
+    """一个异步渲染任务"""
+
+    def __init__(self, job_type, payload, callback_url=None, job_id=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.type = job_type
+        self.payload = payload
+        self.callback_url = callback_url
+        self.status = JOB_QUEUED
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.worker = None
+        self.error = None
+        self.data = None
+        self.size = None
+        self.filename = None
+        self.info = None
+        self.etag = None
+        self.callback_status = None
+
+    def to_dict(self):
+        """任务状态的JSON表示（不包含结果数据本身）"""
+        job = {
+            "job_id": self.id,
+            "type": self.type,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "queue_ms": None,
+            "run_ms": None,
+        }
+        if self.started_at is not None:
+            job["queue_ms"] = round((self.started_at - self.created_at) * 1000, 2)
+            if self.finished_at is not None:
+                job["run_ms"] = round((self.finished_at - self.started_at) * 1000, 2)
+        if self.worker:
+            job["worker"] = self.worker
+        if self.status == JOB_DONE:
+            job["result"] = {
+                "filename": self.filename,
+                "bytes": self.size,
+                "mimetype": self.info.get("mimetype"),
+            }
+        if self.error is not None:
+            job["error"] = self.error
+        if self.callback_url:
+            job["callback"] = {"url": self.callback_url, "status": self.callback_status}
+        return job
+
+
+class JobBroker:
+    """
+    任务队列的接口
+
+    Web端通过enqueue提交任务，渲染端（同一进程的线程或独立的render_worker进程）
+    通过claim领取任务、complete写回结果。新的队列后端实现这些方法并用
+    register_broker注册URL scheme即可，无需修改Flask应用。
+    """
+
+    # 领取的任务超过该秒数没有续租时允许其他工作者重新领取，None表示任务不会被重新领取
+    lease_seconds = None
+
+    def enqueue(self, job):
+        """把新任务放入队列"""
+        raise NotImplementedError
+
+    def claim(self, worker, timeout=1.0):
+        """
+        领取一个排队中的任务，并将其标记为running
+
+        参数:
+            worker: 领取任务的工作者标识
+            timeout: 没有任务时最多等待的秒数
+
+        返回:
+            Job: 领取到的任务（包含payload），超时返回None
+        """
+        raise NotImplementedError
+
+    def renew(self, job):
+        """
+        续租正在执行的任务
+
+        返回:
+            bool: 任务是否仍由job.worker持有（租约过期后被重新领取时返回False）
+        """
+        return True
+
+    def complete(self, job):
+        """
+        写回任务的最终状态（done或failed）和结果
+
+        返回:
+            bool: 是否写回；任务已被其他工作者重新领取时不写回并返回False
+        """
+        raise NotImplementedError
+
+    def set_callback_status(self, job_id, callback_status):
+        """记录回调的结果"""
+        raise NotImplementedError
+
+    def get(self, job_id, with_result=False):
+        """
+        获取任务
+
+        参数:
+            job_id: 任务id
+            with_result: 是否同时加载结果数据
+
+        返回:
+            Job: 任务，不存在时返回None
+        """
+        raise NotImplementedError
+
+    def purge(self, finished_before):
+        """删除在finished_before之前完成的任务，返回删除的数量"""
+        raise NotImplementedError
+
+    def pending(self):
+        """排队中的任务数"""
+        raise NotImplementedError
+
+    def counts(self):
+        """各状态的任务数"""
+        raise NotImplementedError
+
+
+class MemoryBroker(JobBroker):
+    """进程内的任务队列，任务只能由同一进程中的线程处理"""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._jobs = {}
+        self._queue = deque()
+
+    def enqueue(self, job):
+        with self._condition:
+            self._jobs[job.id] = job
+            self._queue.append(job)
+            self._condition.notify()
+
+    def claim(self, worker, timeout=1.0):
+        with self._condition:
+            if not self._queue and not self._condition.wait(timeout):
+                return None
+            if not self._queue:
+                return None
+            job = self._queue.popleft()
+            job.status = JOB_RUNNING
+            job.started_at = time.time()
+            job.worker = worker
+            return job
+
+    def complete(self, job):
+        # 任务对象与队列中的是同一个，无需额外写回
+        with self._condition:
+            self._jobs[job.id] = job
+        return True
+
+    def set_callback_status(self, job_id, callback_status):
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.callback_status = callback_status
+
+    def get(self, job_id, with_result=False):
+        with self._condition:
+            return self._jobs.get(job_id)
+
+    def purge(self, finished_before):
+        with self._condition:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.finished_at is not None and job.finished_at < finished_before]
+            for job_id in expired:
+                del self._jobs[job_id]
+            return len(expired)
+
+    def pending(self):
+        with self._condition:
+            return len(self._queue)
+
+    def counts(self):
+        with self._condition:
+            by_status = dict.fromkeys(JOB_STATUSES, 0)
+            for job in self._jobs.values():
+                by_status[job.status] += 1
+            return by_status
+
+
+class SQLiteBroker(JobBroker):
+    """
+    基于SQLite文件的任务队列
+
+    多个进程（Web端和任意数量的render_worker）共用同一个数据库文件即可协作，
+    不需要额外的服务。领取任务时用BEGIN IMMEDIATE加写锁，保证每个任务只被领取一次；
+    执行中的任务由JobManager定期续租（heartbeat_at），超过lease_seconds没有续租的
+    running任务视为工作进程已退出，会被重新领取。写回结果时校验worker和started_at，
+    已被重新领取的任务不会被原来的工作者覆盖。
+    """
+
+    def __init__(self, path, lease_seconds=600, poll_interval=0.2):
+        """
+        初始化SQLite任务队列
+
+        参数:
+            path: 数据库文件路径
+            lease_seconds: 任务超过该秒数没有续租时允许其他工作者重新领取（每lease_seconds/3秒续租一次，
+                           因此只需大于续租间隔加上一次续租可能的延迟，与任务本身的运行时间无关）
+            poll_interval: 等待新任务时轮询数据库的间隔秒数
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    type TEXT NOT NULL,
+                    payload TEXT,
+                    callback_url TEXT,
+                    status TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    worker TEXT,
+                    error TEXT,
+                    filename TEXT,
+                    info TEXT,
+                    etag TEXT,
+                    size INTEGER,
+                    result BLOB,
+                    callback_status TEXT,
+                    heartbeat_at REAL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at)")
+            # 早期版本创建的数据库没有续租时间列
+            columns = [row["name"] for row in conn.execute("PRAGMA table_info(jobs)")]
+            if "heartbeat_at" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN heartbeat_at REAL")
+
+    def _connect(self):
+        # 每个线程使用自己的连接
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _to_job(row, with_result=False):
+        job = Job(row["type"], json.loads(row["payload"]) if row["payload"] else None,
+                  row["callback_url"], job_id=row["id"])
+        job.status = row["status"]
+        job.created_at = row["created_at"]
+        job.started_at = row["started_at"]
+        job.finished_at = row["finished_at"]
+        job.worker = row["worker"]
+        job.error = row["error"]
+        job.filename = row["filename"]
+        job.info = json.loads(row["info"]) if row["info"] else None
+        job.etag = row["etag"]
+        job.size = row["size"]
+        callback_status = row["callback_status"]
+        job.callback_status = int(callback_status) if callback_status and callback_status.isdigit() else callback_status
+        if with_result:
+            job.data = row["result"]
+        return job
+
+    def enqueue(self, job):
+        self._connect().execute(
+            "INSERT INTO jobs (id, type, payload, callback_url, status, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (job.id, job.type, json.dumps(job.payload, ensure_ascii=False), job.callback_url,
+             job.status, job.created_at)
+        )
+
+    def _claim_once(self, worker):
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = ? OR (status = ? AND COALESCE(heartbeat_at, started_at) < ?) "
+                "ORDER BY created_at LIMIT 1",
+                (JOB_QUEUED, JOB_RUNNING, now - self.lease_seconds)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = ?, started_at = ?, worker = ?, heartbeat_at = ? WHERE id = ?",
+                (JOB_RUNNING, now, worker, now, row["id"])
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        job = self._to_job(row)
+        job.status = JOB_RUNNING
+        job.started_at = now
+        job.worker = worker
+        return job
+
+    def claim(self, worker, timeout=1.0):
+        deadline = time.time() + timeout
+        while True:
+            job = self._claim_once(worker)
+            if job is not None or time.time() >= deadline:
+                return job
+            time.sleep(self.poll_interval)
+
+    def renew(self, job):
+        cursor = self._connect().execute(
+            "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND status = ? AND worker = ? AND started_at = ?",
+            (time.time(), job.id, JOB_RUNNING, job.worker, job.started_at)
+        )
+        return cursor.rowcount > 0
+
+    def complete(self, job):
+        # 只有仍持有租约的工作者（worker和started_at与领取时一致）才能写回结果
+        cursor = self._connect().execute(
+            "UPDATE jobs SET status = ?, finished_at = ?, error = ?, filename = ?, info = ?, etag = ?, "
+            "size = ?, result = ?, payload = NULL WHERE id = ? AND worker = ? AND started_at = ?",
+            (job.status, job.finished_at, job.error, job.filename,
+             json.dumps(job.info) if job.info is not None else None, job.etag,
+             len(job.data) if job.data is not None else None, job.data, job.id,
+             job.worker, job.started_at)
+        )
+        return cursor.rowcount > 0
+
+    def set_callback_status(self, job_id, callback_status):
+        self._connect().execute(
+            "UPDATE jobs SET callback_status = ? WHERE id = ?", (str(callback_status), job_id)
+        )
+
+    def get(self, job_id, with_result=False):
+        columns = "*" if with_result else ", ".join(
+            column for column in ("id", "type", "payload", "callback_url", "status", "created_at",
+                                  "started_at", "finished_at", "worker", "error", "filename", "info",
+                                  "etag", "size", "callback_status")
+        )
+        row = self._connect().execute(f"SELECT {columns} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_job(row, with_result) if row is not None else None
+
+    def purge(self, finished_before):
+        cursor = self._connect().execute(
+            "DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (finished_before,)
+        )
+        return cursor.rowcount
+
+    def pending(self):
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = ?", (JOB_QUEUED,)
+        ).fetchone()[0]
+
+    def counts(self):
+        by_status = dict.fromkeys(JOB_STATUSES, 0)
+        for status, count in self._connect().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"):
+            by_status[status] = count
+        return by_status
+
+
+# URL scheme -> 创建任务队列的函数
+BROKERS = {
+    "memory": lambda location: MemoryBroker(),
+    "sqlite": lambda location: SQLiteBroker(location, lease_seconds=float(os.environ.get("JOB_LEASE_SECONDS", "600"))),
+}
+
+
+def register_broker(scheme, factory):
+    """
+    注册新的任务队列后端
+
+    参数:
+        scheme: URL scheme（如 "redis"）
+        factory: factory(location) -> JobBroker，location为URL中 "://" 之后的部分
+    """
+    BROKERS[scheme] = factory
+
+
+def create_broker(url):
+    """
+    根据URL创建任务队列
+
+    参数:
+        url: "memory://" 或 "sqlite:///path/to/jobs.db"（相对路径写作 "sqlite://jobs.db"）
+
+    返回:
+        JobBroker: 任务队列，scheme不受支持时抛出ValueError
+    """
+    scheme, separator, location = (url or "memory://").partition("://")
+    if not separator or scheme not in BROKERS:
+        raise ValueError(f"Unsupported job broker URL: {url}. Supported schemes: {', '.join(BROKERS)}")
+    return BROKERS[scheme](location)
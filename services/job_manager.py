@@ -0,0 +1,202 @@
+import os
+import time
+import socket
+import threading
+import requests
+from services.render_pool import RenderQueueFull
+from services.job_broker import MemoryBroker, Job, JOB_DONE, JOB_FAILED
+
+
+class JobManager:
+    """
+    异步渲染任务管理器
+
+    提交任务后立即返回任务id，任务放入任务队列（broker）。后台线程从队列中领取任务
+    交给runner执行（runner内部使用渲染进程池），因此排队的渲染再多也不会占用Web请求线程。
+    使用共享的任务队列（如SQLite）时，Web端可以不启动后台线程（workers=0），
+    由任意数量的render_worker进程领取任务。完成的任务结果保留result_ttl秒后清除。
+    任务队列有租约（lease_seconds）时，后台线程定期为正在执行的任务续租。
+    """
+
+    def __init__(self, runner, broker=None, workers=2, max_pending=1000, result_ttl=600,
+                 callback_timeout=5, retry_after=2, name=None):
+        """
+        初始化任务管理器
+
+        参数:
+            runner: 执行任务的函数 runner(job_type, payload) -> (data, filename, info, etag)
+            broker: 任务队列，None表示进程内队列
+            workers: 领取并执行任务的后台线程数，0表示只提交任务
+            max_pending: 最多排队的任务数，超出时抛出RenderQueueFull
+            result_ttl: 完成的任务结果保留的秒数
+            callback_timeout: 回调请求的超时秒数
+            retry_after: 队列满时建议客户端等待的秒数
+            name: 工作者标识前缀，默认为主机名和进程号
+        """
+        self.runner = runner
+        self.broker = broker or MemoryBroker()
+        self.workers = workers
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self.callback_timeout = callback_timeout
+        self.retry_after = retry_after
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self._lock = threading.Lock()
+        self._threads = []
+        self._stop = threading.Event()
+        self._running = {}  # 本进程正在执行的任务 job id -> Job，由续租线程定期续租
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.expired = 0
+        self.lost = 0
+
+    def start(self):
+        """启动领取任务的后台线程（重复调用无副作用）"""
+        with self._lock:
+            if self._threads:
+                return
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._worker, args=(f"{self.name}/{index}",),
+                                          name=f"job-worker-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            if self.workers and self.broker.lease_seconds:
+                thread = threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _heartbeat(self):
+        """每lease_seconds/3秒续租一次正在执行的任务，运行再久的任务也不会被其他工作者重新领取"""
+        interval = self.broker.lease_seconds / 3
+        while not self._stop.wait(interval):
+            with self._lock:
+                jobs = list(self._running.values())
+            for job in jobs:
+                try:
+                    if not self.broker.renew(job):
+                        print(f"任务 {job.id} 的租约已过期，已被其他工作者重新领取")
+                except Exception as e:
+                    print(f"任务 {job.id} 续租失败: {e}")
+
+    def stop(self, wait=True):
+        """停止后台线程，正在执行的任务会先完成"""
+        self._stop.set()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def purge_expired(self):
+        """清除超过保留时间的任务，返回清除的数量"""
+        removed = self.broker.purge(time.time() - self.result_ttl)
+        if removed:
+            with self._lock:
+                self.expired += removed
+        return removed
+
+    def submit(self, job_type, payload, callback_url=None):
+        """
+        提交任务
+
+        参数:
+            job_type: 任务类型，原样传给runner
+            payload: 任务参数（可JSON序列化），原样传给runner
+            callback_url: 任务完成或失败后POST任务状态的URL（可选）
+
+        返回:
+            Job: 新建的任务；排队任务过多时抛出RenderQueueFull
+        """
+        self.purge_expired()
+        if self.broker.pending() >= self.max_pending:
+            raise RenderQueueFull(self.retry_after)
+        # 调度线程在第一次提交任务时启动
+        self.start()
+        job = Job(job_type, payload, callback_url)
+        self.broker.enqueue(job)
+        with self._lock:
+            self.submitted += 1
+        return job
+
+    def get(self, job_id, with_result=False):
+        """获取任务，不存在或已过期时返回None"""
+        self.purge_expired()
+        return self.broker.get(job_id, with_result=with_result)
+
+    def _worker(self, worker_name):
+        while not self._stop.is_set():
+            try:
+                job = self.broker.claim(worker_name, timeout=1.0)
+            except Exception as e:
+                print(f"领取任务失败: {e}")
+                time.sleep(1)
+                continue
+            if job is None:
+                continue
+            self._execute(job)
+
+    def _execute(self, job):
+        with self._lock:
+            self._running[job.id] = job
+        try:
+            job.data, job.filename, job.info, job.etag = self.runner(job.type, job.payload)
+            job.size = len(job.data)
+            status = JOB_DONE
+        except Exception as e:
+            print(f"任务 {job.id} 失败: {e}")
+            job.error = str(e)
+            status = JOB_FAILED
+        finally:
+            with self._lock:
+                self._running.pop(job.id, None)
+        job.finished_at = time.time()
+        job.status = status
+        # 结果已生成，不再需要任务参数
+        job.payload = None
+        if not self.broker.complete(job):
+            # 租约过期后任务已被其他工作者重新领取，以新的领取者的结果为准
+            print(f"任务 {job.id} 已被其他工作者重新领取，丢弃本次结果")
+            with self._lock:
+                self.lost += 1
+            return
+
+        with self._lock:
+            if job.status == JOB_DONE:
+                self.completed += 1
+            else:
+                self.failed += 1
+
+        if job.callback_url:
+            self._send_callback(job)
+
+    def _send_callback(self, job):
+        """把任务状态POST到回调URL，失败只记录不重试"""
+        try:
+            response = requests.post(job.callback_url, json=job.to_dict(), timeout=self.callback_timeout)
+            job.callback_status = response.status_code
+        except requests.RequestException as e:
+            print(f"任务 {job.id} 回调失败: {job.callback_url}, 错误: {e}")
+            job.callback_status = "error"
+        self.broker.set_callback_status(job.id, job.callback_status)
+
+    def stats(self):
+        """
+        获取任务统计信息
+
+        返回:
+            dict: 队列中各状态的任务数，以及本进程的累计计数
+        """
+        self.purge_expired()
+        jobs = self.broker.counts()
+        with self._lock:
+            return {
+                "broker": type(self.broker).__name__,
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "result_ttl": self.result_ttl,
+                "jobs": jobs,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "expired": self.expired,
+                "lost": self.lost,
+            }
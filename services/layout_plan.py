@@ -0,0 +1,418 @@
+import os
+import json
+import math
+import string
+import hashlib
+import threading
+from collections import OrderedDict
+from PIL import Image, ImageDraw
+from services.font_cache import font_registry
+from services.font_fitting import fit_font_size
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_LAYOUT_PATH = os.path.join(BASE_DIR, "assets", "templates", "layouts", "offer_banner.json")
+
+# 每个排版方案最多缓存的画布尺寸数（缩放比例已由template_cache.normalize_scale规整）
+MAX_STAGES = 8
+
+ALIGNMENTS = ("left", "center", "right")
+ANCHORS = ("top", "baseline")
+
+# 排版文件（JSON）描述海报上的文字位，与psd_exchangor编译结果中的slots格式相同：
+# {"version": 1, "slots": [
+#     {"id": "recipient_name", "template": "@{recipient_name}", "position": [3300, 650],
+#      "align": "right", "anchor": "top", "angle": -13, "pivot": "canvas",
+#      "size": 200, "min_size": 100, "max_width": 2475, "step": 8, "color": "white"},
+#     ...]}
+# - template: 文字模板，字段来自渲染参数，默认为 "{<id>}"
+# - position: 原图坐标；align决定x是文字的左边界、中心还是右边界，
+#   anchor决定y是文字顶部还是基线（PSD编译结果为baseline）
+# - angle: 旋转角度（度数，负数为顺时针）；pivot为旋转中心："canvas"（图片中心）、
+#   "anchor"（文字位置，PSD编译结果的默认值）或[x, y]
+# - size / min_size / max_width / step: 字体大小从size开始每次减小step，直到宽度不超过
+#   max_width或到达min_size；min_size默认等于size（固定大小）
+# - group: 同一组的文字位使用同一个字体大小，由组内最长的文字决定
+# - optional: 模板引用的字段都为空时不绘制
+# - font_path: 相对于项目根目录的字体文件，为空时使用模板字体
+# - clip: 文字（旋转前）允许绘制的区域[left, top, right, bottom]，默认为整张图片
+
+
+class LayoutError(ValueError):
+    """排版文件格式错误"""
+
+
+def rotation_matrix(rotation_angle, center):
+    """
+    计算绕center旋转rotation_angle度的逆向仿射矩阵（目标坐标 -> 源坐标），与Image.rotate相同
+
+    参数:
+        rotation_angle: 旋转角度（度数）
+        center: 旋转中心(x, y)
+
+    返回:
+        (a, b, c, d, e, f): Image.transform使用的仿射系数
+    """
+    center_x, center_y = center
+    radians = -math.radians(rotation_angle % 360.0)
+    a, b = round(math.cos(radians), 15), round(math.sin(radians), 15)
+    d, e = round(-math.sin(radians), 15), round(math.cos(radians), 15)
+    c = a * -center_x + b * -center_y + center_x
+    f = d * -center_x + e * -center_y + center_y
+    return a, b, c, d, e, f
+
+
+def rotated_bounds(matrix, box):
+    """
+    计算源区域box旋转后在目标坐标系中的外接矩形
+
+    参数:
+        matrix: rotation_matrix返回的逆向仿射矩阵
+        box: 源区域(left, top, right, bottom)
+
+    返回:
+        (left, top, right, bottom): 向外取整并各留出1像素的目标区域（未按图片大小裁剪）
+    """
+    a, b, c, d, e, f = matrix
+    left, top, right, bottom = box
+    determinant = a * e - b * d
+    corners_x, corners_y = [], []
+    for src_x, src_y in ((left, top), (right, top), (right, bottom), (left, bottom)):
+        dx, dy = src_x - c, src_y - f
+        corners_x.append((e * dx - b * dy) / determinant)
+        corners_y.append((a * dy - d * dx) / determinant)
+    return (math.floor(min(corners_x)) - 1, math.floor(min(corners_y)) - 1,
+            math.ceil(max(corners_x)) + 1, math.ceil(max(corners_y)) + 1)
+
+
+class _Values(dict):
+    # 渲染参数中缺少的字段按空字符串处理
+    def __missing__(self, key):
+        return ""
+
+
+class Slot:
+    """编译后的文字位：与渲染参数无关的部分在加载时解析和校验"""
+
+    def __init__(self, spec, default_font_path):
+        """
+        解析并校验一个文字位
+
+        参数:
+            spec: 文字位定义（字典）
+            default_font_path: 文字位没有指定字体时使用的字体
+        """
+        if not isinstance(spec, dict) or not spec.get("id"):
+            raise LayoutError("each slot must be an object with an 'id'")
+        self.id = str(spec["id"])
+        self.template = spec.get("template") or "{" + self.id + "}"
+        try:
+            self.fields = [field for _, field, _, _ in string.Formatter().parse(self.template) if field]
+        except ValueError as e:
+            raise LayoutError(f"slot {self.id}: invalid template: {e}")
+        self.optional = bool(spec.get("optional", False))
+
+        position = spec.get("position")
+        if not isinstance(position, (list, tuple)) or len(position) != 2:
+            raise LayoutError(f"slot {self.id}: 'position' must be [x, y]")
+        self.position = (float(position[0]), float(position[1]))
+        self.align = spec.get("align", "left")
+        self.anchor = spec.get("anchor", "top")
+        if self.align not in ALIGNMENTS:
+            raise LayoutError(f"slot {self.id}: align must be one of {', '.join(ALIGNMENTS)}")
+        if self.anchor not in ANCHORS:
+            raise LayoutError(f"slot {self.id}: anchor must be one of {', '.join(ANCHORS)}")
+
+        self.angle = float(spec.get("angle", 0))
+        pivot = spec.get("pivot", "anchor" if self.anchor == "baseline" else "canvas")
+        if pivot == "anchor":
+            pivot = self.position
+        elif pivot != "canvas":
+            if not isinstance(pivot, (list, tuple)) or len(pivot) != 2:
+                raise LayoutError(f"slot {self.id}: pivot must be 'canvas', 'anchor' or [x, y]")
+            pivot = (float(pivot[0]), float(pivot[1]))
+        self.pivot = None if pivot == "canvas" else pivot
+
+        self.size = int(spec.get("size", 100))
+        self.min_size = int(spec.get("min_size") or self.size)
+        self.max_width = spec.get("max_width")
+        self.step = int(spec.get("step", 5))
+        if self.size <= 0 or not 0 < self.min_size <= self.size or self.step <= 0:
+            raise LayoutError(f"slot {self.id}: requires 0 < min_size <= size and step > 0")
+        self.group = spec.get("group")
+
+        color = spec.get("color", "white")
+        self.color = tuple(color) if isinstance(color, list) else color
+
+        font_path = spec.get("font_path")
+        self.font_path = os.path.join(BASE_DIR, font_path) if font_path else default_font_path
+        if not self.font_path:
+            raise LayoutError(f"slot {self.id}: no font")
+        try:
+            font_registry.get(self.font_path, self.size)
+        except Exception as e:
+            raise LayoutError(f"slot {self.id}: cannot load font {self.font_path}: {e}")
+
+        clip = spec.get("clip")
+        if clip is not None and (not isinstance(clip, (list, tuple)) or len(clip) != 4):
+            raise LayoutError(f"slot {self.id}: clip must be [left, top, right, bottom]")
+        self.clip = tuple(float(value) for value in clip) if clip is not None else None
+
+    @property
+    def fits(self):
+        """字体大小是否随文字宽度缩小"""
+        return self.max_width is not None and self.min_size < self.size
+
+    def text(self, values):
+        """按模板生成文字，optional且引用的字段都为空时返回None"""
+        if self.optional and not any(values.get(field) for field in self.fields):
+            return None
+        return self.template.format_map(_Values(values))
+
+
+class LayoutPlan:
+    """
+    编译后的排版方案
+
+    加载时一次性完成与具体文字无关的工作：解析和校验文字位、按旋转角度和旋转中心
+    分组、检查字体；每个画布尺寸（预览缩放）第一次渲染时再计算并缓存旋转矩阵、
+    旋转中心、裁剪区域和初始大小的字体对象。渲染一张海报只需要按文字确定字体大小
+    和位置，然后把每组文字交给ImageEditor一次性绘制、旋转和合并。
+    """
+
+    def __init__(self, spec, default_font_path=None, source=None):
+        """
+        编译排版方案
+
+        参数:
+            spec: 排版定义（字典），包含slots列表
+            default_font_path: 文字位没有指定字体时使用的字体
+            source: 排版文件路径（只用于日志和统计）
+        """
+        if not isinstance(spec, dict) or not isinstance(spec.get("slots"), list) or not spec["slots"]:
+            raise LayoutError("layout must be an object with a non-empty 'slots' list")
+        self.source = source
+        self.slots = [Slot(slot, default_font_path) for slot in spec["slots"]]
+        ids = [slot.id for slot in self.slots]
+        if len(set(ids)) != len(ids):
+            raise LayoutError("slot ids must be unique")
+
+        # 渲染分组：相同旋转角度和旋转中心的文字在同一个图层上绘制，按首次出现的顺序合并
+        self.render_groups = OrderedDict()
+        for index, slot in enumerate(self.slots):
+            self.render_groups.setdefault((slot.angle, slot.pivot), []).append(index)
+        # 字体大小分组：组内使用同一个字体大小，参数取组内第一个文字位
+        self.size_groups = OrderedDict()
+        for index, slot in enumerate(self.slots):
+            if slot.group is not None:
+                self.size_groups.setdefault(slot.group, []).append(index)
+
+        self._lock = threading.Lock()
+        self._stages = OrderedDict()  # (缩放比例, 画布尺寸) -> 静态部分，LRU
+
+    def _stage(self, scale, canvas_size):
+        """某个画布尺寸下的静态部分：旋转矩阵、旋转中心、裁剪区域和字体对象"""
+        key = (scale, canvas_size)
+        with self._lock:
+            stage = self._stages.get(key)
+            if stage is not None:
+                self._stages.move_to_end(key)
+        if stage is not None:
+            return stage
+
+        width, height = canvas_size
+
+        def scaled(value):
+            # 与ImageEditor._scaled相同的换算
+            return value if scale == 1 else round(value * scale)
+
+        groups = []
+        for (angle, pivot), indexes in self.render_groups.items():
+            center = None if pivot is None else (scaled(pivot[0]), scaled(pivot[1]))
+            matrix = rotation_matrix(angle, center or (width / 2, height / 2))
+            # 组内所有文字位都有裁剪区域时取它们的并集，否则为整张图片
+            clips = [self.slots[index].clip for index in indexes]
+            if all(clips):
+                clip = (max(0, math.floor(scaled(min(c[0] for c in clips)))),
+                        max(0, math.floor(scaled(min(c[1] for c in clips)))),
+                        min(width, math.ceil(scaled(max(c[2] for c in clips)))),
+                        min(height, math.ceil(scaled(max(c[3] for c in clips)))))
+            else:
+                clip = (0, 0, width, height)
+            groups.append((angle, center, matrix, clip, indexes))
+
+        slots = []
+        for slot in self.slots:
+            font = font_registry.get(slot.font_path, max(1, scaled(slot.size)))
+            slots.append({
+                "x": scaled(slot.position[0]),
+                "y": scaled(slot.position[1]),
+                "fonts": {slot.size: font},
+            })
+
+        stage = {"scale": scale, "groups": groups, "slots": slots}
+        with self._lock:
+            stage = self._stages.setdefault(key, stage)
+            while len(self._stages) > MAX_STAGES:
+                self._stages.popitem(last=False)
+        return stage
+
+    def font_sizes(self, texts):
+        """
+        确定每个文字位的字体大小（原图尺寸）
+
+        参数:
+            texts: 与slots对应的文字列表，None表示不绘制
+
+        返回:
+            list: 与slots对应的字体大小
+        """
+        sizes = [slot.size for slot in self.slots]
+        grouped = set()
+        for indexes in self.size_groups.values():
+            present = [index for index in indexes if texts[index] is not None]
+            grouped.update(indexes)
+            if not present:
+                continue
+            first = self.slots[indexes[0]]
+            size = first.size
+            if first.fits:
+                # 组内最长（字符数最多）的文字决定字体大小
+                longest = max(present, key=lambda index: len(texts[index]))
+                size = self._fit(first, texts[longest])
+            for index in indexes:
+                sizes[index] = size
+        for index, slot in enumerate(self.slots):
+            if index not in grouped and texts[index] is not None and slot.fits:
+                sizes[index] = self._fit(slot, texts[index])
+        return sizes
+
+    @staticmethod
+    def _fit(slot, text):
+        size, _ = fit_font_size(
+            text=text,
+            font_path=slot.font_path,
+            start_size=slot.size,
+            min_size=slot.min_size,
+            max_width=slot.max_width,
+            step=slot.step
+        )
+        return max(size, slot.min_size)
+
+    def execute(self, editor, values):
+        """
+        按排版方案把文字加入编辑器的渲染队列（调用editor.flush()或保存/编码时绘制）
+
+        参数:
+            editor: ImageEditor
+            values: 渲染参数（模板中引用的字段）
+
+        返回:
+            dict: {文字位ID: 字体大小}，不绘制的文字位不包含在内
+        """
+        stage = self._stage(editor.scale, (editor.width, editor.height))
+        texts = [slot.text(values) for slot in self.slots]
+        sizes = self.font_sizes(texts)
+        measure_draw = ImageDraw.Draw(Image.new('RGBA', (1, 1), (0, 0, 0, 0)))
+
+        for angle, center, matrix, clip, indexes in stage["groups"]:
+            items = []
+            for index in indexes:
+                text = texts[index]
+                if text is None:
+                    continue
+                slot, static = self.slots[index], stage["slots"][index]
+                font = static["fonts"].get(sizes[index])
+                if font is None:
+                    font = font_registry.get(slot.font_path, max(1, round(sizes[index] * stage["scale"])))
+
+                x, y = static["x"], static["y"]
+                if slot.align != "left":
+                    text_bbox = measure_draw.textbbox((0, 0), text, font=font)
+                    text_width = text_bbox[2] - text_bbox[0]
+                    x = x - text_width if slot.align == "right" else x - text_width / 2
+                if slot.anchor == "baseline":
+                    y = y - font.getmetrics()[0]
+                items.append(((x, y), text, font, slot.color))
+            if items:
+                editor.queue_items(items, angle, center, matrix=matrix, clip=clip)
+
+        return {slot.id: size for slot, size, text in zip(self.slots, sizes, texts) if text is not None}
+
+    def stats(self):
+        """
+        获取排版方案信息
+
+        返回:
+            dict: 来源、文字位ID、渲染分组数和已准备的画布尺寸数
+        """
+        with self._lock:
+            return {
+                "source": self.source,
+                "slots": [slot.id for slot in self.slots],
+                "render_groups": len(self.render_groups),
+                "stages": len(self._stages),
+            }
+
+
+_plans_lock = threading.Lock()
+_plans = OrderedDict()
+MAX_PLANS = 32
+
+
+def layout_identity(layout):
+    """
+    排版的身份标识（用于缓存键）：排版文件的路径、大小和修改时间，或内联排版内容的摘要
+
+    参数:
+        layout: 排版文件路径、排版定义（字典）或None（默认排版）
+    """
+    if isinstance(layout, dict):
+        encoded = json.dumps(layout, sort_keys=True, ensure_ascii=False)
+        return "inline:" + hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+    path = layout or DEFAULT_LAYOUT_PATH
+    try:
+        stat = os.stat(path)
+        return f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    except OSError:
+        return str(path)
+
+
+def load_layout_plan(layout=None, default_font_path=None):
+    """
+    加载（并缓存）编译后的排版方案，排版文件修改后重新编译
+
+    参数:
+        layout: 排版文件路径、排版定义（字典）或None（默认排版）
+        default_font_path: 文字位没有指定字体时使用的字体
+
+    返回:
+        LayoutPlan
+
+    异常:
+        LayoutError: 排版格式错误；OSError: 排版文件无法读取
+    """
+    key = (layout_identity(layout), default_font_path)
+    with _plans_lock:
+        plan = _plans.get(key)
+        if plan is not None:
+            _plans.move_to_end(key)
+            return plan
+
+    if isinstance(layout, dict):
+        spec, source = layout, None
+    else:
+        source = layout or DEFAULT_LAYOUT_PATH
+        with open(source, encoding='utf-8') as f:
+            try:
+                spec = json.load(f)
+            except json.JSONDecodeError as e:
+                raise LayoutError(f"{source}: {e}")
+    plan = LayoutPlan(spec, default_font_path, source)
+    print(f"排版方案已编译: {source or '内联排版'} ({len(plan.slots)} 个文字位)")
+
+    with _plans_lock:
+        _plans[key] = plan
+        _plans.move_to_end(key)
+        while len(_plans) > MAX_PLANS:
+            _plans.popitem(last=False)
+    return plan
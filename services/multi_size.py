@@ -0,0 +1,128 @@
+from PIL import Image
+
+# 单次请求最多导出的尺寸数量和单边最大像素（另外每个尺寸都不能超过海报原始尺寸，只做缩小）
+MAX_SIZES = 10
+MAX_DIMENSION = 8192
+
+# 表示原始尺寸的写法
+FULL_SIZE_NAMES = ("full", "original")
+
+# 支持的适配方式：contain 完整保留画面并用背景色补边，cover 铺满目标尺寸并居中裁剪
+FIT_MODES = ("contain", "cover")
+
+
+def parse_sizes(sizes, max_size=None):
+    """
+    解析尺寸列表
+
+    参数:
+        sizes: 尺寸列表，每项可以是 "1200x627"、[1200, 627]、{"width": 1200, "height": 627}
+               或 "full"（原始尺寸）；也可以是逗号分隔的字符串
+        max_size: 海报原始尺寸 (width, height)，指定时每个尺寸的宽高都不能超过它
+
+    返回:
+        list: [(width, height) 或 None(原始尺寸), ...]，格式不合法时抛出ValueError
+    """
+    if isinstance(sizes, str):
+        sizes = [item for item in sizes.split(',') if item.strip()]
+    if not isinstance(sizes, (list, tuple)) or not sizes:
+        raise ValueError("sizes must be a non-empty list, e.g. [\"1200x627\", \"1080x1080\", \"full\"]")
+    if len(sizes) > MAX_SIZES:
+        raise ValueError(f"At most {MAX_SIZES} sizes can be requested at once")
+
+    parsed = []
+    for item in sizes:
+        if item is None or (isinstance(item, str) and item.strip().lower() in FULL_SIZE_NAMES):
+            parsed.append(None)
+            continue
+        try:
+            if isinstance(item, str):
+                width, height = item.lower().split('x')
+            elif isinstance(item, dict):
+                width, height = item['width'], item['height']
+            else:
+                width, height = item
+            width, height = int(width), int(height)
+        except (ValueError, TypeError, KeyError):
+            raise ValueError(f"Invalid size: {item!r}. Use \"WIDTHxHEIGHT\" or \"full\"")
+        if not (0 < width <= MAX_DIMENSION and 0 < height <= MAX_DIMENSION):
+            raise ValueError(f"Size {width}x{height} is out of range (1-{MAX_DIMENSION})")
+        if max_size and (width > max_size[0] or height > max_size[1]):
+            raise ValueError(f"Size {width}x{height} is larger than the poster "
+                             f"({max_size[0]}x{max_size[1]}); sizes can only scale the poster down")
+        parsed.append((width, height))
+    return parsed
+
+
+def size_label(size):
+    """尺寸的文本标识，用于文件名"""
+    return "full" if size is None else f"{size[0]}x{size[1]}"
+
+
+def derive_sizes(img, sizes, fit="contain", background=(0, 0, 0)):
+    """
+    从一次渲染的结果派生多个尺寸
+
+    先用reduce(2)逐级构建缩小金字塔（每级只需对上一级做2x2平均），每个目标尺寸从
+    不小于目标的最小一级出发，只做最后一小步LANCZOS缩放，而不是每个尺寸都从原图缩放。
+
+    参数:
+        img: 渲染完成的原尺寸图片
+        sizes: parse_sizes返回的尺寸列表
+        fit: 适配方式（contain / cover）
+        background: contain模式补边的背景色
+
+    返回:
+        list: [(size, Image), ...]，顺序与sizes相同
+    """
+    if fit not in FIT_MODES:
+        raise ValueError(f"fit must be one of: {', '.join(FIT_MODES)}")
+
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    full_width, full_height = img.size
+
+    # 金字塔按需扩展：pyramid[i] 为原图缩小 2**i 倍
+    pyramid = [img]
+
+    results = []
+    for size in sizes:
+        if size is None:
+            results.append((size, img))
+            continue
+
+        width, height = size
+        if width > full_width or height > full_height:
+            raise ValueError(f"Size {width}x{height} is larger than the poster ({full_width}x{full_height})")
+        if fit == "contain":
+            scale = min(width / full_width, height / full_height)
+        else:
+            scale = max(width / full_width, height / full_height)
+        scaled_size = (max(1, round(full_width * scale)), max(1, round(full_height * scale)))
+
+        # 找到不小于目标尺寸的最小一级
+        level = 0
+        while True:
+            if level + 1 >= len(pyramid):
+                current = pyramid[level]
+                if current.width // 2 < scaled_size[0] or current.height // 2 < scaled_size[1]:
+                    break
+                pyramid.append(current.reduce(2))
+            candidate = pyramid[level + 1]
+            if candidate.width < scaled_size[0] or candidate.height < scaled_size[1]:
+                break
+            level += 1
+
+        source = pyramid[level]
+        resized = source if source.size == scaled_size else source.resize(scaled_size, Image.LANCZOS)
+
+        if fit == "contain":
+            output = Image.new('RGB', (width, height), background)
+            output.paste(resized, ((width - resized.width) // 2, (height - resized.height) // 2))
+        else:
+            left = (resized.width - width) // 2
+            top = (resized.height - height) // 2
+            output = resized.crop((left, top, left + width, top + height))
+        results.append((size, output))
+
+    return results
@@ -0,0 +1,298 @@
+import io
+import os
+import time
+import hashlib
+import zipfile
+import threading
+from collections import deque
+from services.image_generator import generate_offer_poster_bytes, generate_offer_poster_sizes, DEFAULT_FONT_PATH
+from services.multi_size import size_label
+from services.render_cache import RenderCache, render_cache
+from services.image_encoder import format_key
+from services.render_pool import RenderPool
+from services.template_registry import template_registry
+from utils.zip_stream import ZipStreamWriter
+
+# 海报渲染的公共流程（缓存键、渲染进程池、多尺寸ZIP、批量ZIP、异步任务），
+# Web应用和独立的render_worker共用
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 渲染进程池：工作进程数默认等于CPU核数（0表示在调用线程中直接渲染），
+# 队列满时返回503并带上Retry-After
+RENDER_POOL_WORKERS = os.environ.get('RENDER_POOL_WORKERS')
+RENDER_QUEUE_SIZE = os.environ.get('RENDER_QUEUE_SIZE')
+RENDER_RETRY_AFTER = int(os.environ.get('RENDER_RETRY_AFTER', '2'))
+
+
+render_pool = None
+render_pool_lock = threading.Lock()
+
+
+def get_render_pool():
+    """获取渲染进程池，首次调用时创建并预热工作进程"""
+    global render_pool
+    with render_pool_lock:
+        if render_pool is None:
+            pool = RenderPool(
+                workers=int(RENDER_POOL_WORKERS) if RENDER_POOL_WORKERS else None,
+                max_queue=int(RENDER_QUEUE_SIZE) if RENDER_QUEUE_SIZE else None,
+                preload_banners=[template.banner_path for template in template_registry.all()],
+                preload_font=DEFAULT_FONT_PATH,
+                preload_layouts=[(template.render_layout, template.font_path) for template in template_registry.all()],
+                retry_after=RENDER_RETRY_AFTER
+            )
+            pids = pool.start()
+            print(f"渲染进程池已启动: {pool.workers} 个工作进程 {pids}, 队列上限 {pool.max_queue}")
+            render_pool = pool
+        return render_pool
+
+
+def poster_cache_key(recipient_name, offer_amount, team_name, team_name2,
+                     banner_path, output_format, encode_options, font_path=None, layout=None, **extra):
+    """计算海报在渲染缓存中的键（同时用作ETag）"""
+    params = {
+        "recipient_name": recipient_name,
+        "offer_amount": offer_amount,
+        "team_name": team_name,
+        "team_name2": team_name2,
+    }
+    params.update(extra)
+    return RenderCache.make_key(
+        params=params,
+        template_path=banner_path,
+        font_path=font_path or DEFAULT_FONT_PATH,
+        output_format=format_key(output_format, encode_options),
+        layout=layout
+    )
+
+
+def poster_request_key(recipient_name, offer_amount, team_name, team_name2,
+                       banner_path, output_format, encode_options, sizes=None, fit='contain', font_path=None,
+                       layout=None):
+    """计算一次海报请求（可能包含多个尺寸）在渲染缓存中的键"""
+    if sizes:
+        return poster_cache_key(
+            recipient_name, offer_amount, team_name, team_name2,
+            banner_path, output_format, encode_options, font_path, layout,
+            sizes=[size_label(size) for size in sizes], fit=fit
+        )
+    return poster_cache_key(
+        recipient_name, offer_amount, team_name, team_name2,
+        banner_path, output_format, encode_options, font_path, layout
+    )
+
+
+def generate_poster_sizes_zip(recipient_name, offer_amount, team_name, team_name2,
+                              banner_path, sizes, fit, output_format, encode_options, block=False,
+                              font_path=None, layout=None):
+    """
+    渲染一次海报并导出多个尺寸，打包为ZIP
+
+    参数block为True时等待渲染队列空位，否则队列满时抛出RenderQueueFull
+
+    返回:
+        (data, filename, info): ZIP字节、文件名和汇总的编码信息，失败时返回None
+    """
+    outputs = get_render_pool().run(
+        generate_offer_poster_sizes,
+        block=block,
+        recipient_name=recipient_name,
+        offer_amount=offer_amount,
+        team_name=team_name,
+        team_name2=team_name2,
+        banner_path=banner_path,
+        font_path=font_path,
+        layout=layout,
+        sizes=sizes,
+        fit=fit,
+        output_format=output_format,
+        encode_options=encode_options
+    )
+    if not outputs:
+        return None
+
+    # 图片已经压缩过，ZIP中直接存储
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for poster_bytes, filename, _ in outputs:
+            archive.writestr(filename, poster_bytes)
+
+    base_name = os.path.splitext(outputs[0][1])[0]
+    if sizes[0] is not None:
+        base_name = base_name.rsplit('_', 1)[0]
+    info = {
+        "mimetype": "application/zip",
+        "encode_ms": round(sum(output[2]['encode_ms'] for output in outputs), 2),
+        "sizes": [output[2]['size'] for output in outputs],
+    }
+    return buffer.getvalue(), f"{base_name}_sizes.zip", info
+
+
+def render_poster(cache_key, recipient_name, offer_amount, team_name, team_name2,
+                  banner_path, output_format, encode_options, sizes=None, fit='contain', block=False,
+                  font_path=None, layout=None):
+    """
+    渲染海报，优先使用渲染缓存，新渲染的结果存入缓存
+
+    返回:
+        (result, cache_status): result为(data, filename, info)，失败时为None；cache_status为HIT或MISS
+    """
+    cached = render_cache.get(cache_key)
+    if cached is not None:
+        print(f"渲染缓存命中: {cache_key}")
+        return cached, 'HIT'
+
+    # Generate the poster in memory
+    if sizes:
+        result = generate_poster_sizes_zip(
+            recipient_name, offer_amount, team_name, team_name2,
+            banner_path, sizes, fit, output_format, encode_options, block=block, font_path=font_path,
+            layout=layout
+        )
+    else:
+        result = get_render_pool().run(
+            generate_offer_poster_bytes,
+            block=block,
+            recipient_name=recipient_name,
+            offer_amount=offer_amount,
+            team_name=team_name,
+            team_name2=team_name2,
+            banner_path=banner_path,
+            font_path=font_path,
+            layout=layout,
+            output_format=output_format,
+            encode_options=encode_options
+        )
+
+    if result:
+        # 存入渲染缓存
+        render_cache.put(cache_key, *result)
+    return result, 'MISS'
+
+
+def generate_batch_zip(items, banner_path, output_format, encode_options, font_path=None, layout=None):
+    """
+    渲染一批海报，逐步生成ZIP数据（每张海报一个文件，最后附上manifest.json）
+
+    参数:
+        items: _parse_batch_items返回的 [(item, error), ...]
+
+    返回:
+        生成器，依次产生ZIP的字节块
+    """
+    pool = get_render_pool()
+    # 每张海报完成后立即输出对应的ZIP数据，不在内存中缓存整个压缩包
+    writer = ZipStreamWriter()
+    manifest = []
+    start_time = time.perf_counter()
+    # 同时提交给进程池的海报数不超过工作进程数，按提交顺序写入ZIP
+    window = max(1, pool.workers)
+    pending = deque()
+
+    def complete(entry, cache_key, job, item_start):
+        error = entry.pop("error", None)
+        if error is None:
+            try:
+                if isinstance(job, tuple):
+                    poster_bytes, filename = job[0], job[1]
+                else:
+                    result = job.result()
+                    if not result:
+                        raise RuntimeError("Failed to generate poster")
+                    poster_bytes, filename, encode_info = result
+                    render_cache.put(cache_key, poster_bytes, filename, encode_info)
+
+                archive_name = f"{entry['index']:04d}_{filename}"
+                writer.add(archive_name, poster_bytes)
+                entry.update({
+                    "status": "ok",
+                    "file": archive_name,
+                    "bytes": len(poster_bytes),
+                    "elapsed_ms": round((time.perf_counter() - item_start) * 1000, 2)
+                })
+            except Exception as e:
+                error = str(e)
+
+        if error is not None:
+            print(f"Batch item {entry['index']} failed: {error}")
+            entry.update({"status": "error", "error": error})
+        manifest.append(entry)
+
+    for index, (item, error) in enumerate(items):
+        entry = {"index": index}
+        if error is None and not isinstance(item, dict):
+            error = "Each item must be a JSON object"
+        if error is None:
+            entry["id"] = item.get('id')
+            missing = [field for field in ('recipient_name', 'offer_amount', 'team_name') if not item.get(field)]
+            if missing:
+                error = f"Missing required parameters: {', '.join(missing)}"
+
+        cache_key = job = None
+        item_start = time.perf_counter()
+        if error is None:
+            try:
+                cache_key = poster_cache_key(
+                    item['recipient_name'], item['offer_amount'], item['team_name'], item.get('team_name2'),
+                    banner_path, output_format, encode_options, font_path, layout
+                )
+                job = render_cache.get(cache_key)
+                if job is None:
+                    # 批量请求等待队列空位，而不是直接拒绝
+                    job = pool.submit(
+                        generate_offer_poster_bytes,
+                        block=True,
+                        recipient_name=item['recipient_name'],
+                        offer_amount=item['offer_amount'],
+                        team_name=item['team_name'],
+                        team_name2=item.get('team_name2'),
+                        banner_path=banner_path,
+                        font_path=font_path,
+                        layout=layout,
+                        output_format=output_format,
+                        encode_options=encode_options
+                    )
+            except Exception as e:
+                error = str(e)
+        if error is not None:
+            entry["error"] = error
+
+        pending.append((entry, cache_key, job, item_start))
+        while len(pending) > window:
+            complete(*pending.popleft())
+            yield from writer.drain()
+
+    while pending:
+        complete(*pending.popleft())
+        yield from writer.drain()
+
+    succeeded = sum(1 for entry in manifest if entry["status"] == "ok")
+    writer.add_json('manifest.json', {
+        "total": len(manifest),
+        "succeeded": succeeded,
+        "failed": len(manifest) - succeeded,
+        "format": output_format,
+        "elapsed_ms": round((time.perf_counter() - start_time) * 1000, 2),
+        "items": manifest
+    })
+    yield from writer.close()
+
+
+def run_render_job(job_type, payload):
+    """
+    执行异步渲染任务（在任务管理器的后台线程中调用）
+
+    返回:
+        (data, filename, info, etag): 结果字节、文件名、编码信息和ETag
+    """
+    if job_type == 'batch':
+        data = b''.join(generate_batch_zip(**payload))
+        filename = f"posters_{time.strftime('%Y%m%d_%H%M%S')}.zip"
+        return data, filename, {"mimetype": "application/zip"}, hashlib.sha256(data).hexdigest()
+
+    # 后台任务等待渲染队列空位，而不是直接失败
+    result, _ = render_poster(block=True, **payload)
+    if not result:
+        raise RuntimeError("Failed to generate poster")
+    return result[0], result[1], result[2], payload['cache_key']
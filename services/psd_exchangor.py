@@ -1,229 +1,291 @@
-from psd_tools import PSDImage
-from psd_tools.constants import Resource
+import os
+import sys
+import json
 import math
+import hashlib
+import argparse
 
-# 加载 PSD 文件
-psd_file = PSDImage.open('../assets/psd/源文件.psd')
-
-# 遍历所有图层，找到并打印文字图层的内容
-text_layers = []
-for layer in psd_file:
-    if layer.is_group():
-        # 如果是图层组，递归遍历子图层
-        for sublayer in layer:
-            if sublayer.kind == 'type':  # 检查是否为文字图层
-                print(f"图层名称: {sublayer.name}, 文字内容: {sublayer.text}")
-                text_layers.append(sublayer)
-    elif layer.kind == 'type':  # 检查是否为文字图层
-        print(f"图层名称: {layer.name}, 文字内容: {layer.text}")
-        text_layers.append(layer)
-
-
-# 遍历所有图层，查找文字图层并打印其位置
-# 遍历所有图层，查找文字图层并打印其位置、倾斜角度、字体大小和字体类型
-for layer in psd_file:
-    if layer.is_group():
-        # 如果是图层组，递归遍历子图层
-        for sublayer in layer:
-            if sublayer.kind == 'type':  # 检查是否为文字图层
-                print(f"图层名称: {sublayer.name}")
-                print(f"文字内容: {sublayer.text}")
-                
-                # 获取位置（使用 offset 或 bbox）
-                if hasattr(sublayer, 'offset'):
-                    x, y = sublayer.offset  # 偏移量，通常是左上角的坐标
-                    print(f"位置 (x, y): ({x}, {y})")
-                elif hasattr(sublayer, 'bbox'):
-                    bbox = sublayer.bbox  # 边界框，包含左、上、右、下的坐标
-                    print(f"边界框 (left, top, right, bottom): {bbox}")
-                
-                # 尝试获取倾斜角度
-                shear_angle = None
-                if hasattr(sublayer, 'transform'):
-                    transform = sublayer.transform
-                    print(f"变换矩阵: {transform}")
-                    if len(transform) >= 6:  # 确保矩阵有足够元素
-                        a, b, c, d, tx, ty = transform[:6]  # 提取前6个元素
-                        if abs(d) > 0:  # 避免除以零
-                            shear_angle = math.degrees(math.atan2(b, d))  # 使用 atan2 计算角度（单位：度）
-                        elif abs(c) > 0:
-                            shear_angle = math.degrees(math.atan2(c, a))
-                        else:
-                            shear_angle = 0  # 默认无倾斜
-                elif hasattr(sublayer, '_engine_data'):
-                    engine_data = sublayer._engine_data
-                    if 'Transform' in engine_data:
-                        transform_data = engine_data['Transform']
-                        print(f"变换数据: {transform_data}")
-                        if isinstance(transform_data, dict):
-                            if 'a' in transform_data and 'b' in transform_data:
-                                a, b = transform_data['a'], transform_data['b']
-                                shear_angle = math.degrees(math.atan2(b, a))  # 假设 a, b 表示倾斜
-                    if 'Warp' in engine_data:  # 扭曲（可能包含倾斜）
-                        warp_data = engine_data['Warp']
-                        print(f"扭曲数据: {warp_data}")
-                else:
-                    print("无法获取倾斜角度，请检查 transform 或 engine_data")
-
-                if shear_angle is not None:
-                    print(f"倾斜角度: {shear_angle:.2f} 度")
-                else:
-                    print("未找到倾斜角度信息")
-                
-                # 尝试获取字体大小和字体类型
-                font_size = None
-                font_type = None
-                if hasattr(sublayer, '_engine_data'):
-                    engine_data = sublayer._engine_data
-                    if 'EngineDict' in engine_data:
-                        engine_dict = engine_data['EngineDict']
-                        if 'Editor' in engine_dict:
-                            editor = engine_dict['Editor']
-                            # 查找字体大小
-                            if 'FontSize' in editor:
-                                font_size = editor['FontSize']
-                            elif 'Size' in editor:  # 可能使用其他键
-                                font_size = editor['Size']
-                            # 查找字体类型
-                            if 'FontSet' in engine_dict:
-                                font_set = engine_dict['FontSet']
-                                if isinstance(font_set, dict) and 'Name' in font_set:
-                                    font_type = font_set['Name']
-                                elif isinstance(font_set, list) and len(font_set) > 0:
-                                    font_type = font_set[0].get('Name', '未知字体')
-                            elif 'FontName' in editor:  # 可能使用其他键
-                                font_type = editor['FontName']
-                    elif 'Transform' in engine_data:  # 某些情况下字体大小可能在 Transform 中
-                        transform_data = engine_data['Transform']
-                        if isinstance(transform_data, dict) and 'FontSize' in transform_data:
-                            font_size = transform_data['FontSize']
-                elif hasattr(sublayer, 'engine_dict'):
-                    engine_dict = sublayer.engine_dict
-                    if 'Editor' in engine_dict:
-                        editor = engine_dict['Editor']
-                        if 'FontSize' in editor:
-                            font_size = editor['FontSize']
-                        if 'FontSet' in engine_dict:
-                            font_set = engine_dict['FontSet']
-                            if isinstance(font_set, dict) and 'Name' in font_set:
-                                font_type = font_set['Name']
-                            elif isinstance(font_set, list) and len(font_set) > 0:
-                                font_type = font_set[0].get('Name', '未知字体')
-
-                if font_size is not None:
-                    print(f"字体大小: {font_size} px")
-                else:
-                    print("未找到字体大小信息")
-                
-                if font_type is not None:
-                    print(f"字体类型: {font_type}")
-                else:
-                    print("未找到字体类型信息")
-    elif layer.kind == 'type':  # 检查是否为文字图层
-        print(f"图层名称: {layer.name}")
-        print(f"文字内容: {layer.text}")
-        
-        # 获取位置
-        if hasattr(layer, 'offset'):
-            x, y = layer.offset
-            print(f"位置 (x, y): ({x}, {y})")
-        elif hasattr(layer, 'bbox'):
-            bbox = layer.bbox
-            print(f"边界框 (left, top, right, bottom): {bbox}")
-        
-        # 尝试获取倾斜角度
-        shear_angle = None
-        if hasattr(layer, 'transform'):
-            transform = layer.transform
-            print(f"变换矩阵: {transform}")
-            if len(transform) >= 6:
-                a, b, c, d, tx, ty = transform[:6]
-                if abs(d) > 0:
-                    shear_angle = math.degrees(math.atan2(b, d))
-                elif abs(c) > 0:
-                    shear_angle = math.degrees(math.atan2(c, a))
-                else:
-                    shear_angle = 0
-        elif hasattr(layer, '_engine_data'):
-            engine_data = layer._engine_data
-            if 'Transform' in engine_data:
-                transform_data = engine_data['Transform']
-                print(f"变换数据: {transform_data}")
-                if isinstance(transform_data, dict):
-                    if 'a' in transform_data and 'b' in transform_data:
-                        a, b = transform_data['a'], transform_data['b']
-                        shear_angle = math.degrees(math.atan2(b, a))
-            if 'Warp' in engine_data:
-                warp_data = engine_data['Warp']
-                print(f"扭曲数据: {warp_data}")
-        else:
-            print("无法获取倾斜角度，请检查 transform 或 engine_data")
-
-        if shear_angle is not None:
-            print(f"倾斜角度: {shear_angle:.2f} 度")
-        else:
-            print("未找到倾斜角度信息")
-        
-        # 尝试获取字体大小和字体类型
-        font_size = None
-        font_type = None
-        if hasattr(layer, '_engine_data'):
-            engine_data = layer._engine_data
-            if 'EngineDict' in engine_data:
-                engine_dict = engine_data['EngineDict']
-                if 'Editor' in engine_dict:
-                    editor = engine_dict['Editor']
-                    if 'FontSize' in editor:
-                        font_size = editor['FontSize']
-                    elif 'Size' in editor:
-                        font_size = editor['Size']
-                    if 'FontSet' in engine_dict:
-                        font_set = engine_dict['FontSet']
-                        if isinstance(font_set, dict) and 'Name' in font_set:
-                            font_type = font_set['Name']
-                        elif isinstance(font_set, list) and len(font_set) > 0:
-                            font_type = font_set[0].get('Name', '未知字体')
-                    elif 'FontName' in editor:
-                        font_type = editor['FontName']
-            elif 'Transform' in engine_data:
-                transform_data = engine_data['Transform']
-                if isinstance(transform_data, dict) and 'FontSize' in transform_data:
-                    font_size = transform_data['FontSize']
-        elif hasattr(layer, 'engine_dict'):
-            engine_dict = layer.engine_dict
-            if 'Editor' in engine_dict:
-                editor = engine_dict['Editor']
-                if 'FontSize' in editor:
-                    font_size = editor['FontSize']
-                if 'FontSet' in engine_dict:
-                    font_set = engine_dict['FontSet']
-                    if isinstance(font_set, dict) and 'Name' in font_set:
-                        font_type = font_set['Name']
-                    elif isinstance(font_set, list) and len(font_set) > 0:
-                        font_type = font_set[0].get('Name', '未知字体')
-
-        if font_size is not None:
-            print(f"字体大小: {font_size} px")
-        else:
-            print("未找到字体大小信息")
-        
-        if font_type is not None:
-            print(f"字体类型: {font_type}")
-        else:
-            print("未找到字体类型信息")
-            
-# 保存修改后的 PSD 文件（可选：如果需要保留 PSD 格式）
-psd_file.save('测试件_修改后.psd')
-
-# 如果需要生成图片，可以使用以下代码（需要 Pillow）
-from PIL import Image
-image = psd_file.composite()  # 合成所有图层
-image.save('测试件_输出.png', 'PNG')  # 保存为 PNG 文件
-print("已生成输出图片：测试件_输出.png")
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 编译结果和对应的模板定义所在目录；容器中放在挂载的assets目录之外，避免被卷覆盖（见Dockerfile）
+COMPILED_DIR = os.environ.get("COMPILED_TEMPLATES_DIR") or os.path.join(BASE_DIR, "assets", "templates", "compiled")
+TEMPLATES_DIR = os.path.join(BASE_DIR, "assets", "templates")
+FONTS_DIR = os.path.join(BASE_DIR, "assets", "fonds")
 
+LAYOUT_VERSION = 2
+BACKGROUND_NAME = "background.png"
+LAYOUT_NAME = "layout.json"
 
+# Photoshop段落对齐方式（ParagraphSheet.Properties.Justification）
+JUSTIFICATIONS = {0: "left", 1: "right", 2: "center"}
 
+# PSD模板编译器：把PSD拆成去掉文字图层的背景图和描述文字位置的排版JSON，
+# 结果按PSD内容的sha256缓存，渲染时只读取编译结果，不再解析PSD
 
 
+def file_sha256(path):
+    """计算文件内容的sha256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
 
 
+def find_font_file(font_name, fonts_dir=FONTS_DIR):
+    """
+    按PostScript字体名在字体目录中查找字体文件（忽略大小写和连字符）
+
+    返回:
+        str: 字体文件路径，找不到时返回None
+    """
+    wanted = font_name.lower().replace('-', '').replace(' ', '')
+    try:
+        names = sorted(os.listdir(fonts_dir))
+    except OSError:
+        return None
+    for name in names:
+        stem, ext = os.path.splitext(name)
+        if ext.lower() in ('.ttf', '.otf', '.ttc') and stem.lower().replace('-', '').replace(' ', '') == wanted:
+            return os.path.join(fonts_dir, name)
+    return None
+
+
+def _dominant_style(engine_dict):
+    """字符数最多的样式（例如金额中较小的$符号不决定字号）"""
+    runs = engine_dict['StyleRun']
+    styles, lengths = {}, {}
+    for length, run in zip(runs['RunLengthArray'], runs['RunArray']):
+        style = run['StyleSheet']['StyleSheetData']
+        key = (int(style.get('Font', 0)), float(style.get('FontSize', 0)))
+        styles.setdefault(key, style)
+        lengths[key] = lengths.get(key, 0) + int(length)
+    return styles[max(lengths, key=lengths.get)]
+
+
+def _unrotated_size(bbox, angle):
+    """由旋转后的外接矩形反推文字本身的宽高"""
+    left, top, right, bottom = bbox
+    width, height = right - left, bottom - top
+    cos, sin = abs(math.cos(math.radians(angle))), abs(math.sin(math.radians(angle)))
+    det = cos * cos - sin * sin
+    if abs(det) < 1e-6:
+        return width, height
+    return (width * cos - height * sin) / det, (height * cos - width * sin) / det
+
+
+def extract_slot(layer, slot_id, fonts_dir=FONTS_DIR):
+    """
+    从一个文字图层中提取排版信息
+
+    参数:
+        layer: psd_tools的文字图层
+        slot_id: 文字位的ID
+
+    返回:
+        dict: 位置（基线锚点）、旋转角度、字体、字号（字符数最多的样式）、对齐方式、最大宽度和颜色
+    """
+    xx, xy, yx, yy, tx, ty = (float(value) for value in layer.transform)
+    style = _dominant_style(layer.engine_dict)
+    baseline_shift = float(style.get('BaselineShift', 0))
+    paragraph = layer.engine_dict['ParagraphRun']['RunArray'][0]['ParagraphSheet']['Properties']
+    font_set = layer.resource_dict['FontSet']
+    font_name = str(font_set[int(style.get('Font', 0))]['Name']).strip("'")
+
+    # 变换矩阵中的缩放乘以字号才是画布上的像素字号；Photoshop顺时针为正，
+    # ImageEditor的rotation_angle逆时针为正
+    scale = math.hypot(xx, xy)
+    angle = -math.degrees(math.atan2(xy, xx))
+    # 基线锚点：文字坐标系中的原点按基线偏移上移后，经变换矩阵映射到画布
+    anchor_x, anchor_y = tx - yx * baseline_shift, ty - yy * baseline_shift
+    width, _ = _unrotated_size(layer.bbox, angle)
+    size = round(float(style.get('FontSize', 0)) * scale)
+
+    color = "#ffffff"
+    fill = style.get('FillColor')
+    if fill is not None and len(fill['Values']) == 4:
+        # 值为 [alpha, r, g, b]，范围0-1
+        color = "#" + "".join(f"{round(float(value) * 255):02x}" for value in list(fill['Values'])[1:])
+
+    font_path = find_font_file(font_name, fonts_dir)
+    return {
+        "id": slot_id,
+        "layer": layer.name,
+        "text": layer.text,
+        "position": [round(anchor_x, 1), round(anchor_y, 1)],
+        "anchor": "baseline",
+        "align": JUSTIFICATIONS.get(int(paragraph.get('Justification', 0)), "left"),
+        "angle": round(angle, 2),
+        "font": font_name,
+        "font_path": os.path.relpath(font_path, BASE_DIR) if font_path else None,
+        "size": size,
+        # 比示例文字长的文字在max_width内缩小，最小为原字号的一半
+        "min_size": max(1, round(size / 2)),
+        "max_width": round(width),
+        "color": color,
+        "bbox": list(layer.bbox),
+    }
+
+
+def _apply_templates(slots, templates):
+    """按文字位ID设置文字模板（见services/layout_plan.py），返回是否有变化"""
+    changed = False
+    for slot in slots:
+        template = templates.get(slot["id"])
+        if template is None:
+            # 没有指定模板时保留图层文字首尾的空白（例如给背景中的@留出的位置）
+            text = slot["text"]
+            lead, trail = text[:len(text) - len(text.lstrip())], text[len(text.rstrip()):]
+            if lead or trail:
+                template = lead + "{" + slot["id"] + "}" + trail
+        if slot.get("template") != template:
+            if template is None:
+                slot.pop("template", None)
+            else:
+                slot["template"] = template
+            changed = True
+    return changed
+
+
+def _write_json(path, data):
+    # 先写临时文件再替换，并发编译或中断时不会留下不完整的结果
+    temp_path = os.path.join(os.path.dirname(path), f".{os.getpid()}.{os.path.basename(path)}")
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, path)
+
+
+def compile_psd(psd_path, slot_names=None, output_root=COMPILED_DIR, fonts_dir=FONTS_DIR, force=False,
+                templates=None):
+    """
+    编译PSD模板：输出去掉文字图层的背景图和排版JSON
+
+    编译结果放在 output_root/<PSD内容sha256前16位>/ 下，内容相同的PSD直接返回已有结果。
+
+    参数:
+        psd_path: PSD文件路径
+        slot_names: {图层名: 文字位ID}，未列出的文字图层按顺序命名为slot_1、slot_2...
+        output_root: 编译结果目录
+        fonts_dir: 查找字体文件的目录
+        force: 忽略已有结果重新编译
+        templates: {文字位ID: 文字模板}，例如 {"team_name": "FROM {team_name} Team!"}，
+                   未指定的文字位直接使用对应的渲染参数
+
+    返回:
+        (layout_path, layout): 排版JSON的路径和内容
+    """
+    slot_names = {name.strip(): slot_id for name, slot_id in (slot_names or {}).items()}
+    templates = templates or {}
+    digest = file_sha256(psd_path)
+    output_dir = os.path.join(output_root, digest[:16])
+    layout_path = os.path.join(output_dir, LAYOUT_NAME)
+    if not force and os.path.exists(layout_path):
+        with open(layout_path, encoding='utf-8') as f:
+            layout = json.load(f)
+        # 同一个PSD换了文字位命名或编译器版本变化时需要重新编译，只换了文字模板时直接更新
+        if layout.get("version") == LAYOUT_VERSION and layout.get("source", {}).get("sha256") == digest and \
+                all(slot["id"] == slot_names.get(slot["layer"].strip(), slot["id"]) for slot in layout["slots"]):
+            if _apply_templates(layout["slots"], templates):
+                _write_json(layout_path, layout)
+            print(f"使用已编译的模板: {layout_path}")
+            return layout_path, layout
+
+    from psd_tools import PSDImage
+
+    print(f"编译PSD模板: {psd_path}")
+    psd = PSDImage.open(psd_path)
+    slots = []
+    for layer in psd.descendants():
+        if layer.kind == 'type' and layer.is_visible():
+            slot_id = slot_names.get(layer.name.strip(), f"slot_{len(slots) + 1}")
+            slots.append(extract_slot(layer, slot_id, fonts_dir))
+    _apply_templates(slots, templates)
+
+    # 合成时去掉文字图层，只保留背景
+    background = psd.composite(layer_filter=lambda layer: layer.is_visible() and layer.kind != 'type')
+
+    os.makedirs(output_dir, exist_ok=True)
+    # 背景图同样先写临时文件再替换
+    background_temp = os.path.join(output_dir, f".{os.getpid()}.{BACKGROUND_NAME}")
+    background.save(background_temp, 'PNG')
+    os.replace(background_temp, os.path.join(output_dir, BACKGROUND_NAME))
+
+    layout = {
+        "version": LAYOUT_VERSION,
+        "source": {"psd": os.path.relpath(os.path.abspath(psd_path), BASE_DIR), "sha256": digest},
+        "canvas": list(psd.size),
+        "background": BACKGROUND_NAME,
+        "slots": slots,
+    }
+    _write_json(layout_path, layout)
+    print(f"已生成: {output_dir} ({len(slots)} 个文字位)")
+    return layout_path, layout
+
+
+def write_template_manifest(template_id, layout_path, layout, name=None, templates_dir=TEMPLATES_DIR):
+    """
+    为编译结果生成模板定义，模板注册表会自动加载
+
+    返回:
+        str: 模板定义文件路径
+    """
+    layout_dir = os.path.dirname(layout_path)
+    font_paths = [slot["font_path"] for slot in layout["slots"] if slot.get("font_path")]
+    manifest = {
+        "id": template_id,
+        "name": name or template_id,
+        "banner": os.path.relpath(os.path.join(layout_dir, layout["background"]), templates_dir),
+        "layout": os.path.relpath(layout_path, templates_dir),
+    }
+    if font_paths:
+        manifest["font"] = os.path.relpath(os.path.join(BASE_DIR, font_paths[0]), templates_dir)
+    manifest_path = os.path.join(templates_dir, f"{template_id}.json")
+    os.makedirs(templates_dir, exist_ok=True)
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest_path
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="把PSD编译为背景图和排版JSON")
+    parser.add_argument("psd", nargs='+', help="PSD文件")
+    parser.add_argument("--slot", action='append', default=[], metavar="图层名=ID",
+                        help="为文字图层指定文字位ID，例如 '$55,392=offer_amount'，可重复")
+    parser.add_argument("--template", action='append', default=[], metavar="ID=模板",
+                        help="文字位的文字模板，例如 'team_name=FROM {team_name} Team!'，可重复")
+    parser.add_argument("--id", default=None, help="生成的模板ID（只有一个PSD时可用，默认使用文件名）")
+    parser.add_argument("--output", default=COMPILED_DIR,
+                        help="编译结果目录，模板定义也写在这里（默认$COMPILED_TEMPLATES_DIR或assets/templates/compiled）")
+    parser.add_argument("--no-manifest", action='store_true', help="不生成模板定义")
+    parser.add_argument("--force", action='store_true', help="忽略缓存重新编译")
+    args = parser.parse_args()
+
+    slot_names = {}
+    for value in args.slot:
+        layer_name, sep, slot_id = value.rpartition('=')
+        if not sep or not layer_name or not slot_id:
+            parser.error(f"--slot的格式应为 图层名=ID: {value}")
+        slot_names[layer_name] = slot_id
+    templates = {}
+    for value in args.template:
+        slot_id, sep, template = value.partition('=')
+        if not sep or not slot_id:
+            parser.error(f"--template的格式应为 ID=模板: {value}")
+        templates[slot_id] = template
+    if args.id and len(args.psd) > 1:
+        parser.error("--id只能用于单个PSD")
+
+    for psd_path in args.psd:
+        layout_path, layout = compile_psd(psd_path, slot_names, args.output, force=args.force, templates=templates)
+        for slot in layout["slots"]:
+            print(f"  {slot['id']}: {slot['layer']!r} at {slot['position']} angle={slot['angle']} "
+                  f"size={slot['size']} align={slot['align']} max_width={slot['max_width']} font={slot['font']}")
+        if not args.no_manifest:
+            template_id = args.id or os.path.splitext(os.path.basename(psd_path))[0]
+            manifest_path = write_template_manifest(template_id, layout_path, layout, templates_dir=args.output)
+            print(f"  模板定义: {manifest_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,203 @@
+import os
+import json
+import time
+import threading
+
+
+class RateCache:
+    """
+    进程级的汇率缓存（TTL + stale-while-revalidate）
+
+    缓存未过期时直接返回；过期但不超过max_stale时立即返回旧值，同时在后台启动一次刷新
+    （同一时间只有一个刷新在进行）；没有可用数据时同步刷新，并发请求等待同一次刷新的结果。
+    每次刷新成功后把快照写入磁盘，冷启动的进程和其他gunicorn工作进程直接从快照读取。
+    """
+
+    def __init__(self, fetch, ttl=60, max_stale=3600, snapshot_path=None, retry_interval=10):
+        """
+        初始化汇率缓存
+
+        参数:
+            fetch: 从上游获取全部汇率的函数，返回 {货币代码: 汇率}
+            ttl: 汇率的有效秒数
+            max_stale: 过期后仍可返回旧值的秒数，超出后同步刷新
+            snapshot_path: 磁盘快照路径，None表示不持久化
+            retry_interval: 刷新失败后至少间隔多少秒再重试
+        """
+        self.fetch = fetch
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.snapshot_path = snapshot_path
+        self.retry_interval = retry_interval
+        self._lock = threading.Lock()
+        self._refreshed = threading.Condition(self._lock)
+        self._rates = None
+        self._fetched_at = 0.0
+        self._snapshot_mtime = 0.0
+        self._refreshing = False
+        self._last_failure = 0.0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.snapshot_loads = 0
+        self.last_error = None
+
+        # 冷启动时先使用磁盘上的快照
+        self._load_snapshot()
+
+    def _load_snapshot(self):
+        """磁盘快照比内存中的数据新时（例如由其他进程刷新）加载快照"""
+        if not self.snapshot_path:
+            return
+        try:
+            mtime = os.path.getmtime(self.snapshot_path)
+        except OSError:
+            return
+        if mtime <= self._snapshot_mtime:
+            return
+        try:
+            with open(self.snapshot_path, encoding='utf-8') as f:
+                snapshot = json.load(f)
+            rates, fetched_at = snapshot["rates"], float(snapshot["fetched_at"])
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"读取汇率快照失败: {self.snapshot_path}, 错误: {e}")
+            return
+        with self._lock:
+            self._snapshot_mtime = mtime
+            if fetched_at > self._fetched_at and rates:
+                self._rates = rates
+                self._fetched_at = fetched_at
+                self.snapshot_loads += 1
+
+    def _save_snapshot(self, rates, fetched_at):
+        # 先写临时文件再替换，其他进程不会读到写了一半的快照
+        if not self.snapshot_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.snapshot_path)), exist_ok=True)
+            temp_path = f"{self.snapshot_path}.{os.getpid()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({"fetched_at": fetched_at, "rates": rates}, f)
+            os.replace(temp_path, self.snapshot_path)
+            self._snapshot_mtime = os.path.getmtime(self.snapshot_path)
+        except OSError as e:
+            print(f"写入汇率快照失败: {self.snapshot_path}, 错误: {e}")
+
+    def _refresh(self):
+        """从上游获取汇率；调用前需已把self._refreshing置为True"""
+        try:
+            rates = self.fetch()
+            if not rates:
+                raise RuntimeError("upstream returned no rates")
+        except Exception as e:
+            print(f"刷新汇率失败: {e}")
+            with self._lock:
+                self.refresh_errors += 1
+                self.last_error = str(e)
+                self._last_failure = time.time()
+                self._refreshing = False
+                self._refreshed.notify_all()
+            return
+
+        fetched_at = time.time()
+        with self._lock:
+            # 上游这次没有返回的货币保留旧值
+            self._rates = dict(self._rates or {}, **rates)
+            self._fetched_at = fetched_at
+            self.refreshes += 1
+            self.last_error = None
+            snapshot = dict(self._rates)
+        self._save_snapshot(snapshot, fetched_at)
+        with self._lock:
+            self._refreshing = False
+            self._refreshed.notify_all()
+
+    def _start_refresh_locked(self, now):
+        # 调用方需持有self._lock；返回是否由本次调用负责刷新
+        if self._refreshing or now - self._last_failure < self.retry_interval:
+            return False
+        self._refreshing = True
+        return True
+
+    def get(self, timeout=30):
+        """
+        获取全部汇率
+
+        参数:
+            timeout: 没有可用数据时等待刷新完成的最长秒数
+
+        返回:
+            dict: {货币代码: 汇率}，上游不可用且没有旧数据时返回空字典
+        """
+        now = time.time()
+        with self._lock:
+            if self._rates is not None and now - self._fetched_at < self.ttl:
+                self.hits += 1
+                return dict(self._rates)
+
+        # 其他进程可能已经刷新并写入了快照
+        self._load_snapshot()
+
+        with self._lock:
+            age = now - self._fetched_at
+            if self._rates is not None and age < self.ttl:
+                self.hits += 1
+                return dict(self._rates)
+
+            if self._rates is not None and age < self.ttl + self.max_stale:
+                # 返回旧值，后台刷新
+                self.stale_hits += 1
+                if self._start_refresh_locked(now):
+                    threading.Thread(target=self._refresh, name="rate-refresh", daemon=True).start()
+                return dict(self._rates)
+
+            self.misses += 1
+            refresh_here = self._start_refresh_locked(now)
+            if not refresh_here:
+                # 等待正在进行的刷新
+                self._refreshed.wait_for(lambda: not self._refreshing, timeout)
+
+        if refresh_here:
+            self._refresh()
+
+        with self._lock:
+            return dict(self._rates or {})
+
+    def clear(self):
+        """清空内存中的汇率（磁盘快照保留），返回被移除的条目数"""
+        try:
+            # 当前的快照不再加载，之后其他进程写入的新快照仍然会被加载
+            snapshot_mtime = os.path.getmtime(self.snapshot_path) if self.snapshot_path else 0.0
+        except OSError:
+            snapshot_mtime = 0.0
+        with self._lock:
+            removed = len(self._rates or {})
+            self._rates = None
+            self._fetched_at = 0.0
+            self._snapshot_mtime = max(self._snapshot_mtime, snapshot_mtime)
+            self._last_failure = 0.0
+            return removed
+
+    def stats(self):
+        """
+        获取缓存统计信息
+
+        返回:
+            dict: 汇率数量、数据年龄、命中/旧值/未命中次数和刷新情况
+        """
+        with self._lock:
+            return {
+                "entries": len(self._rates or {}),
+                "ttl": self.ttl,
+                "age_seconds": round(time.time() - self._fetched_at, 1) if self._rates else None,
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "refreshes": self.refreshes,
+                "refresh_errors": self.refresh_errors,
+                "snapshot_loads": self.snapshot_loads,
+                "refreshing": self._refreshing,
+                "last_error": self.last_error,
+            }
@@ -0,0 +1,189 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # Windows：只在进程内加锁
+    fcntl = None
+
+# 每列都是小端float64的原始文件，可直接用np.memmap映射
+DTYPE = np.dtype('<f8')
+TIMESTAMP_COLUMN = "timestamp"
+
+
+def parse_timestamps(values):
+    """
+    把日期列解析为Unix时间戳（秒）
+
+    支持ISO 8601字符串和数字时间戳；只有日期（YYYY-MM-DD）时取当天结束前的最后时刻，
+    即当天最后一次记录的汇率。空值和无法解析的值为NaN（表示使用当前汇率）。
+
+    参数:
+        values: 日期列表
+
+    返回:
+        numpy.ndarray: float64时间戳
+    """
+    series = pd.Series(values, dtype=object)
+    numeric = pd.to_numeric(series, errors='coerce')
+    text = series.where(numeric.isna()).astype('string')
+    parsed = pd.to_datetime(text, utc=True, errors='coerce', format='ISO8601')
+    seconds = (parsed - pd.Timestamp(0, tz='UTC')).dt.total_seconds()
+    date_only = text.str.fullmatch(r"\d{4}-\d{2}-\d{2}").fillna(False).astype(bool)
+    seconds[date_only] += 86400 - 1e-6
+    return numeric.fillna(seconds).to_numpy(dtype=np.float64)
+
+
+class RateHistory:
+    """
+    汇率历史（列式存储）
+
+    每个货币一个float64列文件，外加一个时间戳列，每次刷新汇率追加一行。文件以只读
+    np.memmap映射，按时间点批量查询汇率时只读取用到的页；多个进程共用同一个目录，
+    追加时用文件锁串行化，读取时发现文件变长会重新映射。
+    """
+
+    def __init__(self, path, currencies):
+        """
+        初始化汇率历史
+
+        参数:
+            path: 存放列文件的目录
+            currencies: 货币代码列表（USD为基准货币，不需要存储）
+        """
+        self.path = path
+        self.currencies = list(currencies)
+        self._lock = threading.Lock()
+        self._mapped_rows = -1
+        self._timestamps = None
+        self._columns = {}
+        self.appends = 0
+        os.makedirs(path, exist_ok=True)
+
+    def _column_path(self, name):
+        return os.path.join(self.path, f"{name}.f8")
+
+    def _rows(self):
+        # 时间戳列最后写入，它的长度就是完整写入的行数
+        try:
+            return os.path.getsize(self._column_path(TIMESTAMP_COLUMN)) // DTYPE.itemsize
+        except OSError:
+            return 0
+
+    def _file_lock(self):
+        fd = os.open(os.path.join(self.path, ".lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        return fd
+
+    def _file_unlock(self, fd):
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    def append(self, timestamp, rates):
+        """
+        追加一行汇率
+
+        参数:
+            timestamp: 汇率获取时间（Unix时间戳）
+            rates: {货币代码: 汇率}，缺少的货币记为NaN
+
+        返回:
+            bool: 是否追加（时间不晚于最后一行时不追加，例如其他进程已经写入）
+        """
+        with self._lock:
+            fd = self._file_lock()
+            try:
+                rows = self._rows()
+                if rows:
+                    with open(self._column_path(TIMESTAMP_COLUMN), 'rb') as f:
+                        f.seek((rows - 1) * DTYPE.itemsize)
+                        if timestamp <= np.frombuffer(f.read(DTYPE.itemsize), dtype=DTYPE)[0]:
+                            return False
+                for code in self.currencies:
+                    self._append_value(self._column_path(code), rows, rates.get(code, np.nan))
+                self._append_value(self._column_path(TIMESTAMP_COLUMN), rows, timestamp)
+                self.appends += 1
+                return True
+            finally:
+                self._file_unlock(fd)
+
+    def _append_value(self, path, rows, value):
+        # 列长度先对齐到rows：中断的写入截掉，新增的货币在前面补NaN
+        with open(path, 'a+b') as f:
+            length = f.tell() // DTYPE.itemsize
+            if length > rows:
+                f.truncate(rows * DTYPE.itemsize)
+            elif length < rows:
+                f.write(np.full(rows - length, np.nan, dtype=DTYPE).tobytes())
+            f.write(np.array([value], dtype=DTYPE).tobytes())
+
+    def _load(self):
+        """返回 (时间戳, {货币代码: 汇率列})，文件变长时重新映射"""
+        with self._lock:
+            rows = self._rows()
+            if rows == self._mapped_rows:
+                return self._timestamps, self._columns
+            if rows == 0:
+                timestamps, columns = np.empty(0, dtype=DTYPE), {}
+            else:
+                timestamps = np.memmap(self._column_path(TIMESTAMP_COLUMN), dtype=DTYPE, mode='r', shape=(rows,))
+                columns = {}
+                for code in self.currencies:
+                    path = self._column_path(code)
+                    length = os.path.getsize(path) // DTYPE.itemsize if os.path.exists(path) else 0
+                    if length >= rows:
+                        columns[code] = np.memmap(path, dtype=DTYPE, mode='r', shape=(rows,))
+                    elif length:
+                        columns[code] = np.concatenate([np.full(rows - length, np.nan, dtype=DTYPE),
+                                                        np.fromfile(path, dtype=DTYPE)])
+            self._mapped_rows, self._timestamps, self._columns = rows, timestamps, columns
+            return timestamps, columns
+
+    def rates_at(self, codes, timestamps):
+        """
+        批量查询汇率：codes[i]在timestamps[i]时刻生效的汇率（该时刻之前最后一次记录的值）
+
+        参数:
+            codes: 货币代码数组
+            timestamps: Unix时间戳数组
+
+        返回:
+            numpy.ndarray: 1美元等于多少该货币；USD为1，没有记录时为NaN
+        """
+        codes = np.asarray(codes)
+        result = np.full(len(codes), np.nan)
+        result[codes == 'USD'] = 1.0
+        history, columns = self._load()
+        if len(history) == 0:
+            return result
+        rows = np.searchsorted(history, np.asarray(timestamps, dtype=np.float64), side='right') - 1
+        found = rows >= 0
+        for code, column in columns.items():
+            mask = found & (codes == code)
+            if mask.any():
+                result[mask] = column[rows[mask]]
+        return result
+
+    def stats(self):
+        """
+        获取历史统计信息
+
+        返回:
+            dict: 行数、时间范围、磁盘占用和本进程追加的行数
+        """
+        history, _ = self._load()
+        size = sum(
+            os.path.getsize(os.path.join(self.path, name))
+            for name in os.listdir(self.path) if name.endswith(".f8")
+        )
+        return {
+            "rows": int(len(history)),
+            "first": float(history[0]) if len(history) else None,
+            "last": float(history[-1]) if len(history) else None,
+            "bytes": size,
+            "appends": self.appends,
+        }
@@ -0,0 +1,146 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from services.layout_plan import layout_identity
+
+
+def file_identity(path):
+    """
+    计算文件的身份标识（绝对路径、大小和修改时间），文件变化后标识随之改变
+
+    参数:
+        path: 文件路径
+
+    返回:
+        str: 文件身份标识，文件不存在时返回路径本身
+    """
+    if not path:
+        return ""
+    try:
+        stat = os.stat(path)
+        return f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    except OSError:
+        return str(path)
+
+
+class RenderCache:
+    """
+    内容寻址的海报渲染结果缓存
+
+    以渲染参数、模板身份、字体身份和输出格式的哈希为键，缓存编码后的图片字节，
+    按总字节数做LRU淘汰。键同时用作HTTP强ETag。
+    """
+
+    def __init__(self, max_bytes=128 * 1024 * 1024):
+        """
+        初始化渲染缓存
+
+        参数:
+            max_bytes: 缓存的最大总字节数
+        """
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (data, filename, info)
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(params, template_path=None, font_path=None, output_format="png", layout=None):
+        """
+        计算渲染结果的内容地址
+
+        参数:
+            params: 渲染参数字典（recipient_name、offer_amount、team_name、team_name2等）
+            template_path: banner模板路径
+            font_path: 字体文件路径
+            output_format: 输出格式（包括编码参数）
+            layout: 排版文件路径或排版定义（字典），None表示默认排版
+
+        返回:
+            str: sha256十六进制摘要
+        """
+        payload = {
+            "params": params,
+            "template": file_identity(template_path),
+            "font": file_identity(font_path),
+            "format": output_format,
+            "layout": layout_identity(layout),
+        }
+        encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        获取缓存的渲染结果
+
+        返回:
+            (data, filename, info): 图片字节、下载文件名和编码信息，未命中时返回None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, data, filename, info=None):
+        """
+        存入渲染结果，超过字节预算时淘汰最久未使用的条目
+
+        参数:
+            key: 内容地址
+            data: 编码后的图片字节
+            filename: 下载文件名
+            info: 编码信息（格式、MIME类型、编码耗时等）
+        """
+        size = len(data)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= len(old[0])
+            self._entries[key] = (data, filename, info or {})
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (evicted, _, _) = self._entries.popitem(last=False)
+                self.current_bytes -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        """清空缓存，返回被移除的条目数"""
+        with self._lock:
+            removed = len(self._entries)
+            self._entries.clear()
+            self.current_bytes = 0
+            return removed
+
+    def stats(self):
+        """
+        获取缓存统计信息
+
+        返回:
+            dict: 条目数、字节数、命中/未命中/淘汰次数
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+# 进程级共享的渲染缓存，容量可通过环境变量调整
+render_cache = RenderCache(max_bytes=int(os.environ.get("RENDER_CACHE_MAX_BYTES", str(128 * 1024 * 1024))))
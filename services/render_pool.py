@@ -0,0 +1,271 @@
+import os
+import time
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+class RenderQueueFull(Exception):
+    """渲染队列已满，调用方应稍后重试"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Render queue is full, retry after {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+def preload_worker(banner_paths, font_path, font_sizes=(700, 200, 170), layouts=()):
+    """
+    工作进程启动时预加载banner模板和字体，并编译排版方案
+
+    参数:
+        banner_paths: 需要预加载的banner路径列表
+        font_path: 字体文件路径
+        font_sizes: 需要预加载的字体大小
+        layouts: 需要编译的排版 [(排版文件路径或排版定义, 默认字体路径), ...]
+    """
+    from services.template_cache import template_cache
+    from services.font_cache import font_registry
+    from services.font_fitting import get_font_metrics
+    from services.layout_plan import load_layout_plan
+
+    for banner_path in banner_paths:
+        try:
+            template_cache.get_template(banner_path)
+        except Exception as e:
+            print(f"预加载banner失败: {banner_path}, 错误: {e}")
+
+    if font_path:
+        try:
+            for font_size in font_sizes:
+                font_registry.get(font_path, font_size)
+            get_font_metrics(font_path)
+        except Exception as e:
+            print(f"预加载字体失败: {font_path}, 错误: {e}")
+
+    for layout, layout_font_path in layouts:
+        try:
+            load_layout_plan(layout, layout_font_path)
+        except Exception as e:
+            print(f"编译排版失败: {layout}, 错误: {e}")
+
+
+def _noop():
+    return os.getpid()
+
+
+def _run_job(fn, kwargs, submitted_at):
+    """在工作进程中执行渲染函数，并记录排队和执行耗时"""
+    started_at = time.time()
+    result = fn(**kwargs)
+    return {
+        "result": result,
+        "wait_ms": (started_at - submitted_at) * 1000,
+        "run_ms": (time.time() - started_at) * 1000,
+    }
+
+
+class RenderPool:
+    """
+    CPU密集型渲染的进程池
+
+    工作进程数默认等于CPU核数，启动时预加载banner和字体。提交队列有上限，
+    队列满时立即抛出RenderQueueFull，而不是让请求在socket上无限排队。
+    workers为0时在调用线程中直接渲染（用于调试或不支持多进程的环境）。
+    """
+
+    def __init__(self, workers=None, max_queue=None, preload_banners=(), preload_font=None,
+                 preload_font_sizes=(700, 200, 170), retry_after=2, start_method="spawn", preload_layouts=()):
+        """
+        初始化渲染进程池
+
+        参数:
+            workers: 工作进程数，None表示CPU核数，0表示不使用进程池
+            max_queue: 除正在执行的任务外最多排队的任务数，None表示工作进程数的2倍
+            preload_banners: 工作进程启动时预加载的banner路径
+            preload_font: 工作进程启动时预加载的字体路径
+            preload_font_sizes: 预加载的字体大小
+            retry_after: 队列满时建议客户端等待的秒数
+            start_method: 工作进程的启动方式（默认spawn，避免fork时复制持有锁的线程状态）
+            preload_layouts: 工作进程启动时编译的排版 [(排版, 默认字体路径), ...]
+        """
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.max_queue = self.workers * 2 if max_queue is None else max_queue
+        self.retry_after = retry_after
+        self._initargs = (tuple(preload_banners), preload_font, tuple(preload_font_sizes), tuple(preload_layouts))
+        self._start_method = start_method
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        # 同时在池中的任务（执行中+排队中）不超过 workers + max_queue
+        self._slots = threading.BoundedSemaphore(max(1, self.workers + self.max_queue))
+
+        self._stats_lock = threading.Lock()
+        self.in_flight = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+        self.total_run_ms = 0.0
+        self.restarts = 0
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context(self._start_method),
+                    initializer=preload_worker,
+                    initargs=self._initargs
+                )
+            return self._executor
+
+    def _discard_executor(self, executor):
+        """
+        丢弃损坏的进程池（工作进程异常退出后进程池不再接受任务）
+
+        返回:
+            bool: 是否丢弃了当前进程池；其他线程已丢弃或重建时返回False
+        """
+        with self._executor_lock:
+            if self._executor is not executor:
+                return False
+            self._executor = None
+        with self._stats_lock:
+            self.restarts += 1
+        print("渲染进程池已损坏（工作进程异常退出），正在重建")
+        executor.shutdown(wait=False)
+        return True
+
+    def _rebuild_executor(self, broken):
+        """丢弃损坏的进程池，创建新的进程池并预热所有工作进程"""
+        discarded = self._discard_executor(broken)
+        executor = self._get_executor()
+        if discarded:
+            for _ in range(self.workers):
+                executor.submit(_noop)
+        return executor
+
+    def _submit_job(self, fn, kwargs, submitted_at):
+        executor = self._get_executor()
+        try:
+            return executor, executor.submit(_run_job, fn, kwargs, submitted_at)
+        except BrokenProcessPool:
+            # 上一个任务导致工作进程崩溃后，进程池会拒绝所有新任务，重建后重新提交一次
+            executor = self._rebuild_executor(executor)
+            return executor, executor.submit(_run_job, fn, kwargs, submitted_at)
+
+    def start(self):
+        """
+        启动并预热所有工作进程（每个进程完成预加载后才返回）
+
+        返回:
+            list: 工作进程的pid
+        """
+        if self.workers == 0:
+            preload_worker(*self._initargs)
+            return []
+        executor = self._get_executor()
+        futures = [executor.submit(_noop) for _ in range(self.workers)]
+        return sorted(set(future.result() for future in futures))
+
+    def submit(self, fn, block=False, timeout=None, **kwargs):
+        """
+        提交渲染任务
+
+        参数:
+            fn: 可被pickle的模块级渲染函数
+            block: 队列满时是否等待空位
+            timeout: block为True时最长等待的秒数，None表示一直等待
+            **kwargs: 传给fn的参数
+
+        返回:
+            Future: 结果为fn的返回值；队列满时抛出RenderQueueFull
+        """
+        if not self._slots.acquire(blocking=block, timeout=timeout if block else None):
+            with self._stats_lock:
+                self.rejected += 1
+            raise RenderQueueFull(self.retry_after)
+
+        with self._stats_lock:
+            self.in_flight += 1
+            self.submitted += 1
+
+        result_future = Future()
+        submitted_at = time.time()
+
+        def finish(job_future, executor=None):
+            self._slots.release()
+            try:
+                job = job_future.result()
+            except BaseException as e:
+                if executor is not None and isinstance(e, BrokenProcessPool):
+                    # 任务执行中工作进程崩溃，立即重建并预热进程池，后续任务不会再被拒绝
+                    self._rebuild_executor(executor)
+                with self._stats_lock:
+                    self.in_flight -= 1
+                    self.failed += 1
+                result_future.set_exception(e)
+                return
+            with self._stats_lock:
+                self.in_flight -= 1
+                self.completed += 1
+                self.total_wait_ms += job["wait_ms"]
+                self.max_wait_ms = max(self.max_wait_ms, job["wait_ms"])
+                self.total_run_ms += job["run_ms"]
+            result_future.set_result(job["result"])
+
+        if self.workers == 0:
+            job_future = Future()
+            try:
+                job_future.set_result(_run_job(fn, kwargs, submitted_at))
+            except Exception as e:
+                job_future.set_exception(e)
+            finish(job_future)
+        else:
+            try:
+                executor, job_future = self._submit_job(fn, kwargs, submitted_at)
+            except Exception:
+                self._slots.release()
+                with self._stats_lock:
+                    self.in_flight -= 1
+                    self.failed += 1
+                raise
+            job_future.add_done_callback(lambda done: finish(done, executor))
+        return result_future
+
+    def run(self, fn, block=False, timeout=None, **kwargs):
+        """提交渲染任务并等待结果，参数同submit"""
+        return self.submit(fn, block=block, timeout=timeout, **kwargs).result()
+
+    def shutdown(self, wait=True):
+        """关闭进程池"""
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
+
+    def stats(self):
+        """
+        获取进程池统计信息
+
+        返回:
+            dict: 工作进程数、队列容量、当前队列深度、任务计数、进程池重建次数以及平均/最大排队耗时
+        """
+        with self._stats_lock:
+            finished = self.completed
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "in_flight": self.in_flight,
+                "queue_depth": max(0, self.in_flight - self.workers),
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "restarts": self.restarts,
+                "avg_wait_ms": round(self.total_wait_ms / finished, 2) if finished else 0.0,
+                "max_wait_ms": round(self.max_wait_ms, 2),
+                "avg_run_ms": round(self.total_run_ms / finished, 2) if finished else 0.0,
+            }
@@ -0,0 +1,174 @@
+import os
+import threading
+from collections import OrderedDict
+from PIL import Image
+
+# 缩放比例保留的小数位数：相差不到0.01的比例渲染结果相同，共用同一个缓存条目
+SCALE_DECIMALS = 2
+
+
+def normalize_scale(scale):
+    """
+    把缩放比例规整到两位小数（最小0.01），用于缓存键和渲染
+
+    参数:
+        scale: 缩放比例（0-1]
+
+    返回:
+        float: 规整后的缩放比例，不在(0, 1]范围内时抛出ValueError
+    """
+    try:
+        scale = float(scale)
+    except (TypeError, ValueError):
+        raise ValueError("scale must be a number") from None
+    if not 0 < scale <= 1:
+        raise ValueError("scale must be greater than 0 and at most 1")
+    return max(round(scale, SCALE_DECIMALS), 10 ** -SCALE_DECIMALS)
+
+
+class TemplateCache:
+    """
+    进程内的banner模板缓存
+
+    以 (路径, mtime) 为键缓存解码后的RGBA图像，避免每次请求都重新读取、
+    解码PNG并转换为RGBA。每次获取返回一个可以自由绘制的副本。
+    预览等场景使用的缩小版本也按（规整后的）缩放比例分别缓存。
+    缓存的总字节数有上限，超出时淘汰最久未使用的条目。
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        """
+        初始化模板缓存
+
+        参数:
+            max_bytes: 解码后图像的最大总字节数（至少保留最近使用的一个条目）
+        """
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (abs_path, scale) -> (mtime, Image)
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _size_of(img):
+        return img.width * img.height * len(img.getbands())
+
+    def _store_locked(self, key, mtime, img):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.current_bytes -= self._size_of(old[1])
+        self._entries[key] = (mtime, img)
+        self.current_bytes += self._size_of(img)
+        while self.current_bytes > self.max_bytes and len(self._entries) > 1:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.current_bytes -= self._size_of(evicted)
+            self.evictions += 1
+
+    @staticmethod
+    def _downscale(img, scale):
+        # 整数倍缩小时使用reduce()（盒式平均，速度最快），否则使用BOX重采样
+        factor = 1 / scale
+        if abs(factor - round(factor)) < 1e-9:
+            return img.reduce(int(round(factor)))
+        size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        return img.resize(size, Image.BOX)
+
+    def _load(self, abs_path, mtime, scale):
+        if scale == 1:
+            with Image.open(abs_path) as img:
+                decoded = img.convert('RGBA')
+            # 解码后立即加载像素，之后的copy()只是内存拷贝
+            decoded.load()
+        else:
+            # 缩小版本基于全尺寸缓存生成
+            decoded = self._downscale(self._get_locked(abs_path, mtime, 1), scale)
+        self._store_locked((abs_path, scale), mtime, decoded)
+        return decoded
+
+    def _get_locked(self, abs_path, mtime, scale):
+        entry = self._entries.get((abs_path, scale))
+        if entry is not None and entry[0] == mtime:
+            self._entries.move_to_end((abs_path, scale))
+            self.hits += 1
+            return entry[1]
+
+        # 文件不存在缓存中或已被修改，重新解码
+        self.misses += 1
+        return self._load(abs_path, mtime, scale)
+
+    def get_template(self, image_path, scale=1):
+        """
+        获取缓存中的模板图像（只读，不要直接在上面绘制）
+
+        参数:
+            image_path: 图片文件的路径
+            scale: 缩放比例（0-1]，如0.25表示1/4尺寸
+
+        返回:
+            Image: 解码后的RGBA图像
+        """
+        abs_path = os.path.abspath(image_path)
+        mtime = os.path.getmtime(abs_path)
+        scale = normalize_scale(scale)
+
+        with self._lock:
+            return self._get_locked(abs_path, mtime, scale)
+
+    def get(self, image_path, scale=1):
+        """
+        获取模板图像的副本，调用方可以在副本上自由绘制
+
+        参数:
+            image_path: 图片文件的路径
+            scale: 缩放比例（0-1]，如0.25表示1/4尺寸
+
+        返回:
+            Image: 解码后的RGBA图像副本
+        """
+        return self.get_template(image_path, scale).copy()
+
+    def invalidate(self, image_path=None):
+        """
+        使缓存失效
+
+        参数:
+            image_path: 要失效的图片路径，为None时清空全部缓存
+
+        返回:
+            int: 被移除的条目数
+        """
+        with self._lock:
+            if image_path is None:
+                removed = len(self._entries)
+                self._entries.clear()
+                self.current_bytes = 0
+                return removed
+
+            abs_path = os.path.abspath(image_path)
+            keys = [key for key in self._entries if key[0] == abs_path]
+            for key in keys:
+                self.current_bytes -= self._size_of(self._entries.pop(key)[1])
+            return len(keys)
+
+    def stats(self):
+        """
+        获取缓存统计信息
+
+        返回:
+            dict: 条目数、占用字节数、命中次数、未命中次数和淘汰次数
+        """
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+# 进程级共享的模板缓存
+template_cache = TemplateCache(max_bytes=int(os.environ.get("TEMPLATE_CACHE_MAX_BYTES", str(256 * 1024 * 1024))))
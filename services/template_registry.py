@@ -0,0 +1,264 @@
+import os
+import json
+import time
+import threading
+from services.image_generator import DEFAULT_FONT_PATH, get_image_size
+from services.template_cache import template_cache
+from services.layout_plan import load_layout_plan
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEMPLATES_DIR = os.path.join(BASE_DIR, "assets", "templates")
+# psd_exchangor的编译结果和生成的模板定义（与psd_exchangor.COMPILED_DIR一致）
+COMPILED_DIR = os.environ.get('COMPILED_TEMPLATES_DIR') or os.path.join(TEMPLATES_DIR, "compiled")
+IMAGES_DIR = os.path.join(BASE_DIR, "assets", "images")
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# 没有指定template_id时使用的模板
+DEFAULT_TEMPLATE_ID = os.environ.get('DEFAULT_TEMPLATE_ID', 'offer_banner')
+
+
+class TemplateNotFound(KeyError):
+    """请求的模板不存在"""
+
+
+class Template:
+    """一个海报模板：banner图片、字体和排版信息"""
+
+    def __init__(self, template_id, banner_path, font_path=None, name=None, layout=None, source=None,
+                 layout_path=None):
+        """
+        初始化模板
+
+        参数:
+            template_id: 模板ID
+            banner_path: banner图片路径
+            font_path: 字体文件路径，None表示使用默认字体
+            name: 显示名称
+            layout: 排版信息（字典），内联的排版定义或排版文件的内容
+            source: 模板定义文件路径，从assets/images自动发现的模板为None
+            layout_path: 排版信息来自单独的JSON文件（例如PSD编译结果）时的文件路径
+        """
+        self.id = template_id
+        self.banner_path = banner_path
+        self.font_path = font_path or DEFAULT_FONT_PATH
+        self.name = name or template_id
+        self.layout = layout or {}
+        self.source = source
+        self.layout_path = layout_path
+        self.width, self.height = get_image_size(banner_path) or (None, None)
+
+    @property
+    def render_layout(self):
+        """渲染使用的排版：排版文件路径或内联排版定义，没有时为None（使用默认排版）"""
+        return self.layout_path or (self.layout or None)
+
+    def files(self):
+        """模板依赖的文件（用于检查是否被修改）"""
+        return [path for path in (self.source, self.banner_path, self.font_path, self.layout_path) if path]
+
+    def to_dict(self):
+        """转换为可JSON序列化的字典"""
+        return {
+            "id": self.id,
+            "name": self.name,
+            "banner": os.path.relpath(self.banner_path, BASE_DIR),
+            "font": os.path.relpath(self.font_path, BASE_DIR),
+            "width": self.width,
+            "height": self.height,
+            "layout": self.layout,
+        }
+
+
+class TemplateRegistry:
+    """
+    模板注册表
+
+    启动时建立一次 模板ID -> Template 的索引，请求直接按ID查找，不再逐个探测路径或遍历
+    assets目录。模板来源：
+    - templates_dir中的模板定义（*.json），路径相对于定义文件：
+      {"id": "offer_banner", "name": "...", "banner": "../images/offer_banner.png",
+       "font": "../fonds/impact.ttf", "layout": {...}}
+      layout也可以是排版JSON文件的路径（layouts/下的排版文件或psd_exchangor的编译结果），
+      格式见services/layout_plan.py；没有layout的模板使用默认排版
+    - compiled_dir中psd_exchangor生成的模板定义，格式同上；ID与templates_dir中的重复时跳过
+    - images_dir顶层没有被模板定义引用的图片，以文件名（不含扩展名）为ID，使用默认字体
+
+    查找时最多每check_interval秒检查一次目录和模板文件的mtime，有变化时重新建立索引，
+    新增、修改或删除模板不需要重启。
+    """
+
+    def __init__(self, templates_dir=TEMPLATES_DIR, images_dir=IMAGES_DIR,
+                 default_id=DEFAULT_TEMPLATE_ID, check_interval=2.0, compiled_dir=COMPILED_DIR):
+        """
+        初始化模板注册表
+
+        参数:
+            templates_dir: 模板定义目录
+            images_dir: 自动发现banner图片的目录
+            compiled_dir: psd_exchangor生成的模板定义目录
+            default_id: 默认模板ID（不存在时使用ID排序后的第一个模板）
+            check_interval: 两次mtime检查之间的最短秒数，0表示每次查找都检查
+        """
+        self.templates_dir = templates_dir
+        self.images_dir = images_dir
+        self.compiled_dir = compiled_dir
+        self.default_id = default_id
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._templates = {}
+        self._signature = None
+        self._checked_at = 0.0
+        self.reloads = 0
+        self.errors = {}
+        self.reload()
+
+    def _signature_of(self, templates):
+        # 目录本身的mtime反映文件的增删，模板文件的mtime反映内容修改
+        signature = []
+        for path in [self.templates_dir, self.compiled_dir, self.images_dir] + [
+            path for template in templates.values() for path in template.files()
+        ]:
+            try:
+                signature.append((path, os.stat(path).st_mtime_ns))
+            except OSError:
+                signature.append((path, None))
+        return tuple(signature)
+
+    @staticmethod
+    def _list_files(directory, extensions):
+        try:
+            with os.scandir(directory) as it:
+                return sorted(entry.path for entry in it
+                              if entry.is_file() and entry.name.lower().endswith(extensions))
+        except OSError:
+            return []
+
+    def _load_manifest(self, path):
+        with open(path, encoding='utf-8') as f:
+            spec = json.load(f)
+        base = os.path.dirname(path)
+        template_id = spec.get('id') or os.path.splitext(os.path.basename(path))[0]
+        if not spec.get('banner'):
+            raise ValueError("'banner' is required")
+        banner_path = os.path.normpath(os.path.join(base, spec['banner']))
+        if not os.path.exists(banner_path):
+            raise ValueError(f"banner not found: {banner_path}")
+        font_path = os.path.normpath(os.path.join(base, spec['font'])) if spec.get('font') else None
+        if font_path and not os.path.exists(font_path):
+            raise ValueError(f"font not found: {font_path}")
+        layout, layout_path = spec.get('layout'), None
+        if isinstance(layout, str):
+            # 排版信息在单独的文件中（psd_exchangor生成的layout.json）
+            layout_path = os.path.normpath(os.path.join(base, layout))
+            with open(layout_path, encoding='utf-8') as f:
+                layout = json.load(f)
+        template = Template(template_id, banner_path, font_path, spec.get('name'), layout,
+                            source=path, layout_path=layout_path)
+        # 加载时编译排版方案，排版有错误的模板和其他错误一样被跳过
+        if template.render_layout is not None:
+            load_layout_plan(template.render_layout, template.font_path)
+        return template
+
+    def _build(self):
+        templates, errors = {}, {}
+        manifests = self._list_files(self.templates_dir, ('.json',))
+        if os.path.abspath(self.compiled_dir) != os.path.abspath(self.templates_dir):
+            manifests += self._list_files(self.compiled_dir, ('.json',))
+        for path in manifests:
+            try:
+                template = self._load_manifest(path)
+                if template.id in templates:
+                    raise ValueError(f"duplicate template id {template.id!r} (already defined in "
+                                     f"{templates[template.id].source})")
+            except (OSError, ValueError) as e:
+                # 有问题的模板定义只跳过该模板
+                errors[os.path.basename(path)] = str(e)
+                print(f"加载模板失败: {path}, 错误: {e}")
+                continue
+            templates[template.id] = template
+
+        referenced = {template.banner_path for template in templates.values()}
+        for path in self._list_files(self.images_dir, IMAGE_EXTENSIONS):
+            template_id = os.path.splitext(os.path.basename(path))[0]
+            if path not in referenced and template_id not in templates:
+                templates[template_id] = Template(template_id, path)
+        return templates, errors
+
+    def reload(self):
+        """重新建立模板索引，返回模板数"""
+        templates, errors = self._build()
+        signature = self._signature_of(templates)
+        with self._lock:
+            old, self._templates = self._templates, templates
+            self._signature = signature
+            self._checked_at = time.time()
+            self.errors = errors
+            self.reloads += 1
+        # 释放已删除或更换了banner的模板占用的解码缓存
+        current = {template.banner_path for template in templates.values()}
+        for template in old.values():
+            if template.banner_path not in current:
+                template_cache.invalidate(template.banner_path)
+        print(f"模板注册表已加载: {', '.join(sorted(templates)) or '无模板'}")
+        return len(templates)
+
+    def _reload_if_changed(self):
+        now = time.time()
+        with self._lock:
+            if now - self._checked_at < self.check_interval:
+                return
+            self._checked_at = now
+            templates, signature = self._templates, self._signature
+        if self._signature_of(templates) != signature:
+            self.reload()
+
+    def get(self, template_id=None):
+        """
+        按ID获取模板
+
+        参数:
+            template_id: 模板ID，None表示默认模板
+
+        返回:
+            Template
+
+        异常:
+            TemplateNotFound: 模板不存在（或没有任何模板）
+        """
+        self._reload_if_changed()
+        with self._lock:
+            if template_id is None:
+                if self.default_id in self._templates:
+                    return self._templates[self.default_id]
+                if self._templates:
+                    return self._templates[min(self._templates)]
+                raise TemplateNotFound("No templates available")
+            try:
+                return self._templates[template_id]
+            except KeyError:
+                raise TemplateNotFound(f"Unknown template_id: {template_id}") from None
+
+    def all(self):
+        """按ID排序返回所有模板"""
+        self._reload_if_changed()
+        with self._lock:
+            return [self._templates[template_id] for template_id in sorted(self._templates)]
+
+    def stats(self):
+        """
+        获取注册表状态
+
+        返回:
+            dict: 模板ID列表、默认模板、重新加载次数和加载失败的模板定义
+        """
+        with self._lock:
+            return {
+                "templates": sorted(self._templates),
+                "default": self.default_id if self.default_id in self._templates else min(self._templates, default=None),
+                "reloads": self.reloads,
+                "errors": dict(self.errors),
+            }
+
+
+# 全局模板注册表，导入时建立索引
+template_registry = TemplateRegistry()
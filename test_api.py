@@ -5,6 +5,7 @@ Test script for the Post Auto Editor API
 import requests
 import json
 import os
+import time
 import argparse
 
 def test_exchange_rates(base_url):
@@ -84,16 +85,59 @@ def test_cleanup(base_url):
     else:
         print(f"Error: {response.status_code} - {response.text}")
 
+def test_rates_offline():
+    """Test batched and pooled exchange-rate fetching against a local stub upstream"""
+    from services.exchange_rate import ExchangeRateService
+    from utils.stub_rate_server import StubRateServer
+
+    print("\n=== Testing Exchange Rate Fetching (offline stub) ===")
+    ok = True
+
+    with StubRateServer() as stub:
+        service = ExchangeRateService(base_url=stub.url)
+        rates = service.fetch_all_rates()
+        service.fetch_all_rates()
+        print(f"\nBatched: {len(rates)} rates, {stub.requests} requests over {stub.connections} connection(s)")
+        if len(rates) != len(service.currencies) or stub.requests != 2 or stub.connections != 1:
+            print("Error: expected one request per refresh over a single kept-alive connection")
+            ok = False
+
+    with StubRateServer(batch=False, delay=0.1) as stub:
+        service = ExchangeRateService(base_url=stub.url, batch_retry_after=1)
+        service.fetch_all_rates()
+        stub.reset_counters()
+        rates = service.fetch_all_rates()
+        print(f"Parallel fallback: {len(rates)} rates, {stub.requests} requests over {stub.connections} new connection(s)")
+        if len(rates) != len(service.currencies) or stub.requests != len(service.currencies) or stub.connections != 0:
+            print("Error: expected one request per currency on pooled connections")
+            ok = False
+
+        # the upstream starts accepting multi-symbol requests again: re-probed after the cooldown
+        stub.batch = True
+        time.sleep(1)
+        stub.reset_counters()
+        rates = service.fetch_all_rates()
+        print(f"Batch re-probe: {len(rates)} rates, {stub.requests} request(s)")
+        if len(rates) != len(service.currencies) or stub.requests != 1:
+            print("Error: expected batching to resume after batch_retry_after")
+            ok = False
+
+    print("Success!" if ok else "Rate fetching test failed.")
+
 def main():
     """Main function"""
     parser = argparse.ArgumentParser(description="Test the Post Auto Editor API")
     parser.add_argument("--url", default="http://localhost:5000", help="Base URL of the API")
     parser.add_argument("--output", default="test_poster.png", help="Output file for the generated poster")
-    parser.add_argument("--test", choices=["all", "exchange", "poster", "cleanup"], default="all", 
-                        help="Which test to run")
+    parser.add_argument("--test", choices=["all", "exchange", "poster", "cleanup", "rates-offline"], default="all", 
+                        help="Which test to run (rates-offline runs against a local stub upstream, no server needed)")
     
     args = parser.parse_args()
     
+    if args.test == "rates-offline":
+        test_rates_offline()
+        return
+    
     print(f"Testing API at {args.url}")
     
     if args.test in ["all", "exchange"]:
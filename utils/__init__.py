@@ -1,3 +1,5 @@
 from .file_handler import FileHandler
+from .zip_stream import ZipStreamWriter
+from .stub_rate_server import StubRateServer
 
-__all__ = ['FileHandler'] 
\ No newline at end of file
+__all__ = ['FileHandler', 'ZipStreamWriter', 'StubRateServer'] 
\ No newline at end of file
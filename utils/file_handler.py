@@ -1,21 +1,184 @@
 import os
+import time
 import uuid
 import shutil
-from typing import Optional, Tuple
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
 from werkzeug.utils import secure_filename
 
 class FileHandler:
-    """Utility class for handling file operations in the application"""
+    """
+    Utility class for handling file operations in the application
+
+    The files under base_dir are managed as a size-bounded cache: the directory is
+    scanned once with os.scandir, every file written, read (touch) or deleted through
+    the handler keeps the byte count up to date, and when max_bytes is exceeded the
+    least recently accessed files are evicted. Files deleted elsewhere are reported
+    with forget().
+    """
     
-    def __init__(self, base_dir: str):
+    def __init__(self, base_dir: str, max_bytes: Optional[int] = None):
         """
         Initialize the FileHandler
         
         Args:
             base_dir: Base directory for storing files
+            max_bytes: Byte budget for base_dir (None means unbounded)
         """
-        self.base_dir = base_dir
+        # absolute, so paths reported by other components (e.g. the expiry scheduler) match
+        self.base_dir = os.path.abspath(base_dir)
+        self.max_bytes = max_bytes
         os.makedirs(base_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        # path -> size in bytes, ordered from least to most recently accessed
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._bytes = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+        self.rescans = 0
+        self.rescan()
+    
+    def _scan(self, directory: str, found: Dict[str, Tuple[float, int]]) -> None:
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    self._scan(entry.path, found)
+                elif entry.is_file(follow_symlinks=False):
+                    stat = entry.stat(follow_symlinks=False)
+                    found[entry.path] = (max(stat.st_atime, stat.st_mtime), stat.st_size)
+    
+    def rescan(self) -> None:
+        """Rebuild the accounting from disk (e.g. after other processes wrote files)"""
+        found: Dict[str, Tuple[float, int]] = {}
+        self._scan(self.base_dir, found)
+        with self._lock:
+            self._entries = OrderedDict(
+                (path, size) for path, (_, size) in sorted(found.items(), key=lambda item: item[1][0])
+            )
+            self._bytes = sum(self._entries.values())
+            self.rescans += 1
+        self._evict()
+    
+    def _record(self, file_path: str, size: int) -> None:
+        with self._lock:
+            self._bytes += size - self._entries.pop(file_path, 0)
+            self._entries[file_path] = size
+    
+    def _forget(self, file_path: str) -> None:
+        with self._lock:
+            self._bytes -= self._entries.pop(file_path, 0)
+    
+    def _evict(self, keep: Optional[str] = None) -> int:
+        """Remove least recently accessed files until the byte budget is met"""
+        evicted = 0
+        while True:
+            with self._lock:
+                if self.max_bytes is None or self._bytes <= self.max_bytes or not self._entries:
+                    return evicted
+                file_path, size = next(iter(self._entries.items()))
+                if file_path == keep:
+                    if len(self._entries) == 1:
+                        return evicted
+                    # the file just written stays even if it alone exceeds the budget
+                    self._entries.move_to_end(file_path)
+                    continue
+                del self._entries[file_path]
+                self._bytes -= size
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                # already removed, e.g. by another worker or the expiry scheduler
+                continue
+            except OSError as e:
+                print(f"Error evicting {file_path}: {e}")
+                continue
+            evicted += 1
+            with self._lock:
+                self.evictions += 1
+                self.evicted_bytes += size
+    
+    def add_file(self, file_path: str) -> None:
+        """
+        Register a file written into base_dir by other code and enforce the budget
+        
+        Args:
+            file_path: Path of the new file
+        """
+        self._record(file_path, os.path.getsize(file_path))
+        self._evict(keep=file_path)
+    
+    def write_file(self, filename: str, data: bytes, subfolder: Optional[str] = None) -> str:
+        """
+        Write bytes to a file in base_dir and enforce the budget
+        
+        Args:
+            filename: Name of the file
+            data: File contents
+            subfolder: Optional subfolder within base_dir
+            
+        Returns:
+            The path of the written file
+        """
+        target_dir = self.base_dir
+        if subfolder:
+            target_dir = os.path.join(self.base_dir, subfolder)
+            os.makedirs(target_dir, exist_ok=True)
+        file_path = os.path.join(target_dir, filename)
+        with open(file_path, 'wb') as f:
+            f.write(data)
+        self._record(file_path, len(data))
+        self._evict(keep=file_path)
+        return file_path
+    
+    def touch(self, file_path: str) -> bool:
+        """
+        Mark a file as accessed so it is evicted last
+        
+        Args:
+            file_path: Path of the file
+            
+        Returns:
+            True if the file is managed by the handler
+        """
+        with self._lock:
+            if file_path not in self._entries:
+                return False
+            self._entries.move_to_end(file_path)
+        try:
+            # keep the access time on disk too, so the order survives a restart
+            os.utime(file_path, (time.time(), os.stat(file_path).st_mtime))
+        except OSError:
+            self._forget(file_path)
+            return False
+        return True
+    
+    def forget(self, file_path: str) -> None:
+        """
+        Drop a file deleted by other code (e.g. the expiry scheduler) from the byte count
+        
+        Args:
+            file_path: Absolute path of the deleted file
+        """
+        self._forget(file_path)
+    
+    def stats(self) -> Dict:
+        """
+        Get statistics of the managed output directory
+        
+        Returns:
+            Dictionary with bytes, entries, budget and eviction counters
+        """
+        with self._lock:
+            return {
+                "directory": self.base_dir,
+                "bytes": self._bytes,
+                "entries": len(self._entries),
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+                "evicted_bytes": self.evicted_bytes,
+                "rescans": self.rescans,
+            }
     
     def save_uploaded_file(self, file, subfolder: Optional[str] = None) -> Tuple[bool, str]:
         """
@@ -45,6 +208,7 @@ class FileHandler:
             # Save the file
             file_path = os.path.join(target_dir, filename)
             file.save(file_path)
+            self.add_file(file_path)
             
             return True, file_path
             
@@ -66,6 +230,7 @@ class FileHandler:
                 return False, f"File not found: {file_path}"
                 
             os.remove(file_path)
+            self._forget(file_path)
             return True, f"File deleted: {file_path}"
             
         except Exception as e:
@@ -82,8 +247,6 @@ class FileHandler:
         Returns:
             Tuple of (number_of_files_deleted, message)
         """
-        import time
-        
         try:
             target_dir = self.base_dir
             if subfolder:
@@ -92,24 +255,24 @@ class FileHandler:
             if not os.path.exists(target_dir):
                 return 0, f"Directory not found: {target_dir}"
                 
-            now = time.time()
-            max_age_seconds = max_age_hours * 3600
+            cutoff = time.time() - max_age_hours * 3600
             deleted_count = 0
             
-            for filename in os.listdir(target_dir):
-                file_path = os.path.join(target_dir, filename)
-                
-                # Skip directories
-                if os.path.isdir(file_path):
-                    continue
-                    
-                # Check file age
-                file_age = now - os.path.getmtime(file_path)
-                if file_age > max_age_seconds:
-                    os.remove(file_path)
-                    deleted_count += 1
-                    
+            with os.scandir(target_dir) as it:
+                for entry in it:
+                    # Skip directories
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+                        
+                    # Check file age
+                    if entry.stat(follow_symlinks=False).st_mtime < cutoff:
+                        os.remove(entry.path)
+                        self._forget(entry.path)
+                        deleted_count += 1
+            
+            # pick up files written by other processes since the last scan
+            self.rescan()
             return deleted_count, f"Deleted {deleted_count} old files from {target_dir}"
             
         except Exception as e:
-            return 0, f"Error cleaning old files: {str(e)}" 
\ No newline at end of file
+            return 0, f"Error cleaning old files: {str(e)}"
\ No newline at end of file
@@ -0,0 +1,124 @@
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import urlparse, parse_qs
+
+DEFAULT_STUB_RATES = {
+    'CNY': 7.2345,
+    'EUR': 0.9123,
+    'GBP': 0.7890,
+    'JPY': 149.85,
+    'CAD': 1.3567,
+    'AUD': 1.5234,
+    'INR': 83.12,
+}
+
+
+class StubRateServer:
+    """
+    Local stand-in for the quotes.csv exchange-rate upstream
+
+    Answers `?s=USDCNY=X` (or several comma-separated symbols) with one CSV line per
+    symbol, keeps HTTP/1.1 connections alive, and counts requests, connections and
+    symbols so tests can check batching and connection reuse without network access.
+    """
+
+    def __init__(self, rates: Optional[Dict[str, float]] = None, batch: bool = True,
+                 delay: float = 0.0, host: str = "127.0.0.1", port: int = 0):
+        """
+        Initialize the stub server
+
+        Args:
+            rates: Rate per currency code (1 USD = rate), defaults to DEFAULT_STUB_RATES
+            batch: Whether multi-symbol requests are accepted (False answers them with 400)
+            delay: Seconds to wait before answering each request
+            host: Interface to bind
+            port: Port to bind (0 picks a free port)
+        """
+        self.rates = dict(DEFAULT_STUB_RATES if rates is None else rates)
+        self.batch = batch
+        self.delay = delay
+        self.requests = 0
+        self.connections = 0
+        self.symbols = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """Base URL to pass to ExchangeRateService"""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/d/quotes.csv"
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with stub._lock:
+                    stub.connections += 1
+
+            def do_GET(self):
+                symbols = []
+                for value in parse_qs(urlparse(self.path).query).get('s', []):
+                    symbols.extend(symbol for symbol in value.replace('+', ',').split(',') if symbol)
+                with stub._lock:
+                    stub.requests += 1
+                    stub.symbols += len(symbols)
+                if stub.delay:
+                    time.sleep(stub.delay)
+
+                if not symbols or (len(symbols) > 1 and not stub.batch):
+                    self._reply(400, "bad request")
+                    return
+                lines = []
+                for symbol in symbols:
+                    code = symbol[3:6]
+                    rate = stub.rates.get(code, "N/A")
+                    lines.append(f'"{symbol}",{rate},"1/1/2025","4:00pm"')
+                self._reply(200, "\n".join(lines) + "\n")
+
+            def _reply(self, status, body):
+                data = body.encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "text/csv")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                try:
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    # the client timed out and closed the connection
+                    self.close_connection = True
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> "StubRateServer":
+        """Serve in a background thread"""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop serving and close the socket"""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_counters(self) -> None:
+        """Reset the request, connection and symbol counters"""
+        with self._lock:
+            self.requests = self.connections = self.symbols = 0
+
+    def __enter__(self) -> "StubRateServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
@@ -0,0 +1,57 @@
+import json
+import zipfile
+from typing import Iterator, List
+
+
+class _ChunkSink:
+    """只支持写入的输出流，写入的数据暂存为分块，由ZipStreamWriter取走"""
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+class ZipStreamWriter:
+    """
+    Incrementally build a ZIP archive and hand out its bytes as they are produced
+
+    The underlying stream is not seekable, so zipfile writes data descriptors after
+    each member and nothing but the member currently being added is kept in memory.
+    """
+
+    def __init__(self, compression: int = zipfile.ZIP_STORED):
+        """
+        Initialize the writer
+
+        Args:
+            compression: zipfile compression method (images are already compressed,
+                         so ZIP_STORED is the default)
+        """
+        self._sink = _ChunkSink()
+        self._archive = zipfile.ZipFile(self._sink, 'w', compression=compression)
+
+    def add(self, filename: str, data: bytes) -> None:
+        """Add a member to the archive"""
+        self._archive.writestr(filename, data)
+
+    def add_json(self, filename: str, payload) -> None:
+        """Add a JSON document to the archive"""
+        self.add(filename, json.dumps(payload, ensure_ascii=False, indent=2).encode('utf-8'))
+
+    def drain(self) -> Iterator[bytes]:
+        """Yield (and forget) the bytes produced since the last call"""
+        chunks, self._sink.chunks = self._sink.chunks, []
+        for chunk in chunks:
+            if chunk:
+                yield chunk
+
+    def close(self) -> Iterator[bytes]:
+        """Write the central directory and yield the remaining bytes"""
+        self._archive.close()
+        return self.drain()